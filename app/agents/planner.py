@@ -1,37 +1,94 @@
 import re
 from datetime import datetime
 
+# References back to the document discussed earlier in the session: a pronoun object ("Approve it",
+# "what about that?") or "that one"/"the same invoice". Bare "this"/"that" only count at the end of
+# the question, so "invoices that are overdue" and "flagged this month" are not follow-ups. Matched
+# against the original text: "it"/"It" is a pronoun, "IT" is the department
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b([Ii]ts?|(?i:(?:this|that|the same|the previous|the last|last) (?:one|invoice|po|purchase order)))\b"
+    r"|\b(?i:this|that)\s*[?.!]*$"
+)
+# Questions about sets of documents or a department carry their own subject, whatever pronouns they contain
+COLLECTION_PATTERN = re.compile(r"\b(invoices|pos|purchase orders|all|every|which|department|dept)\b")
+# Counting / summing questions are answered from materialized aggregates
+AGGREGATE_PATTERN = re.compile(
+    r"\b(how many|count|number of|total|sum of|rate|percentage|(by|per) (vendor|department|status|month))\b"
+)
+# Questions about statistically unusual amounts are answered from the anomaly scores
+ANOMALY_PATTERN = re.compile(r"\b(unusual|anomal\w*|outliers?|abnormal|suspicious amounts?)\b")
+# Approval changes state durably, so only an explicit command ("Approve it", "Please approve INV-1023")
+# counts; questions and negations ("Should I approve it?", "Don't approve it yet") never do
+APPROVE_COMMAND_PATTERN = re.compile(r"^\s*(?:please\s+)?approve\b")
+
+
+def is_approval_command(user_query: str) -> bool:
+    """Whether the query is an imperative request to approve, not a question about approval"""
+    return bool(APPROVE_COMMAND_PATTERN.match(user_query.lower())) and "?" not in user_query
+
 class QueryPlanner:
     def __init__(self):
         # NO OPENAI - pure rule-based planning
         pass
         
-    def plan_query(self, user_query: str) -> dict:
+    def plan_query(self, user_query: str, session_context: dict = None) -> dict:
         """Analyze user query and determine what actions to take"""
         
         # Extract invoice ID if present
         invoice_match = re.search(r'INV-(\d+)', user_query.upper())
         invoice_id = invoice_match.group(0) if invoice_match else None
+        po_match = re.search(r'PO-(\d+)', user_query.upper())
+        po_number = po_match.group(0) if po_match else None
         
         # Simple rule-based planning
         plan = {
             "query": user_query,
             "invoice_id": invoice_id,
+            "po_number": po_number,
+            "follow_up": False,
             "actions": [],
             "timestamp": datetime.now().isoformat(),
             "reasoning": ""
         }
         
-        if "flagged" in user_query.lower() or "flag" in user_query.lower():
-            plan["actions"].append("retrieve_invoice")
-            if invoice_id:
-                plan["actions"].append("retrieve_matching_po")
+        # Follow-ups ("Approve it", "Why was it flagged?") reuse the session's context; a question
+        # naming its own subject or intent (ids, sets of documents, aggregates, anomalies) is not one
+        text = user_query.lower()
+        if (session_context and not invoice_id and not po_number
+                and session_context.get("last_invoice_id")
+                and FOLLOW_UP_PATTERN.search(user_query)
+                and not COLLECTION_PATTERN.search(text)
+                and not AGGREGATE_PATTERN.search(text)
+                and not ANOMALY_PATTERN.search(text)):
+            plan["follow_up"] = True
+            plan["invoice_id"] = session_context["last_invoice_id"]
+            plan["po_number"] = session_context.get("last_po_number")
+            invoice_id = plan["invoice_id"]
+            if not is_approval_command(user_query):
+                plan["actions"].append("use_session_context")
+        
+        if not plan["follow_up"] and not invoice_id and not po_number and AGGREGATE_PATTERN.search(user_query.lower()):
+            plan["actions"].append("aggregate")
+            plan["reasoning"] = "Aggregate question answered from materialized counts and sums"
+            
+        elif not plan["follow_up"] and not invoice_id and not po_number and ANOMALY_PATTERN.search(user_query.lower()):
+            plan["actions"].append("list_anomalies")
+            plan["reasoning"] = "Invoices whose amounts deviate from their vendor's history or usual PO variance"
+            
+        elif "flagged" in user_query.lower() or "flag" in user_query.lower():
+            if not plan["follow_up"]:
+                plan["actions"].append("retrieve_invoice")
+                if invoice_id:
+                    plan["actions"].append("retrieve_matching_po")
             plan["actions"].append("explain_flagging")
             plan["reasoning"] = f"User asking about flagged invoice {invoice_id}"
             
-        elif "approve" in user_query.lower():
+        elif is_approval_command(user_query):
             plan["actions"].append("approve_invoice")
-            plan["reasoning"] = "User requesting invoice approval"
+            plan["reasoning"] = f"User requesting approval of invoice {invoice_id}" if invoice_id else "User requesting invoice approval"
+            
+        elif plan["follow_up"]:
+            plan["reasoning"] = f"Follow-up about invoice {invoice_id} from this session"
             
         else:
             plan["actions"].append("general_search")
@@ -0,0 +1,95 @@
+import re
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from app.data.vendor_index import normalize_vendor
+
+STATUS_WORDS = ("flagged", "pending", "approved", "rejected", "open", "closed", "partially_received")
+
+DEFAULT_WEIGHTS = {
+    "retrieval": 1.0,   # first-phase rank (1 / (rank + 1))
+    "id_match": 3.0,    # document id / linked PO number named in the query
+    "vendor": 1.0,      # document vendor named in the query
+    "status": 0.75,     # document status named in the query
+    "amount": 0.5,      # invoice amount close to its linked PO amount
+}
+
+
+class StructuredReranker:
+    """
+    Second retrieval phase: re-orders an over-fetched candidate set using
+    structured signals (ID match, vendor match, status, amount proximity to
+    the linked PO). Candidates are scored in vectorized chunks, best first-phase
+    ranks first, and scoring stops when the time budget runs out; whatever was
+    not scored keeps its first-phase order behind the scored candidates.
+    """
+
+    def __init__(self, po_records: Dict[str, Dict] = None, weights: Dict[str, float] = None,
+                 vendors=None, chunk_size: int = 32, vendor_resolver=None):
+        self.po_records = po_records if po_records is not None else {}
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.vendors = vendors or (lambda: ())  # -> iterable of known canonical vendor names
+        self.vendor_resolver = vendor_resolver  # text -> canonical vendor names mentioned (fuzzy), if available
+        self.chunk_size = chunk_size
+
+    def rerank(self, query: str, docs: list, k: int = 5, budget_ms: Optional[float] = None) -> list:
+        """Return the top-k documents after structured re-ranking within budget_ms"""
+        if len(docs) <= 1:
+            return docs[:k]
+        deadline = time.perf_counter() + budget_ms / 1000 if budget_ms is not None else None
+        signals = self._query_signals(query)
+
+        scores = np.full(len(docs), -np.inf)
+        scored = 0
+        for start in range(0, len(docs), self.chunk_size):
+            if deadline is not None and start and time.perf_counter() >= deadline:
+                break
+            chunk = docs[start:start + self.chunk_size]
+            scores[start:start + len(chunk)] = self._score(chunk, start, signals)
+            scored = start + len(chunk)
+
+        # Stable sort keeps first-phase order among ties and for unscored candidates
+        order = np.argsort(-scores[:scored], kind="stable")
+        ranked = [docs[i] for i in order] + docs[scored:]
+        return ranked[:k]
+
+    def _score(self, chunk: list, offset: int, signals: Dict) -> np.ndarray:
+        w = self.weights
+        metadata = [doc.metadata for doc in chunk]
+        ids = [str(m.get("id", "")).upper() for m in metadata]
+        po_numbers = [str(m.get("po_number", "")).upper() for m in metadata]
+        vendors = [normalize_vendor(m.get("vendor", "")) for m in metadata]
+        statuses = [str(m.get("status", "")).lower() for m in metadata]
+        amounts = np.array([float(m.get("amount") or 0) for m in metadata])
+        po_amounts = np.array([
+            float(self.po_records.get(po, {}).get("total_amount") or 0) if m.get("type") == "invoice" else 0.0
+            for m, po in zip(metadata, po_numbers)
+        ])
+
+        retrieval = 1.0 / (np.arange(offset, offset + len(chunk)) + 1.0)
+        id_match = np.array([
+            doc_id in signals["ids"] or (po != "" and po in signals["ids"]) for doc_id, po in zip(ids, po_numbers)
+        ], dtype=float)
+        vendor_match = np.array([v in signals["vendors"] for v in vendors], dtype=float)
+        status_match = np.array([s in signals["statuses"] for s in statuses], dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            proximity = np.where(po_amounts > 0, np.exp(-np.abs(amounts - po_amounts) / po_amounts), 0.0)
+
+        return (
+            w["retrieval"] * retrieval
+            + w["id_match"] * id_match
+            + w["vendor"] * vendor_match
+            + w["status"] * status_match
+            + w["amount"] * proximity
+        )
+
+    def _query_signals(self, query: str) -> Dict:
+        text = query.lower()
+        return {
+            "ids": {match.upper() for match in re.findall(r"\b(?:inv|po)-\d+\b", text)},
+            "vendors": (set(self.vendor_resolver(query)) if self.vendor_resolver else
+                        {v for v in self.vendors() if v and re.search(rf"\b{re.escape(v)}\b", text)}),
+            "statuses": {s for s in STATUS_WORDS if re.search(rf"\b{s.replace('_', '[ _]')}\b", text)},
+        }
@@ -0,0 +1,184 @@
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, Any, List, Optional
+
+from app.agents.verifier import result_verifier
+from app.data.fx import fx_rates
+from app.utils.profiler import profiler
+from app.data.verification_store import VerificationStore, record_version
+
+
+class VerificationScheduler:
+    """
+    Keeps invoice/PO verification verdicts precomputed.
+
+    The vector store manager reports every ingested or changed record; the
+    affected invoices (the invoice itself, or every invoice joined to a
+    changed PO through po_number) are marked dirty, and a background thread
+    re-verifies dirty invoices in batches. Queries read the stored verdicts,
+    so verification is paid once per change instead of once per question.
+    """
+
+    def __init__(self, vector_store, store: VerificationStore = None, batch_size: int = 100,
+                 interval_seconds: float = 2.0, verifier=None):
+        self.name = "VerificationScheduler"
+        self.vector_store = vector_store
+        self.store = store or VerificationStore()
+        self.verifier = verifier or result_verifier
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self._generation = defaultdict(int)  # invoice id -> change counter, guards against lost updates
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        vector_store.add_change_listener(self.on_records_changed)
+
+    def start(self):
+        """Start the background re-verification thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def on_records_changed(self, doc_type: str, records: List[Dict[str, Any]]):
+        """Mark the invoices affected by changed invoices/POs as dirty"""
+        if doc_type == "invoice":
+            invoice_ids = [record["invoice_id"] for record in records]
+        else:
+            invoice_ids = []
+            for record in records:
+                invoice_ids.extend(self.vector_store.invoices_by_po.get(record["po_number"], ()))
+
+        # Skip invoices whose stored verdict already matches the current record versions
+        stored = self.store.versions(invoice_ids)
+        dirty = []
+        for invoice_id in invoice_ids:
+            invoice, po = self._pair(invoice_id)
+            versions = stored.get(invoice_id)
+            if versions and not versions[2] and versions[:2] == (record_version(invoice), record_version(po)):
+                continue
+            dirty.append(invoice_id)
+
+        if dirty:
+            with self._lock:
+                for invoice_id in dirty:
+                    self._generation[invoice_id] += 1
+                self.store.mark_dirty(dirty)
+            self._wake.set()
+
+    def run_pending(self, max_batches: int = None) -> int:
+        """Re-verify dirty invoices batch by batch; returns how many were verified"""
+        verified = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            invoice_ids = self.store.dirty_ids(self.batch_size)
+            if not invoice_ids:
+                break
+            done = self._verify_batch(invoice_ids)
+            if not done:
+                break  # everything in the batch changed meanwhile; retry on the next wake-up
+            verified += done
+            batches += 1
+        return verified
+
+    def _verify_batch(self, invoice_ids: List[str]) -> int:
+        # PROFILE_SAMPLE_RATE also covers background verification batches
+        with profiler.profile("verify_batch", enabled=profiler.should_profile(), batch_size=len(invoice_ids)):
+            return self._verify_batch_unprofiled(invoice_ids)
+
+    def _verify_batch_unprofiled(self, invoice_ids: List[str]) -> int:
+        with self._lock:
+            generations = {invoice_id: self._generation[invoice_id] for invoice_id in invoice_ids}
+
+        rows = []
+        missing = []
+        pairs = {invoice_id: self._pair(invoice_id) for invoice_id in invoice_ids}
+        # One concurrent, cached batch of LLM analyses instead of one call per pair
+        prefetch = getattr(self.verifier, "prefetch_analyses", None)
+        if prefetch:
+            prefetch([pair for pair in pairs.values() if pair[0] is not None])
+        normalized = self._normalized_amounts(pairs)
+        for invoice_id in invoice_ids:
+            invoice, po = pairs[invoice_id]
+            if invoice is None:
+                missing.append(invoice_id)
+                continue
+            result = self.verifier.verify_invoice_po_match(
+                invoice, po, anomaly=self.vector_store.anomalies.get(invoice_id),
+                vendor_index=self.vector_store.vendors, normalized_amounts=normalized.get(invoice_id)
+            )
+            rows.append({
+                "invoice_id": invoice_id,
+                "po_number": invoice.get("po_number"),
+                "invoice_version": record_version(invoice),
+                "po_version": record_version(po),
+                "result": result,
+            })
+
+        # A record that changed mid-batch stays dirty and is picked up again
+        with self._lock:
+            current = [row for row in rows if self._generation[row["invoice_id"]] == generations[row["invoice_id"]]]
+            self.store.save_many(current)
+            self.store.delete(missing)
+        return len(current) + len(missing)
+
+    def _normalized_amounts(self, pairs: Dict[str, tuple]) -> Dict[str, tuple]:
+        """
+        Base-currency (invoice, PO) amounts for the batch's cross-currency pairs,
+        both converted at the invoice date: one vectorized pass per column.
+        """
+        matched = [(invoice_id, invoice, po) for invoice_id, (invoice, po) in pairs.items()
+                   if invoice is not None and po is not None
+                   and str(invoice.get("currency") or "").upper() != str(po.get("currency") or "").upper()]
+        if not matched:
+            return {}
+        days = [invoice.get("invoice_date") for _, invoice, _ in matched]
+        invoice_amounts = fx_rates.records_to_base([invoice for _, invoice, _ in matched], "invoice_date")
+        po_amounts = fx_rates.records_to_base([po for _, _, po in matched], "created_date", day_override=days)
+        return {
+            invoice_id: tuple(None if math.isnan(amount) else float(amount) for amount in amounts)
+            for (invoice_id, _, _), amounts in zip(matched, zip(invoice_amounts, po_amounts))
+        }
+
+    def reconcile_range(self, field: str, start: int, end: int) -> int:
+        """Re-verify every invoice dated in [start, end] (YYYYMMDD); only overlapping partitions are read"""
+        invoice_ids = self.vector_store.invoice_ids_in_range(field, start, end)
+        with self._lock:
+            for invoice_id in invoice_ids:
+                self._generation[invoice_id] += 1
+            self.store.mark_dirty(invoice_ids)
+        verified = 0
+        for offset in range(0, len(invoice_ids), self.batch_size):
+            verified += self._verify_batch(invoice_ids[offset:offset + self.batch_size])
+        return verified
+
+    def get_verdict(self, invoice_id: str) -> Optional[Dict[str, Any]]:
+        """Precomputed verdict; verified on the spot only if the invoice was never verified"""
+        verdict = self.store.get(invoice_id)
+        if verdict is None and invoice_id in self.vector_store.records["invoice"]:
+            self._verify_batch([invoice_id])
+            verdict = self.store.get(invoice_id)
+        return verdict
+
+    def _pair(self, invoice_id: str) -> tuple:
+        invoice = self.vector_store.records["invoice"].get(invoice_id)
+        po = self.vector_store.records["po"].get(invoice.get("po_number")) if invoice else None
+        return invoice, po
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_seconds)
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f"Verification scheduler error: {e}")
@@ -1,6 +1,8 @@
-from typing import Dict, Any, Optional
-from utils.llm import llm_client
-from utils.audit import audit_logger
+from typing import Dict, Any, List, Optional
+from app.utils.llm import llm_client
+from app.utils.audit import audit_logger
+from app.data.vendor_index import VendorIndex, normalize_vendor
+from app.data.fx import fx_rates
 import json
 
 class ResultVerifier:
@@ -16,9 +18,18 @@ class ResultVerifier:
     def verify_invoice_po_match(
         self, 
         invoice: Dict[str, Any], 
-        po: Optional[Dict[str, Any]] = None
+        po: Optional[Dict[str, Any]] = None,
+        anomaly: Optional[Dict[str, Any]] = None,
+        vendor_index: Optional[VendorIndex] = None,
+        normalized_amounts: Optional[tuple] = None
     ) -> Dict[str, Any]:
-        """Verify if invoice matches PO and determine confidence"""
+        """
+        Verify if invoice matches PO and determine confidence. anomaly is the
+        invoice's AnomalyScorer score; vendor_index resolves vendor spellings
+        (canonical names are compared without one). normalized_amounts is the
+        (invoice, PO) pair already converted to the FX base currency by a batch
+        caller; it is only used when the two are billed in different currencies.
+        """
         
         audit_logger.log_action(
             agent_name=self.name,
@@ -45,18 +56,31 @@ class ResultVerifier:
             
             # Add rule-based checks
             if po:
-                # Check vendor match
-                if invoice.get("vendor_name", "").lower() != po.get("vendor_name", "").lower():
+                # Check vendor match (raw records use "vendor", retrieval metadata "vendor_name")
+                if not self._same_vendor(self._vendor(invoice), self._vendor(po), vendor_index):
                     verification_result["issues"].append("Vendor name mismatch")
                     verification_result["match_score"] -= 20
                 
-                # Check amount (allow 5% variance)
-                invoice_amount = float(invoice.get("amount", 0))
-                po_amount = float(po.get("amount", 0))
-                
-                if abs(invoice_amount - po_amount) / po_amount > 0.05:
-                    verification_result["issues"].append(f"Amount variance: Invoice ${invoice_amount}, PO ${po_amount}")
-                    verification_result["match_score"] -= 15
+                # Check amount (allow 5% variance), in one currency
+                invoice_currency, po_currency = self._currency(invoice), self._currency(po)
+                if invoice_currency == po_currency:
+                    invoice_amount = self._amount(invoice)
+                    po_amount = self._amount(po)
+                    
+                    if po_amount and abs(invoice_amount - po_amount) / po_amount > 0.05:
+                        verification_result["issues"].append(f"Amount variance: Invoice ${invoice_amount}, PO ${po_amount}")
+                        verification_result["match_score"] -= 15
+                else:
+                    invoice_amount, po_amount = normalized_amounts or self._to_base(invoice, po)
+                    if invoice_amount is None or po_amount is None:
+                        verification_result["issues"].append(
+                            f"No FX rate to compare {invoice_currency} invoice with {po_currency} PO")
+                        verification_result["match_score"] -= 15
+                    elif po_amount and abs(invoice_amount - po_amount) / po_amount > 0.05:
+                        verification_result["issues"].append(
+                            f"Amount variance: Invoice {invoice_amount:,.2f} {fx_rates.base} ({invoice_currency}), "
+                            f"PO {po_amount:,.2f} {fx_rates.base} ({po_currency})")
+                        verification_result["match_score"] -= 15
                 
                 # Check PO number match
                 if invoice.get("po_number") != po.get("po_number"):
@@ -68,6 +92,13 @@ class ResultVerifier:
                 verification_result["match_score"] = 30
                 verification_result["flagging_reasons"].append("Missing PO reference")
             
+            # Statistical check against the vendor's amount history and usual PO variance
+            if anomaly:
+                verification_result["anomaly_score"] = anomaly["score"]
+                if anomaly["anomalous"]:
+                    verification_result["issues"].extend(anomaly["reasons"])
+                    verification_result["match_score"] -= 15
+            
             # Determine flagging reasons
             if verification_result["match_score"] < 70:
                 verification_result["flagging_reasons"].extend(verification_result["issues"])
@@ -106,6 +137,37 @@ class ResultVerifier:
         
         return verification_result
     
+    def prefetch_analyses(self, pairs: List[tuple]):
+        """Run the LLM analyses of many invoice/PO pairs as one concurrent batch; verify calls then hit the cache"""
+        try:
+            llm_client.analyze_many(pairs)
+        except Exception as e:
+            print(f"LLM prefetch error: {e}")
+    
+    @staticmethod
+    def _vendor(record: Dict[str, Any]) -> str:
+        return record.get("vendor_name") or record.get("vendor") or ""
+    
+    @staticmethod
+    def _same_vendor(a: str, b: str, vendor_index: Optional[VendorIndex]) -> bool:
+        if vendor_index is not None:
+            return vendor_index.same_vendor(a, b)
+        return normalize_vendor(a) == normalize_vendor(b)
+    
+    @staticmethod
+    def _amount(record: Dict[str, Any]) -> float:
+        return float(record.get("amount", record.get("total_amount", 0)) or 0)
+    
+    @staticmethod
+    def _currency(record: Dict[str, Any]) -> str:
+        return str(record.get("currency") or "").upper()
+    
+    def _to_base(self, invoice: Dict[str, Any], po: Dict[str, Any]) -> tuple:
+        """Both amounts in the FX base currency at the rate of the invoice date (None where no rate is known)"""
+        day = invoice.get("invoice_date") or invoice.get("invoice_date_ord")
+        return (fx_rates.convert(self._amount(invoice), self._currency(invoice), day),
+                fx_rates.convert(self._amount(po), self._currency(po), day))
+    
     def should_escalate(self, confidence: float, issues: List[str]) -> bool:
         """Determine if case should be escalated to human review"""
         return confidence < self.confidence_threshold or len(issues) > 2
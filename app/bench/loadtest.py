@@ -0,0 +1,401 @@
+"""
+Load generator for the query API (app.main:app).
+
+Starts the app locally against a synthetic corpus (or targets a running
+server with --url), replays a weighted mix of query types from an asyncio
+client and reports throughput, p50/p95/p99 latency, error rates and the
+server-side stage timings taken from each response's audit log.
+
+    python -m app.bench.loadtest --invoices 2000 --concurrency 32 --duration 60
+    python -m app.bench.loadtest --rate 40 --duration 60 --save-baseline bench/baseline.json
+    python -m app.bench.loadtest --rate 40 --duration 60 --compare bench/baseline.json
+
+Closed loop (--concurrency) keeps N requests in flight. Open loop (--rate)
+sends on a fixed schedule and measures latency from the scheduled send time,
+so a stalled server shows up as queueing instead of a lower request rate.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.data.mock_invoices import generate_mock_invoices, generate_mock_pos
+
+DEFAULT_MIX = "flagged=40,vendor=30,po=20,approval=10"
+STAGES = ("planning", "retrieval", "response_generation")
+
+
+def build_corpus(directory: str, count: int, seed: int) -> Dict[str, str]:
+    """Write a synthetic invoice/PO corpus and return the environment pointing the app at it"""
+    random.seed(seed)
+    paths = {
+        "INVOICE_DATA_PATH": os.path.join(directory, "invoices.json"),
+        "PO_DATA_PATH": os.path.join(directory, "pos.json"),
+        "CHROMA_DIR": os.path.join(directory, "chroma_db"),
+        "VERIFICATION_DB_PATH": os.path.join(directory, "verification.db"),
+        "AUDIT_LOG_PATH": os.path.join(directory, "audit_log.jsonl"),
+        # Synthetic ids overlap the real ones: approvals, caches, snapshots and profiles must not touch data/
+        "APPROVALS_WAL_PATH": os.path.join(directory, "approvals.wal"),
+        "LLM_CACHE_PATH": os.path.join(directory, "llm_cache.db"),
+        "INDEX_SNAPSHOT_PATH": os.path.join(directory, "index.snapshot"),
+        "PROFILE_DIR": os.path.join(directory, "profiles"),
+    }
+    with open(paths["INVOICE_DATA_PATH"], "w") as f:
+        json.dump(generate_mock_invoices(count), f)
+    with open(paths["PO_DATA_PATH"], "w") as f:
+        json.dump(generate_mock_pos(count), f)
+    return paths
+
+
+class Workload:
+    """Draws query scenarios from the corpus according to a weighted mix"""
+
+    def __init__(self, invoices: List[Dict], pos: List[Dict], mix: Dict[str, float], seed: int = 7):
+        unknown = set(mix) - {"flagged", "vendor", "po", "approval"}
+        if unknown:
+            raise ValueError(f"Unknown query types in mix: {', '.join(sorted(unknown))}")
+        self.rng = random.Random(seed)
+        self.flagged = [i["invoice_id"] for i in invoices if i.get("status") == "flagged"] or \
+            [i["invoice_id"] for i in invoices]
+        self.vendors = sorted({i["vendor"] for i in invoices})
+        self.po_numbers = [p["po_number"] for p in pos]
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+
+    def next(self) -> Tuple[str, List[str]]:
+        """(query type, queries sent in order within one session)"""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "flagged":
+            return kind, [f"Why was invoice {self.rng.choice(self.flagged)} flagged?"]
+        if kind == "vendor":
+            return kind, [f"Show invoices from {self.rng.choice(self.vendors)}"]
+        if kind == "po":
+            return kind, [f"What is the status of {self.rng.choice(self.po_numbers)}?"]
+        # Approval follow-up: ask about an invoice, then approve it in the same session
+        return kind, [f"Why was invoice {self.rng.choice(self.flagged)} flagged?", "Approve it"]
+
+
+class HttpConnection:
+    """Minimal keep-alive HTTP/1.1 JSON client on asyncio streams"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def post_json(self, path: str, payload: Dict) -> Tuple[int, Dict]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"POST {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        self.writer.write(head.encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Server closed the connection")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        data = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, json.loads(data) if data else {}
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadTest:
+    def __init__(self, url: str, workload: Workload, timeout: float = 10.0, budget_ms: float = None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.workload = workload
+        self.timeout = timeout
+        self.budget_ms = budget_ms
+        self.samples = []  # dicts: kind, sent_at, latency_ms, ok, degraded, stages
+        self._idle = []
+
+    async def run_closed(self, concurrency: int, duration: float):
+        """Keep `concurrency` scenarios in flight for `duration` seconds"""
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            connection = HttpConnection(self.host, self.port)
+            while time.perf_counter() < stop_at:
+                kind, queries = self.workload.next()
+                await self._scenario(connection, kind, queries)
+            connection.close()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    async def run_open(self, rate: float, duration: float):
+        """Start one scenario every 1/rate seconds, regardless of how fast responses come back"""
+        started = time.perf_counter()
+        tasks = []
+        sent = 0
+        while True:
+            scheduled = started + sent / rate
+            if scheduled - started >= duration:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            kind, queries = self.workload.next()
+            tasks.append(asyncio.ensure_future(self._pooled_scenario(kind, queries, scheduled)))
+            sent += 1
+        await asyncio.gather(*tasks)
+        for connection in self._idle:
+            connection.close()
+
+    async def _pooled_scenario(self, kind: str, queries: List[str], scheduled: float):
+        connection = self._idle.pop() if self._idle else HttpConnection(self.host, self.port)
+        try:
+            await self._scenario(connection, kind, queries, scheduled)
+        finally:
+            self._idle.append(connection)
+
+    async def _scenario(self, connection: HttpConnection, kind: str, queries: List[str], scheduled: float = None):
+        session_id = str(uuid.uuid4())
+        for position, query in enumerate(queries):
+            last = position == len(queries) - 1
+            # The approval set-up question is an ordinary flagged-invoice lookup
+            label = kind if last else "flagged"
+            sent_at = scheduled if position == 0 and scheduled is not None else time.perf_counter()
+            payload = {"query": query, "session_id": session_id}
+            if self.budget_ms is not None:
+                payload["budget_ms"] = self.budget_ms
+            sample = {"kind": label, "sent_at": sent_at, "ok": False, "degraded": False, "stages": {}}
+            try:
+                status, body = await asyncio.wait_for(connection.post_json("/query", payload), self.timeout)
+                sample["ok"] = status == 200
+                if sample["ok"]:
+                    sample["degraded"] = bool(body.get("degraded"))
+                    sample["stages"] = stage_timings(body.get("audit_log", []))
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                connection.close()
+            sample["latency_ms"] = (time.perf_counter() - sent_at) * 1000
+            self.samples.append(sample)
+            if not sample["ok"]:
+                break
+
+
+def stage_timings(audit_log: List[Dict]) -> Dict[str, float]:
+    """Per-stage durations from the cumulative elapsed_ms the pipeline records on each audit step"""
+    timings = {}
+    previous = 0.0
+    for entry in audit_log:
+        if entry.get("step") in STAGES and "elapsed_ms" in entry:
+            timings[entry["step"]] = entry["elapsed_ms"] - previous
+            previous = entry["elapsed_ms"]
+    return timings
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))], 2)
+
+
+def summarize(samples: List[Dict], wall_seconds: float) -> Dict:
+    def latency_stats(group: List[Dict]) -> Dict:
+        latencies = [s["latency_ms"] for s in group if s["ok"]]
+        errors = sum(1 for s in group if not s["ok"])
+        return {
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": round(errors / len(group), 4) if group else 0.0,
+            "degraded": sum(1 for s in group if s["degraded"]),
+            "throughput_rps": round(len(group) / wall_seconds, 2) if wall_seconds else 0.0,
+            "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+
+    by_kind = {}
+    for sample in samples:
+        by_kind.setdefault(sample["kind"], []).append(sample)
+    stages = {}
+    for stage in STAGES:
+        values = [s["stages"][stage] for s in samples if stage in s["stages"]]
+        if values:
+            stages[stage] = {"p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95),
+                             "p99_ms": percentile(values, 99)}
+    return {
+        "overall": latency_stats(samples),
+        "by_type": {kind: latency_stats(group) for kind, group in sorted(by_kind.items())},
+        "stages": stages,
+    }
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float = 0.1) -> List[str]:
+    """Regressions of report against baseline: latency or throughput worse by more than tolerance, or more errors"""
+    regressions = []
+    groups = [("overall", report["overall"], baseline.get("overall", {}))]
+    groups += [(kind, stats, baseline.get("by_type", {}).get(kind, {})) for kind, stats in report["by_type"].items()]
+    for name, current, previous in groups:
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if current.get(metric) and previous.get(metric) and current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {previous[metric]} -> {current[metric]}")
+        if current["error_rate"] > previous.get("error_rate", 0.0) + 0.01:
+            regressions.append(f"{name} error_rate: {previous.get('error_rate', 0.0)} -> {current['error_rate']}")
+    previous_rps = baseline.get("overall", {}).get("throughput_rps")
+    if previous_rps and report["overall"]["throughput_rps"] < previous_rps * (1 - tolerance):
+        regressions.append(f"overall throughput_rps: {previous_rps} -> {report['overall']['throughput_rps']}")
+    return regressions
+
+
+def print_report(report: Dict):
+    header = f"{'type':<12}{'reqs':>7}{'err%':>7}{'degr':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = list(report["by_type"].items()) + [("overall", report["overall"])]
+    for name, stats in rows:
+        print(f"{name:<12}{stats['requests']:>7}{stats['error_rate'] * 100:>7.1f}{stats['degraded']:>6}"
+              f"{stats['throughput_rps']:>8.1f}{stats['p50_ms'] or 0:>9.1f}{stats['p95_ms'] or 0:>9.1f}"
+              f"{stats['p99_ms'] or 0:>9.1f}")
+    if report["stages"]:
+        print("\nServer-side stage timings (ms):")
+        for stage, stats in report["stages"].items():
+            print(f"  {stage:<22}p50 {stats['p50_ms']:>8.1f}  p95 {stats['p95_ms']:>8.1f}  p99 {stats['p99_ms']:>8.1f}")
+
+
+def start_server(port: int, env: Dict[str, str], startup_timeout: float) -> subprocess.Popen:
+    """Run uvicorn on app.main:app and wait until it answers /health"""
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, **env},
+    )
+    give_up_at = time.time() + startup_timeout
+    while time.time() < give_up_at:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited during startup (code {server.returncode})")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=2):
+                return server
+        except OSError:
+            time.sleep(1)
+    server.terminate()
+    raise RuntimeError(f"Server did not come up within {startup_timeout:.0f}s")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the invoice matcher query API")
+    parser.add_argument("--url", help="Target a running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--invoices", type=int, default=500, help="Synthetic corpus size (invoices and POs)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted query types, e.g. flagged=40,vendor=30,po=20,approval=10")
+    parser.add_argument("--concurrency", type=int, default=16, help="Closed loop: scenarios kept in flight")
+    parser.add_argument("--rate", type=float, help="Open loop: scenarios started per second (overrides --concurrency)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="Seconds of load before measuring")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Per-request client timeout in seconds")
+    parser.add_argument("--budget-ms", type=float, help="Request deadline sent with every query")
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    parser.add_argument("--save-baseline", help="Write the report to this JSON file")
+    parser.add_argument("--compare", help="Compare against a saved baseline; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative slowdown vs baseline")
+    parser.add_argument("--keep-data", action="store_true", help="Keep the synthetic corpus directory")
+    args = parser.parse_args(argv)
+
+    workdir = None
+    server = None
+    try:
+        if args.url:
+            url = args.url
+            invoice_path = os.getenv("INVOICE_DATA_PATH", "data/invoices/mock_invoices.json")
+            po_path = os.getenv("PO_DATA_PATH", "data/pos/mock_pos.json")
+        else:
+            workdir = tempfile.mkdtemp(prefix="loadtest-")
+            env = build_corpus(workdir, args.invoices, args.seed)
+            invoice_path, po_path = env["INVOICE_DATA_PATH"], env["PO_DATA_PATH"]
+            print(f"📦 Synthetic corpus: {args.invoices} invoices/POs in {workdir}")
+            print("🚀 Starting app.main:app (builds the vector stores on startup)...")
+            server = start_server(args.port, env, args.startup_timeout)
+            url = f"http://127.0.0.1:{args.port}"
+
+        with open(invoice_path) as f:
+            invoices = json.load(f)
+        with open(po_path) as f:
+            pos = json.load(f)
+        workload = Workload(invoices, pos, parse_mix(args.mix), seed=args.seed)
+        test = LoadTest(url, workload, timeout=args.timeout, budget_ms=args.budget_ms)
+
+        async def drive():
+            total = args.warmup + args.duration
+            if args.rate:
+                await test.run_open(args.rate, total)
+            else:
+                await test.run_closed(args.concurrency, total)
+
+        mode = f"{args.rate}/s open loop" if args.rate else f"{args.concurrency} concurrent"
+        print(f"🔥 {mode}, {args.warmup:.0f}s warm-up + {args.duration:.0f}s measured against {url}")
+        started = time.perf_counter()
+        asyncio.run(drive())
+        measured_from = started + args.warmup
+        samples = [s for s in test.samples if s["sent_at"] >= measured_from]
+        report = summarize(samples, time.perf_counter() - measured_from)
+        report["config"] = {key: value for key, value in vars(args).items()
+                            if key not in ("save_baseline", "compare", "keep_data")}
+        print()
+        print_report(report)
+
+        if args.save_baseline:
+            os.makedirs(os.path.dirname(args.save_baseline) or ".", exist_ok=True)
+            with open(args.save_baseline, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\n💾 Baseline saved to {args.save_baseline}")
+        if args.compare:
+            with open(args.compare) as f:
+                regressions = compare(report, json.load(f), args.tolerance)
+            if regressions:
+                print(f"\n❌ {len(regressions)} regression(s) vs {args.compare}:")
+                for regression in regressions:
+                    print(f"  - {regression}")
+                return 1
+            print(f"\n✅ No regressions vs {args.compare} (tolerance {args.tolerance:.0%})")
+        return 0
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if workdir and not args.keep_data:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Retrieval quality vs. latency for retriever configurations.
+
+Labeled queries are generated from the corpus itself: the mock generator
+decides which invoices are flagged and which PO each invoice references, so
+the relevant documents for "Why was invoice INV-1003 flagged?" or "Which PO
+does INV-1003 bill against?" are known. Each configuration runs the same
+query set and reports recall@k, MRR and latency percentiles side by side, so
+a faster setting (smaller k, another backend, different hybrid weights)
+comes with its accuracy cost attached.
+
+    python -m app.bench.retrieval_eval --config vector --config lexical --config hybrid
+    python -m app.bench.retrieval_eval --config "hybrid:lexical_weight=2" --config "hybrid:rerank=20" --k 1 3 5
+
+A configuration is "<mode>[:option=value,...]" where mode is vector, lexical
+or hybrid, options go to HybridRetriever (vector_weight, lexical_weight,
+rrf_k, fetch_k, identifier_threshold), and rerank=N over-fetches N candidates
+and applies the structured re-ranker.
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Dict, List, Tuple
+
+from app.bench.loadtest import percentile
+
+QUERY_TYPES = ("invoice_id", "invoice_po", "po_id", "po_invoices", "vendor_flagged", "descriptive")
+
+
+def build_queries(records: Dict[str, Dict[str, Dict]], per_type: int = 50, seed: int = 7) -> List[Dict]:
+    """Labeled queries: {type, doc_type, query, relevant (set of ids)}"""
+    rng = random.Random(seed)
+    invoices = sorted(records["invoice"].values(), key=lambda item: item["invoice_id"])
+    pos = sorted(records["po"].values(), key=lambda item: item["po_number"])
+    invoices_by_po = {}
+    for item in invoices:
+        if item.get("po_number"):
+            invoices_by_po.setdefault(item["po_number"], set()).add(item["invoice_id"])
+
+    def sample(items: list) -> list:
+        return rng.sample(items, min(per_type, len(items)))
+
+    queries = []
+    for item in sample(invoices):
+        queries.append({"type": "invoice_id", "doc_type": "invoice",
+                        "query": f"Why was invoice {item['invoice_id']} flagged?",
+                        "relevant": {item["invoice_id"]}})
+    for item in sample([i for i in invoices if i.get("po_number") in records["po"]]):
+        queries.append({"type": "invoice_po", "doc_type": "po",
+                        "query": f"Which purchase order does invoice {item['invoice_id']} bill against, "
+                                 f"{item['vendor']} for {item['total_amount']}?",
+                        "relevant": {item["po_number"]}})
+    for item in sample(pos):
+        queries.append({"type": "po_id", "doc_type": "po",
+                        "query": f"What is the status of {item['po_number']}?",
+                        "relevant": {item["po_number"]}})
+    for po_number in sample(sorted(invoices_by_po)):
+        queries.append({"type": "po_invoices", "doc_type": "invoice",
+                        "query": f"Show invoices billed against {po_number}",
+                        "relevant": invoices_by_po[po_number]})
+    flagged_by_vendor = {}
+    for item in invoices:
+        if item.get("status") == "flagged":
+            flagged_by_vendor.setdefault(item["vendor"], set()).add(item["invoice_id"])
+    for vendor in sorted(flagged_by_vendor):
+        queries.append({"type": "vendor_flagged", "doc_type": "invoice",
+                        "query": f"Flagged invoices from {vendor}",
+                        "relevant": flagged_by_vendor[vendor]})
+    for item in sample(invoices):
+        descriptions = ", ".join(li["description"] for li in item.get("line_items", [])[:2])
+        queries.append({"type": "descriptive", "doc_type": "invoice",
+                        "query": f"{item['vendor']} invoice for {item['total_amount']} {item['currency']} "
+                                 f"covering {descriptions}",
+                        "relevant": {item["invoice_id"]}})
+    return queries
+
+
+def parse_config(spec: str) -> Tuple[str, Dict]:
+    mode, _, options = spec.partition(":")
+    parsed = {}
+    for part in filter(None, options.split(",")):
+        name, _, value = part.partition("=")
+        parsed[name.strip()] = float(value) if "." in value else int(value)
+    return mode.strip(), parsed
+
+
+class ConfiguredRetriever:
+    """Ranked ids for a query under one configuration, via the manager's retriever factories"""
+
+    def __init__(self, vector_store, spec: str, k: int):
+        self.spec = spec
+        self.mode, self.options = parse_config(spec)
+        self.rerank = int(self.options.pop("rerank", 0))
+        self.vector_store = vector_store
+        self.k = k
+        self.reranker = None
+        if self.rerank:
+            from app.agents.reranker import StructuredReranker
+            self.reranker = StructuredReranker(
+                po_records=vector_store.records["po"],
+                vendors=lambda: vector_store.aggregates.values["invoice"]["vendor"],
+                vendor_resolver=vector_store.vendors.find_in_text
+            )
+        factories = {"invoice": vector_store.get_invoice_retriever, "po": vector_store.get_po_retriever}
+        fetch = max(self.k, self.rerank)
+        self.retrievers = {doc_type: factory(k=fetch, mode=self.mode, **self.options)
+                           for doc_type, factory in factories.items()}
+
+    def ranked_ids(self, query: str, doc_type: str) -> List[str]:
+        docs = self.retrievers[doc_type].invoke(query)
+        if self.reranker:
+            docs = self.reranker.rerank(query, docs, k=self.k)
+        return [doc.metadata.get("id") for doc in docs[:self.k]]
+
+
+def evaluate(retriever: ConfiguredRetriever, queries: List[Dict], ks: List[int]) -> Dict:
+    """recall@k (relevant found in top k, out of min(|relevant|, k)), MRR and latency, overall and per query type"""
+    rows = []
+    for labeled in queries:
+        started = time.perf_counter()
+        ranked = retriever.ranked_ids(labeled["query"], labeled["doc_type"])
+        latency_ms = (time.perf_counter() - started) * 1000
+        relevant = labeled["relevant"]
+        first_hit = next((rank for rank, doc_id in enumerate(ranked, 1) if doc_id in relevant), None)
+        rows.append({
+            "type": labeled["type"],
+            "latency_ms": latency_ms,
+            "reciprocal_rank": 1.0 / first_hit if first_hit else 0.0,
+            "recall": {k: len(relevant & set(ranked[:k])) / min(len(relevant), k) for k in ks},
+        })
+
+    def summarize(group: List[Dict]) -> Dict:
+        latencies = [row["latency_ms"] for row in group]
+        return {
+            "queries": len(group),
+            "recall": {k: round(sum(row["recall"][k] for row in group) / len(group), 4) for k in ks},
+            "mrr": round(sum(row["reciprocal_rank"] for row in group) / len(group), 4),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+
+    by_type = {}
+    for row in rows:
+        by_type.setdefault(row["type"], []).append(row)
+    return {
+        "overall": summarize(rows),
+        "by_type": {name: summarize(by_type[name]) for name in QUERY_TYPES if name in by_type},
+    }
+
+
+def print_results(results: Dict[str, Dict], ks: List[int]):
+    recall_headers = "".join(f"{f'R@{k}':>8}" for k in ks)
+    header = f"{'config':<28}{'type':<16}{'n':>5}{recall_headers}{'MRR':>8}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    for spec, result in results.items():
+        groups = list(result["by_type"].items()) + [("overall", result["overall"])]
+        for name, stats in groups:
+            recalls = "".join(f"{stats['recall'][k]:>8.3f}" for k in ks)
+            print(f"{spec:<28}{name:<16}{stats['queries']:>5}{recalls}{stats['mrr']:>8.3f}"
+                  f"{stats['p50_ms']:>9.2f}{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+        print()
+
+
+def main(argv: List[str] = None) -> int:
+    from app.data.vector_store import VectorStoreManager
+
+    parser = argparse.ArgumentParser(description="Evaluate retriever configurations against labeled queries")
+    parser.add_argument("--config", action="append", help="Retriever configuration (repeatable), e.g. hybrid:lexical_weight=2")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="Cut-offs for recall@k")
+    parser.add_argument("--per-type", type=int, default=50, help="Queries sampled per query type")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+    configs = args.config or ["vector", "lexical", "hybrid"]
+    ks = sorted(set(args.k))
+
+    vector_store = VectorStoreManager()
+    vector_store.setup_vector_stores()
+    queries = build_queries(vector_store.records, per_type=args.per_type, seed=args.seed)
+    print(f"📋 {len(queries)} labeled queries, {len(configs)} configuration(s), k = {', '.join(map(str, ks))}\n")
+
+    results = {}
+    for spec in configs:
+        retriever = ConfiguredRetriever(vector_store, spec, k=max(ks))
+        retriever.ranked_ids(queries[0]["query"], queries[0]["doc_type"])  # warm-up (model, caches)
+        results[spec] = evaluate(retriever, queries, ks)
+    print_results(results, ks)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"queries": len(queries), "k": ks, "results": results}, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Serialization cost of a /query response by evidence size.
+
+Compares the old path (validate through the pydantic QueryResponse model,
+then .json()) with the direct path used by the API (app.utils.serialization,
+orjson when installed, stdlib json otherwise), for the full response and for
+the "answer" and "evidence" projections.
+
+    python -m app.bench.serialization --sizes 3 30 300 3000
+"""
+import sys
+import json
+import time
+import argparse
+from typing import Callable, Dict, List
+
+from app.data.mock_invoices import generate_mock_invoices
+from app.utils.serialization import JSON_BACKEND, dumps, project, resolve_fields
+
+ALL_FIELDS = ("query", "session_id", "response", "confidence", "sources", "audit_log", "plan", "degraded")
+
+
+def synthetic_result(source_count: int) -> Dict:
+    """A process_query result shaped like the real one, with source_count retrieved documents"""
+    invoices = generate_mock_invoices(source_count)
+    sources = [
+        {"type": "invoice", "id": item["invoice_id"], "vendor": item["vendor"], "amount": item["total_amount"],
+         "status": item["status"], "po_number": item["po_number"] or "", "invoice_date_ord": 20250101}
+        for item in invoices
+    ]
+    plan = {"query": "Why was invoice INV-1023 flagged?", "invoice_id": "INV-1023", "po_number": None,
+            "follow_up": False, "actions": ["retrieve_invoice", "explain_flagging"],
+            "timestamp": "2025-01-01T00:00:00", "reasoning": "User asking about flagged invoice INV-1023"}
+    return {
+        "query": plan["query"],
+        "session_id": "bench-session",
+        "response": "**Invoice INV-1023 Analysis**\n" + "Flagged because the amount differs from the PO. " * 10,
+        "confidence": 0.9,
+        "sources": sources,
+        "audit_log": [
+            {"step": "planning", "timestamp": "2025-01-01T00:00:00", "elapsed_ms": 0.4, "input": plan["query"],
+             "output": plan},
+            {"step": "retrieval", "timestamp": "2025-01-01T00:00:00", "elapsed_ms": 21.7,
+             "retrieved_count": len(sources), "sources": sources[:3]},
+            {"step": "response_generation", "timestamp": "2025-01-01T00:00:00", "elapsed_ms": 22.3,
+             "response_length": 512, "method": "rule_based"},
+        ],
+        "plan": plan,
+        "degraded": False,
+    }
+
+
+def time_per_call(fn: Callable[[], bytes], min_seconds: float = 0.2) -> float:
+    """Mean microseconds per call over at least min_seconds"""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        fn()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / calls * 1e6
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark /query response serialization")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 30, 300, 3000], help="Sources per response")
+    parser.add_argument("--min-seconds", type=float, default=0.2, help="Measuring time per cell")
+    args = parser.parse_args(argv)
+
+    try:
+        from app.models.schemas import QueryResponse
+    except ImportError:
+        QueryResponse = None
+        print("(pydantic is not installed; skipping the model-validation column)")
+
+    print(f"JSON backend: {JSON_BACKEND}\n")
+    header = f"{'sources':>8}{'bytes':>11}{'pydantic µs':>14}{'direct µs':>12}{'answer µs':>12}{'evidence µs':>13}{'answer B':>10}"
+    print(header)
+    print("-" * len(header))
+    answer = resolve_fields(["answer"], ALL_FIELDS)
+    evidence = resolve_fields(["evidence"], ALL_FIELDS)
+    for size in args.sizes:
+        result = synthetic_result(size)
+        full = dumps(result)
+        model_us = (time_per_call(lambda: QueryResponse(**result).json().encode("utf-8"), args.min_seconds)
+                    if QueryResponse else float("nan"))
+        direct_us = time_per_call(lambda: dumps(result), args.min_seconds)
+        answer_us = time_per_call(lambda: dumps(project(result, answer)), args.min_seconds)
+        evidence_us = time_per_call(lambda: dumps(project(result, evidence)), args.min_seconds)
+        answer_bytes = len(dumps(project(result, answer)))
+        print(f"{size:>8}{len(full):>11}{model_us:>14.1f}{direct_us:>12.1f}{answer_us:>12.1f}"
+              f"{evidence_us:>13.1f}{answer_bytes:>10}")
+    # Sanity check: the fast path emits the same document as stdlib json
+    sample = synthetic_result(5)
+    assert json.loads(dumps(sample)) == json.loads(json.dumps(sample, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
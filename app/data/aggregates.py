@@ -0,0 +1,187 @@
+import re
+import threading
+from collections import defaultdict
+from datetime import datetime
+from itertools import combinations
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from app.data.fx import FXTable, fx_rates
+from app.data.vendor_index import normalize_vendor
+
+DIMENSIONS = {
+    "invoice": ("vendor", "status", "month"),
+    "po": ("vendor", "status", "department", "month"),
+}
+DATE_FIELDS = {"invoice": "invoice_date", "po": "created_date"}
+# Dimensions whose canonical (lowercased/normalized) values are shown as the records spell them
+DISPLAY_FIELDS = ("vendor", "department")
+MONTH_NAMES = ["january", "february", "march", "april", "may", "june", "july",
+               "august", "september", "october", "november", "december"]
+
+
+class AggregateStore:
+    """
+    Materialized counts, amount sums and flagged rates for invoices and POs.
+
+    Every combination of dimension values a record has (vendor, status,
+    department, month) gets its own cell, so a lookup with any set of filters
+    is a single dict access. Cells are updated incrementally on ingest and on
+    status changes (old record subtracted, new record added). Vendors are
+    grouped by canonical name, so "TechCorp Inc." and "TECHCORP" share cells,
+    and answers show the first spelling seen for each canonical value.
+    Amounts are summed in the FX table's base currency, converted at each
+    record's own date.
+    """
+
+    def __init__(self, vendor_resolver: Callable[[str], List[str]] = None, fx: FXTable = None):
+        self.cells = defaultdict(lambda: [0, 0.0, 0])  # key -> [count, total amount, flagged]
+        self.values = {doc_type: defaultdict(set) for doc_type in DIMENSIONS}
+        self.display = {}  # (dimension, canonical value) -> name as written in the records
+        # text -> canonical vendor names mentioned in it (fuzzy); exact word match on known vendors otherwise
+        self.vendor_resolver = vendor_resolver
+        self.fx = fx or fx_rates
+        self._lock = threading.Lock()
+
+    def add(self, record: Dict, doc_type: str):
+        """Count a newly ingested record"""
+        self.replace_many([(None, record)], doc_type)
+
+    def replace(self, old: Optional[Dict], new: Dict, doc_type: str):
+        """Move a changed record (e.g. a status transition) to its new cells"""
+        self.replace_many([(old, new)], doc_type)
+
+    def replace_many(self, changes: List[Tuple[Optional[Dict], Dict]], doc_type: str):
+        """
+        Apply a batch of (old or None, new) record changes. Base-currency amounts
+        are converted for the whole batch at once; records whose currency has no
+        rate are counted without an amount.
+        """
+        olds = [old for old, _ in changes if old is not None]
+        news = [new for _, new in changes]
+        amounts = self.fx.records_to_base(olds + news, DATE_FIELDS[doc_type])
+        amounts = np.nan_to_num(amounts, nan=0.0)
+        for record, amount in zip(olds, amounts[:len(olds)]):
+            self._apply(record, doc_type, -1, amount)
+        for record, amount in zip(news, amounts[len(olds):]):
+            self._apply(record, doc_type, 1, amount)
+
+    def _apply(self, record: Dict, doc_type: str, sign: int, amount: float):
+        dims = self.dimensions_of(record, doc_type)
+        amount = float(amount) * sign
+        flagged = sign if record.get("status") == "flagged" else 0
+        items = sorted(dims.items())
+        with self._lock:
+            for name, value in items:
+                self.values[doc_type][name].add(value)
+                if sign > 0 and name in DISPLAY_FIELDS and (name, value) not in self.display:
+                    self.display[(name, value)] = str(record.get(name) or "").strip() or value
+            for size in range(len(items) + 1):
+                for combo in combinations(items, size):
+                    cell = self.cells[(doc_type,) + combo]
+                    cell[0] += sign
+                    cell[1] += amount
+                    cell[2] += flagged
+
+    @staticmethod
+    def dimensions_of(record: Dict, doc_type: str) -> Dict[str, str]:
+        """Dimension values of a raw invoice/PO record"""
+        dims = {
+            "vendor": normalize_vendor(record.get("vendor", "")),
+            "status": str(record.get("status", "")).lower(),
+            "month": str(record.get(DATE_FIELDS[doc_type], ""))[:7],
+        }
+        if doc_type == "po":
+            dims["department"] = str(record.get("department", "")).lower()
+        return dims
+
+    def display_name(self, dimension: str, value: str) -> str:
+        """How a canonical dimension value is written in the records ("techcorp" -> "TechCorp")"""
+        return self.display.get((dimension, value), value)
+
+    def get(self, doc_type: str, **filters) -> Dict[str, Any]:
+        """Aggregates for the records matching all filters (constant time)"""
+        key = (doc_type,) + tuple(sorted((name, str(value).lower()) for name, value in filters.items()))
+        count, total, flagged = self.cells.get(key, (0, 0.0, 0))
+        return {
+            "count": count,
+            "total_amount": round(total, 2),
+            "flagged": flagged,
+            "flagged_rate": round(flagged / count, 4) if count else 0.0,
+        }
+
+    def group_by(self, doc_type: str, dimension: str, **filters) -> Dict[str, Dict[str, Any]]:
+        """Aggregates per value of one dimension, skipping empty groups"""
+        groups = {}
+        for value in sorted(self.values[doc_type].get(dimension, ())):
+            stats = self.get(doc_type, **{**filters, dimension: value})
+            if stats["count"]:
+                groups[value] = stats
+        return groups
+
+    def parse_query(self, query: str) -> Dict[str, Any]:
+        """Turn an aggregate question into a doc type, filters, group-by and metric"""
+        text = query.lower()
+        doc_type = "po" if re.search(r"\b(po|pos|purchase orders?)\b", text) else "invoice"
+
+        filters = {}
+        if self.vendor_resolver:
+            known = self.values[doc_type].get("vendor", ())
+            vendors = [vendor for vendor in self.vendor_resolver(query) if vendor in known]
+            if vendors:
+                filters["vendor"] = vendors[0]
+        for name in ("vendor", "status", "department"):
+            if name in filters:
+                continue
+            for value in self.values[doc_type].get(name, ()):
+                if value and re.search(rf"\b{re.escape(value).replace('_', '[ _]')}\b", text):
+                    filters[name] = value
+                    break
+        month = self._parse_month(text)
+        if month:
+            filters["month"] = month
+        # "flagged rate" asks about all invoices, not only the flagged ones
+        if re.search(r"\b(rate|percent|percentage|share)\b", text) and filters.get("status") == "flagged":
+            del filters["status"]
+
+        group_match = re.search(r"\b(?:by|per|for each)\s+(vendor|status|department|month)\b", text)
+        if re.search(r"\b(rate|percent|percentage|share)\b", text):
+            metric = "flagged_rate"
+        elif re.search(r"\b(total|sum|value|amount|spend)\b", text) and not re.search(r"\bhow many\b", text):
+            metric = "total_amount"
+        else:
+            metric = "count"
+        return {
+            "doc_type": doc_type,
+            "filters": filters,
+            "group_by": group_match.group(1) if group_match else None,
+            "metric": metric,
+        }
+
+    def answer(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        """Evaluate a parsed aggregate query"""
+        if spec["group_by"]:
+            filters = {k: v for k, v in spec["filters"].items() if k != spec["group_by"]}
+            return {"groups": self.group_by(spec["doc_type"], spec["group_by"], **filters)}
+        return {"totals": self.get(spec["doc_type"], **spec["filters"])}
+
+    @staticmethod
+    def _parse_month(text: str) -> Optional[str]:
+        now = datetime.now()
+        if "this month" in text:
+            return now.strftime("%Y-%m")
+        if "last month" in text or "previous month" in text:
+            year, month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+            return f"{year:04d}-{month:02d}"
+        explicit = re.search(r"\b(\d{4})-(\d{2})\b", text)
+        if explicit:
+            return explicit.group(0)
+        for index, name in enumerate(MONTH_NAMES, 1):
+            if re.search(rf"\b{name}\b", text):
+                year_match = re.search(rf"\b{name}\s+(\d{{4}})\b", text)
+                if name == "may" and not year_match:
+                    continue  # too common as a verb to trust on its own
+                year = int(year_match.group(1)) if year_match else (now.year if index <= now.month else now.year - 1)
+                return f"{year:04d}-{index:02d}"
+        return None
@@ -0,0 +1,265 @@
+"""
+Statistical amount anomalies per vendor.
+
+For every vendor two running distributions are kept: log invoice amount, and
+log(invoice amount / linked PO amount). Each is a Welford mean/variance plus
+P² quantile sketches (median, p95), so ingesting an invoice is O(1) and no
+history is rescanned. Logs are used because amounts vary multiplicatively
+(a 10x invoice is equally unusual for a small and a large vendor).
+
+New or changed invoices are scored in batches with numpy: the z-score of the
+amount against the vendor's history and of the PO ratio against the vendor's
+usual PO variance. Scores are kept per invoice for the verifier, the flagged
+invoice explanations and "unusual invoices" questions.
+"""
+import math
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+from app.data.vendor_index import normalize_vendor
+
+
+class P2Quantile:
+    """Streaming quantile estimate in constant space (Jain & Chlamtac P² algorithm)"""
+
+    def __init__(self, p: float):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        # Move the three middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                candidate = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < candidate < q[i + 1]:
+                    candidate = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = candidate
+                n[i] += d
+
+    def value(self) -> Optional[float]:
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return self.heights[min(len(self.heights) - 1, int(self.p * len(self.heights)))]
+        return self.heights[2]
+
+
+class RunningStats:
+    """Welford mean/variance with removal, plus median and p95 sketches"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.median = P2Quantile(0.5)
+        self.p95 = P2Quantile(0.95)
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.median.add(x)
+        self.p95.add(x)
+
+    def remove(self, x: float):
+        """Undo add(x) for a changed record (the quantile sketches keep the old value)"""
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        delta = x - self.mean
+        self.mean = (self.mean * self.count - x) / (self.count - 1)
+        self.count -= 1
+        self.m2 = max(0.0, self.m2 - delta * (x - self.mean))
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class AnomalyScorer:
+    """
+    Per-vendor amount and PO-variance statistics with batched z-score scoring.
+    An invoice is anomalous when either |z| reaches `threshold`; vendors with
+    fewer than `min_history` invoices are not scored. `min_std` (in log units)
+    keeps vendors with near-identical amounts from flagging tiny deviations.
+    """
+
+    def __init__(self, threshold: float = 3.0, min_history: int = 5, min_std: float = 0.05):
+        self.threshold = threshold
+        self.min_history = min_history
+        self.min_std = min_std
+        self.amounts = {}   # vendor -> RunningStats of log amount
+        self.ratios = {}    # vendor -> RunningStats of log(invoice / PO amount)
+        self.observed = {}  # invoice id -> (vendor, log amount, log ratio or None)
+        self.scores = {}    # invoice id -> latest score
+
+    def update(self, invoices: List[Dict], pos_by_number: Dict[str, Dict]) -> List[Dict[str, Any]]:
+        """Fold new or changed invoices into the statistics, then score them as one batch"""
+        for invoice in invoices:
+            self.observe(invoice, pos_by_number.get(invoice.get("po_number")))
+        scored = self.score_batch(invoices, pos_by_number)
+        for result in scored:
+            self.scores[result["invoice_id"]] = result
+        return scored
+
+    def observe(self, invoice: Dict, po: Optional[Dict] = None):
+        """O(1) update; re-observing an unchanged invoice (e.g. a status change) is a no-op"""
+        features = self._features(invoice, po)
+        invoice_id = invoice["invoice_id"]
+        previous = self.observed.get(invoice_id)
+        if previous == features:
+            return
+        if previous:
+            self._apply(previous, remove=True)
+        self.observed[invoice_id] = features
+        self._apply(features)
+
+    def score_batch(self, invoices: List[Dict], pos_by_number: Dict[str, Dict]) -> List[Dict[str, Any]]:
+        """
+        Score invoices against the current vendor statistics (vectorized over the
+        batch). An invoice already folded into the statistics is scored against
+        them without its own value (leave-one-out): otherwise an outlier inflates
+        the spread it is measured by, and with n invoices |z| can never exceed
+        (n-1)/sqrt(n), below the threshold for any vendor with 10 or fewer.
+        """
+        if not invoices:
+            return []
+        features = [self._features(item, pos_by_number.get(item.get("po_number"))) for item in invoices]
+        # Rows whose current features are the ones counted in the statistics
+        included = np.array([self.observed.get(item["invoice_id"]) == feature
+                             for item, feature in zip(invoices, features)], dtype=bool)
+        vendors = [vendor for vendor, _, _ in features]
+        log_amount = np.array([value if value is not None else np.nan for _, value, _ in features])
+        log_ratio = np.array([value if value is not None else np.nan for _, _, value in features])
+        amount_mean, amount_std, amount_ok, amount_count = self._moments(self.amounts, vendors, log_amount, included)
+        ratio_mean, ratio_std, ratio_ok, _ = self._moments(self.ratios, vendors, log_ratio, included)
+
+        with np.errstate(invalid="ignore"):
+            z_amount = np.where(amount_ok & ~np.isnan(log_amount), (log_amount - amount_mean) / amount_std, 0.0)
+            z_ratio = np.where(ratio_ok & ~np.isnan(log_ratio), (log_ratio - ratio_mean) / ratio_std, 0.0)
+        score = np.maximum(np.abs(z_amount), np.abs(z_ratio))
+
+        results = []
+        for i, invoice in enumerate(invoices):
+            vendor = vendors[i]
+            stats = self.amounts.get(vendor)
+            reasons = []
+            if abs(z_amount[i]) >= self.threshold:
+                direction = "above" if z_amount[i] > 0 else "below"
+                reasons.append(f"Amount {float(invoice.get('total_amount', 0)):,.2f} is {abs(z_amount[i]):.1f}σ "
+                               f"{direction} {invoice.get('vendor')}'s typical {math.exp(amount_mean[i]):,.2f}")
+            if abs(z_ratio[i]) >= self.threshold:
+                reasons.append(f"Invoice/PO ratio {math.exp(log_ratio[i]):.2f} is {abs(z_ratio[i]):.1f}σ from "
+                               f"{invoice.get('vendor')}'s usual {math.exp(ratio_mean[i]):.2f}")
+            median = stats.median.value() if stats else None
+            p95 = stats.p95.value() if stats else None
+            results.append({
+                "invoice_id": invoice["invoice_id"],
+                "vendor": invoice.get("vendor"),
+                "score": round(float(score[i]), 3),
+                "z_amount": round(float(z_amount[i]), 3),
+                "z_po_ratio": round(float(z_ratio[i]), 3),
+                "vendor_history": int(amount_count[i]),
+                "vendor_median": round(math.exp(median), 2) if median is not None else None,
+                "vendor_p95": round(math.exp(p95), 2) if p95 is not None else None,
+                "anomalous": bool(reasons),
+                "reasons": reasons,
+            })
+        return results
+
+    def get(self, invoice_id: str) -> Optional[Dict[str, Any]]:
+        return self.scores.get(invoice_id)
+
+    def top(self, n: int = 10, anomalous_only: bool = True) -> List[Dict[str, Any]]:
+        """Highest-scoring invoices, best first"""
+        results = [r for r in self.scores.values() if r["anomalous"] or not anomalous_only]
+        if not results:
+            return []
+        scores = np.array([r["score"] for r in results])
+        n = min(n, len(results))
+        best = np.argpartition(-scores, n - 1)[:n]
+        return [results[i] for i in best[np.argsort(-scores[best], kind="stable")]]
+
+    def _features(self, invoice: Dict, po: Optional[Dict]) -> tuple:
+        vendor = normalize_vendor(invoice.get("vendor", ""))
+        amount = float(invoice.get("total_amount") or 0)
+        po_amount = float(po.get("total_amount") or 0) if po else 0.0
+        log_amount = math.log(amount) if amount > 0 else None
+        log_ratio = math.log(amount / po_amount) if amount > 0 and po_amount > 0 else None
+        return vendor, log_amount, log_ratio
+
+    def _apply(self, features: tuple, remove: bool = False):
+        vendor, log_amount, log_ratio = features
+        for table, value in ((self.amounts, log_amount), (self.ratios, log_ratio)):
+            if value is None:
+                continue
+            stats = table.setdefault(vendor, RunningStats())
+            if remove:
+                stats.remove(value)
+            else:
+                stats.add(value)
+
+    def _moments(self, table: Dict[str, RunningStats], vendors: List[str], values: np.ndarray,
+                 included: np.ndarray) -> tuple:
+        """
+        Per-row vendor mean, std (floored), whether there is enough history and
+        the history size, with the row's own value taken out where it is counted.
+        """
+        unique = {vendor: i for i, vendor in enumerate(dict.fromkeys(vendors))}
+        counts = np.zeros(len(unique))
+        means = np.zeros(len(unique))
+        m2s = np.zeros(len(unique))
+        for vendor, i in unique.items():
+            stats = table.get(vendor)
+            if stats:
+                counts[i], means[i], m2s[i] = stats.count, stats.mean, stats.m2
+        index = np.fromiter((unique[vendor] for vendor in vendors), dtype=np.int64, count=len(vendors))
+        count, mean, m2 = counts[index], means[index], m2s[index]
+
+        # Welford removal of the row's own value (the same update RunningStats.remove makes)
+        own = included & ~np.isnan(values) & (count > 1)
+        x = np.where(own, values, 0.0)
+        loo_count = count - own
+        with np.errstate(invalid="ignore", divide="ignore"):
+            loo_mean = np.where(own, (mean * count - x) / np.maximum(loo_count, 1), mean)
+            loo_m2 = np.maximum(np.where(own, m2 - (x - mean) * (x - loo_mean), m2), 0.0)
+            std = np.where(loo_count > 1, np.sqrt(loo_m2 / np.maximum(loo_count - 1, 1)), 0.0)
+        return loo_mean, np.maximum(std, self.min_std), loo_count >= self.min_history, loo_count
+
+if __name__ == "__main__":
+    from app.data.mock_invoices import generate_mock_invoices, generate_mock_pos
+
+    invoices = generate_mock_invoices(500)
+    pos = {po["po_number"]: po for po in generate_mock_pos(500)}
+    scorer = AnomalyScorer()
+    scorer.update(invoices, pos)
+    for result in scorer.top(5, anomalous_only=False):
+        print(result["invoice_id"], result["score"], result["reasons"])
@@ -0,0 +1,246 @@
+import os
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, Any, List
+
+# Allowed invoice status transitions
+TRANSITIONS = {
+    "pending": {"approved", "rejected", "flagged"},
+    "flagged": {"approved", "rejected", "pending"},
+    "rejected": {"pending"},
+    "approved": set(),
+}
+
+
+class ApprovalWorkflow:
+    """
+    Durable invoice status transitions (approve, reject, flag, reopen).
+
+    Every change is appended to a write-ahead log before it is applied, and
+    callers get their answer only once it is on disk. A single committer
+    thread group-commits whatever arrived within batch_window_ms: one write and
+    one fsync per batch, then one in-place update of the records, aggregates,
+    lexical index and vector metadata (no re-embedding). Idempotency keys make
+    retries safe: a key already committed returns the original entry.
+
+    The source JSON files are never rewritten; on startup the log is replayed
+    over them, so approvals survive restarts. Read-only workers serving a
+    published index generation refuse transitions: only the writer appends to
+    the log, and its statuses reach readers with the next generation.
+    """
+
+    def __init__(self, vector_store, wal_path: str = None, batch_window_ms: float = 5.0, max_batch: int = 256):
+        self.name = "ApprovalWorkflow"
+        self.vector_store = vector_store
+        self.wal_path = wal_path or os.getenv("APPROVALS_WAL_PATH", "data/approvals.wal")
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.committed = {}  # idempotency key -> entry
+        self.statuses = {}   # invoice id -> last logged status
+        self.seq = 0
+        self._queue = queue.Queue()
+        self._recovered = False
+        self._recover_lock = threading.Lock()
+        self._wal = None
+        self._thread = None
+        vector_store.ready_listeners.append(self.recover)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="approval-committer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def recover(self):
+        """Replay the log over the freshly loaded source records (runs once the stores are built)"""
+        with self._recover_lock:
+            if not self._recovered:
+                self._load_log()
+                self._recovered = True
+            # A published generation already has the logged statuses applied
+            if self.statuses and not self.vector_store.read_only:
+                self.vector_store.update_invoice_status(self.statuses)
+
+    def transition(self, invoice_id: str, status: str, idempotency_key: str = None, actor: str = None,
+                   reason: str = None, timeout: float = 10.0) -> Dict[str, Any]:
+        """
+        Durably move an invoice to `status` and return the log entry.
+        Raises KeyError for an unknown invoice and ValueError for a disallowed transition.
+        """
+        if status not in TRANSITIONS:
+            raise ValueError(f"Unknown status: {status}")
+        if self.vector_store.read_only:
+            raise ValueError("This worker serves a read-only index generation; send status changes to the writer")
+        if not self.vector_store.records["invoice"]:
+            self.vector_store.setup_vector_stores()
+        if not self._recovered:
+            self.recover()
+        self.start()
+        request = {
+            "invoice_id": invoice_id,
+            "status": status,
+            "idempotency_key": idempotency_key,
+            "actor": actor,
+            "reason": reason,
+        }
+        future = Future()
+        self._queue.put((request, future))
+        return future.result(timeout=timeout)
+
+    def approve(self, invoice_id: str, **kwargs) -> Dict[str, Any]:
+        return self.transition(invoice_id, "approved", **kwargs)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            # Group commit: gather whatever else arrives within the batch window
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: List):
+        """Validate, log (one fsync) and apply one batch; resolve every caller's future"""
+        entries = []
+        outcomes = []  # (future, entry or exception)
+        pending = {}   # idempotency key -> entry within this batch
+        effective = {}  # invoice id -> status after the earlier entries of this batch
+        for request, future in batch:
+            key = request["idempotency_key"]
+            previous = (self.committed.get(key) or pending.get(key)) if key else None
+            if previous:
+                outcomes.append((future, {**previous, "replayed": True}))
+                continue
+            invoice_id = request["invoice_id"]
+            record = self.vector_store.records["invoice"].get(invoice_id)
+            if record is None:
+                outcomes.append((future, KeyError(f"Invoice {invoice_id} not found")))
+                continue
+            current = effective.get(invoice_id, record.get("status"))
+            if current == request["status"]:
+                outcomes.append((future, {"invoice_id": invoice_id, "from": current, "to": current,
+                                          "idempotency_key": key, "unchanged": True}))
+                continue
+            if request["status"] not in TRANSITIONS.get(current, set()):
+                outcomes.append((future, ValueError(f"Invoice {invoice_id} cannot go from {current} to {request['status']}")))
+                continue
+            self.seq += 1
+            entry = {
+                "seq": self.seq,
+                "timestamp": datetime.now().isoformat(),
+                "invoice_id": invoice_id,
+                "from": current,
+                "to": request["status"],
+                "idempotency_key": key,
+                "actor": request["actor"],
+                "reason": request["reason"],
+            }
+            effective[invoice_id] = request["status"]
+            if key:
+                pending[key] = entry
+            entries.append(entry)
+            outcomes.append((future, entry))
+
+        if entries:
+            try:
+                self._append(entries)
+            except Exception as e:
+                print(f"Approval log write error: {e}")
+                self.seq -= len(entries)
+                if self._wal is not None:
+                    self._wal.close()
+                    self._wal = None
+                # Only the new transitions failed; replays and rejections keep their outcome
+                outcomes = [(future, e if any(outcome is entry for entry in entries) else outcome)
+                            for future, outcome in outcomes]
+                entries = []
+        if entries:
+            for entry in entries:
+                self.statuses[entry["invoice_id"]] = entry["to"]
+                if entry["idempotency_key"]:
+                    self.committed[entry["idempotency_key"]] = entry
+            try:
+                self.vector_store.update_invoice_status(effective)
+            except Exception as e:
+                # Already durable: the log is replayed over the records on the next recover()
+                print(f"Approval apply error: {e}")
+
+        for future, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def _append(self, entries: List[Dict[str, Any]]):
+        if self._wal is None:
+            os.makedirs(os.path.dirname(self.wal_path) or ".", exist_ok=True)
+            self._wal = open(self.wal_path, "a", encoding="utf-8")
+        start = self._wal.tell()
+        try:
+            self._wal.write("".join(json.dumps(entry) + "\n" for entry in entries))
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+        except OSError:
+            # Don't leave half a batch behind for the next one to be appended after
+            os.truncate(self.wal_path, start)
+            raise
+
+    def _load_log(self):
+        if not os.path.exists(self.wal_path):
+            return
+        valid_bytes = 0
+        with open(self.wal_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                valid_bytes += len(line)
+                self.seq = max(self.seq, entry["seq"])
+                self.statuses[entry["invoice_id"]] = entry["to"]
+                if entry.get("idempotency_key"):
+                    self.committed[entry["idempotency_key"]] = entry
+        # A torn tail from a crash mid-write was never acknowledged; cut it so new entries start on a clean line
+        if valid_bytes < os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(valid_bytes)
+
+    def history(self, invoice_id: str) -> List[Dict[str, Any]]:
+        """Logged transitions of one invoice, oldest first"""
+        if not os.path.exists(self.wal_path):
+            return []
+        with open(self.wal_path, "r", encoding="utf-8") as f:
+            entries = []
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if entry["invoice_id"] == invoice_id:
+                    entries.append(entry)
+            return entries
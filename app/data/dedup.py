@@ -0,0 +1,213 @@
+import math
+import re
+import zlib
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+class DuplicateDetector:
+    """
+    Finds duplicate and near-duplicate invoices without pairwise comparison.
+
+    Each invoice is placed in blocks keyed on vendor, a log-scale amount bucket
+    and a date window, and within those blocks on MinHash/LSH bands over its
+    line-item descriptions. A new invoice only probes its own and adjacent
+    blocks, so ingesting N invoices is a single near-linear pass. Confirmed
+    pairs are merged into clusters with union-find. Re-adding an invoice that
+    changed (amount, date, vendor or lines) moves it out of its old blocks and
+    cluster first.
+    """
+
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        amount_tolerance: float = 0.02,
+        date_window_days: int = 14,
+        similarity_threshold: float = 0.6,
+        seed: int = 42,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.amount_tolerance = amount_tolerance
+        self.date_window_days = date_window_days
+        self.similarity_threshold = similarity_threshold
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, MAX_HASH, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, MAX_HASH, size=num_perm, dtype=np.uint64)
+
+        self.buckets = defaultdict(list)  # (vendor, amount bucket, date bucket, band, band hash) -> invoice ids
+        self.signatures = {}
+        self.entries = {}                 # invoice id -> (amount, date ordinal)
+        self.blocks = {}                  # invoice id -> bucket keys it was stored under
+        self._parent = {}
+        self._members = {}                # cluster root -> member ids
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def add_many(self, invoices: List[Dict]) -> List[List[str]]:
+        """Ingest a batch of invoices and return the resulting duplicate clusters"""
+        for invoice in invoices:
+            self.add(invoice)
+        return self.clusters()
+
+    def add(self, invoice: Dict) -> List[str]:
+        """Ingest one invoice; returns the ids of the invoices it duplicates"""
+        invoice_id = invoice["invoice_id"]
+        vendor = self._normalize(invoice.get("vendor", ""))
+        amount = float(invoice.get("total_amount", 0))
+        date_ordinal = self._date_ordinal(invoice.get("invoice_date"))
+        signature = self.signature(invoice)
+        amount_blocks = self._neighbour_blocks(self._amount_position(amount))
+        date_blocks = self._neighbour_blocks(date_ordinal / (2 * self.date_window_days))
+        # A band's raw bytes are its bucket key
+        band_hashes = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        keys = [(vendor, amount_blocks[0], date_blocks[0], band, band_hash) for band, band_hash in enumerate(band_hashes)]
+
+        with self._lock:
+            if invoice_id in self.signatures:
+                if self.blocks.get(invoice_id) == keys and self.entries[invoice_id] == (amount, date_ordinal):
+                    return self.cluster_of(invoice_id, _locked=True)
+                # Changed since it was indexed: drop the old entry, then insert it as new
+                self._remove(invoice_id)
+
+            # Blocks are twice the tolerance wide, so any invoice within tolerance
+            # is either in the same block or in the nearer neighbouring one
+            candidates = set()
+            for amount_key in amount_blocks:
+                for date_key in date_blocks:
+                    for band, band_hash in enumerate(band_hashes):
+                        candidates.update(self.buckets.get((vendor, amount_key, date_key, band, band_hash), ()))
+
+            matches = [other_id for other_id in candidates
+                       if self._similar(amount, date_ordinal, signature, other_id)]
+
+            self.signatures[invoice_id] = signature
+            self.entries[invoice_id] = (amount, date_ordinal)
+            self.blocks[invoice_id] = keys
+            self._parent[invoice_id] = invoice_id
+            self._members[invoice_id] = [invoice_id]
+            for key in keys:
+                self.buckets[key].append(invoice_id)
+            for other_id in matches:
+                self._union(invoice_id, other_id)
+            return sorted(matches)
+
+    def signature(self, invoice: Dict) -> np.ndarray:
+        """MinHash signature over character 3-grams of the line-item descriptions"""
+        text = " ".join(self._normalize(li.get("description", "")) for li in invoice.get("line_items", []))
+        if not text:
+            # No line items: fall back to the amount so exact resubmissions still collide
+            text = f"{float(invoice.get('total_amount', 0)):.2f}"
+        shingles = {text[i:i + 3] for i in range(max(1, len(text) - 2))}
+        hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles], dtype=np.uint64)
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % MERSENNE_PRIME
+        return (permuted & MAX_HASH).min(axis=1)
+
+    def clusters(self) -> List[List[str]]:
+        """All duplicate clusters (groups of two or more invoices)"""
+        with self._lock:
+            groups = [sorted(members) for members in self._members.values() if len(members) > 1]
+        return sorted(groups, key=lambda group: group[0])
+
+    def cluster_of(self, invoice_id: str, _locked: bool = False) -> List[str]:
+        """Other invoices in the same duplicate cluster as invoice_id"""
+        if not _locked:
+            with self._lock:
+                return self.cluster_of(invoice_id, _locked=True)
+        if invoice_id not in self._parent:
+            return []
+        return sorted(other for other in self._members[self._find(invoice_id)] if other != invoice_id)
+
+    def _similar(self, amount: float, date_ordinal: int, signature: np.ndarray, other_id: str) -> bool:
+        """Whether an invoice is within tolerance of, and describes the same lines as, an indexed one"""
+        other_amount, other_date = self.entries[other_id]
+        if abs(other_date - date_ordinal) > self.date_window_days:
+            return False
+        if abs(other_amount - amount) > self.amount_tolerance * max(abs(amount), abs(other_amount), 1.0):
+            return False
+        return np.mean(self.signatures[other_id] == signature) >= self.similarity_threshold
+
+    def _remove(self, invoice_id: str):
+        """Take an invoice out of its buckets and cluster (caller holds the lock)"""
+        for key in self.blocks.pop(invoice_id, ()):
+            bucket = self.buckets.get(key)
+            if bucket and invoice_id in bucket:
+                bucket.remove(invoice_id)
+                if not bucket:
+                    del self.buckets[key]
+        members = [other for other in self._members.pop(self._find(invoice_id)) if other != invoice_id]
+        del self.signatures[invoice_id], self.entries[invoice_id], self._parent[invoice_id]
+        # Union-find cannot split a cluster, so rebuild what is left of it from its pairs
+        for member in members:
+            self._parent[member] = member
+            self._members[member] = [member]
+        for i, member in enumerate(members):
+            amount, date_ordinal = self.entries[member]
+            for other_id in members[i + 1:]:
+                if (self.blocks[member][0][0] == self.blocks[other_id][0][0]
+                        and self._similar(amount, date_ordinal, self.signatures[member], other_id)):
+                    self._union(member, other_id)
+
+    def _find(self, invoice_id: str) -> str:
+        parent = self._parent
+        while parent[invoice_id] != invoice_id:
+            parent[invoice_id] = parent[parent[invoice_id]]
+            invoice_id = parent[invoice_id]
+        return invoice_id
+
+    def _union(self, a: str, b: str):
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a == root_b:
+            return
+        # Merge the smaller cluster into the larger one
+        if len(self._members[root_a]) < len(self._members[root_b]):
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._members[root_a].extend(self._members.pop(root_b))
+
+    def _amount_position(self, amount: float) -> float:
+        # Log scale in units of two tolerances, so relative differences map to fixed distances
+        return math.log(max(abs(amount), 1.0)) / (-2 * math.log(1 - self.amount_tolerance))
+
+    @staticmethod
+    def _neighbour_blocks(position: float) -> tuple:
+        """The block a position falls in, followed by the neighbouring block nearest to it"""
+        block = math.floor(position)
+        return (block, block + 1 if position - block >= 0.5 else block - 1)
+
+    @staticmethod
+    def _date_ordinal(value: Optional[str]) -> int:
+        try:
+            return datetime.fromisoformat(value).toordinal()
+        except (TypeError, ValueError):
+            return 0
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9 ]", " ", str(text).lower())).strip()
+
+
+if __name__ == "__main__":
+    import json
+
+    with open("data/invoices/mock_invoices.json", "r") as f:
+        invoices = json.load(f)
+    detector = DuplicateDetector()
+    clusters = detector.add_many(invoices)
+    print(f"✅ Scanned {len(detector)} invoices, found {len(clusters)} duplicate clusters")
+    for cluster in clusters:
+        print(f"Cluster: {', '.join(cluster)}")
@@ -0,0 +1,138 @@
+"""
+Currency normalization with a dated FX rate table.
+
+Rates come from a local JSON file (FX_RATES_PATH, default data/fx/rates.json):
+
+    {"base": "USD", "rates": {"2025-01-01": {"EUR": 1.04, "GBP": 1.25}, ...}}
+
+where each rate is the value of one unit of the currency in the base
+currency, effective from its date until the next one. A lookup takes the
+latest rate on or before the requested date and is memoized per
+(currency, date), so a whole column of amounts is converted with one lookup
+per distinct (currency, day) and one vectorized multiply. Columns that are
+already in the base currency are returned untouched.
+"""
+import os
+import json
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.utils.date_range import date_ordinal
+
+
+class FXTable:
+    def __init__(self, path: str = None, base: str = None):
+        self.path = path or os.getenv("FX_RATES_PATH", "data/fx/rates.json")
+        self.base = base
+        self._dates = {}  # currency -> sorted YYYYMMDD ordinals
+        self._rates = {}  # currency -> rates aligned with _dates
+        self._memo = {}   # (currency, ordinal) -> rate or None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read the rate file (once); a missing file leaves only the base currency convertible"""
+        with self._lock:
+            if self._loaded:
+                return
+            table = {"base": self.base or "USD", "rates": {}}
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding="utf-8") as f:
+                    table = json.load(f)
+            self.base = (self.base or table.get("base") or "USD").upper()
+            series = {}
+            for day, rates in table.get("rates", {}).items():
+                ordinal = date_ordinal(day)
+                if ordinal is None:
+                    raise ValueError(f"Bad date {day!r} in FX rate file {self.path}")
+                for currency, rate in rates.items():
+                    series.setdefault(currency.upper(), []).append((ordinal, float(rate)))
+            for currency, points in series.items():
+                points.sort()
+                self._dates[currency] = np.array([day for day, _ in points], dtype=np.int64)
+                self._rates[currency] = np.array([rate for _, rate in points])
+            self._memo.clear()
+            self._loaded = True
+
+    def currencies(self) -> List[str]:
+        self.load()
+        return [self.base] + sorted(self._dates)
+
+    def rate(self, currency: str, day) -> Optional[float]:
+        """Base-currency value of one unit of currency on day (ISO string, date or YYYYMMDD); None if unknown"""
+        self.load()
+        currency = str(currency or self.base).upper()
+        if currency == self.base:
+            return 1.0
+        ordinal = day if isinstance(day, (int, np.integer)) else date_ordinal(day)
+        key = (currency, ordinal)
+        if key not in self._memo:
+            self._memo[key] = self._lookup(currency, ordinal)
+        return self._memo[key]
+
+    def _lookup(self, currency: str, ordinal: Optional[int]) -> Optional[float]:
+        dates = self._dates.get(currency)
+        if dates is None:
+            return None
+        if ordinal is None:
+            return float(self._rates[currency][-1])  # undated amounts use the latest rate
+        # Latest rate effective on or before the day; days before the table use its first rate
+        index = max(int(np.searchsorted(dates, ordinal, side="right")) - 1, 0)
+        return float(self._rates[currency][index])
+
+    def convert(self, amount: float, currency: str, day) -> Optional[float]:
+        rate = self.rate(currency, day)
+        return float(amount) * rate if rate is not None else None
+
+    def to_base(self, amounts: Iterable[float], currencies: Iterable[str], days: Iterable) -> np.ndarray:
+        """
+        Convert a column of amounts to the base currency (NaN where no rate is
+        known). Rates are looked up once per distinct (currency, day).
+        """
+        self.load()
+        amounts = np.asarray(list(amounts), dtype=float)
+        currencies = [str(currency or self.base).upper() for currency in currencies]
+        if all(currency == self.base for currency in currencies):
+            return amounts
+        # Days are parsed once per distinct (currency, day), not once per row
+        pairs = list(zip(currencies, days))
+        unique = {pair: index for index, pair in enumerate(dict.fromkeys(pairs))}
+        rates = np.array([self.rate(currency, day) for currency, day in unique], dtype=float)
+        index = np.fromiter((unique[pair] for pair in pairs), dtype=np.int64, count=len(pairs))
+        return amounts * rates[index]
+
+    def records_to_base(self, records: List[Dict], date_field: str,
+                        day_override: Optional[List] = None) -> np.ndarray:
+        """Base-currency total_amount column of raw invoice/PO records"""
+        return self.to_base(
+            (float(record.get("total_amount") or 0) for record in records),
+            (record.get("currency") for record in records),
+            day_override if day_override is not None else (record.get(date_field) for record in records),
+        )
+
+    def stats(self) -> Dict[str, object]:
+        self.load()
+        return {"base": self.base, "currencies": len(self._dates), "memoized": len(self._memo)}
+
+
+# Global FX table (loaded on first use)
+fx_rates = FXTable()
+
+
+if __name__ == "__main__":
+    import time
+
+    table = FXTable()
+    print(table.stats(), table.currencies())
+    rng = np.random.default_rng(0)
+    n = 200_000
+    amounts = rng.uniform(100, 10000, n)
+    days = [f"2025-{m:02d}-{d:02d}" for m, d in zip(rng.integers(1, 13, n), rng.integers(1, 29, n))]
+    for label, currencies in (("single currency", ["USD"] * n),
+                              ("multi currency", list(rng.choice(table.currencies(), n)))):
+        started = time.perf_counter()
+        converted = table.to_base(amounts, currencies, days)
+        print(f"{label}: {n} amounts in {(time.perf_counter() - started) * 1000:.0f} ms, "
+              f"total {np.nansum(converted):,.0f} {table.base}")
@@ -0,0 +1,310 @@
+"""
+Immutable index generations: one writer publishes, N read-only workers serve.
+
+The writer (an ingest job, cron, or an operator) builds the whole index into
+a new generation directory, writes its snapshot and manifest, and only then
+points CURRENT at it with an atomic rename:
+
+    <root>/generations/000007/chroma_db/       persisted vector collections
+    <root>/generations/000007/index.snapshot   snapshot of the in-memory structures
+    <root>/generations/000007/manifest.json    written last; marks the build complete
+    <root>/CURRENT                             "000007"
+
+API workers (INDEX_ROLE=reader) never build or write: they attach to the
+generation named by CURRENT, poll it, and when a new one is published load it
+next to the old one and swap the reference in one assignment, so a request
+sees either the old or the new generation and never a half-built one. A
+published generation is never modified, which is what lets every worker on
+the host read the same files. The Chroma data and the snapshot's MinHash
+signatures are shared through the page cache; every other snapshot section
+is unpickled into each worker's own memory, so a worker costs a full copy of
+the in-memory index.
+
+    python -m app.data.generations publish --keep 3
+    python -m app.data.generations status
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; publishing there relies on running a single writer
+    fcntl = None
+
+GENERATIONS_ROOT = os.getenv("INDEX_GENERATIONS_DIR", "data/generations")
+
+
+def generation_path(gen_id: str, root: str = None) -> str:
+    return os.path.join(root or GENERATIONS_ROOT, "generations", gen_id)
+
+
+def current_generation(root: str = None) -> Optional[str]:
+    """Id of the published generation, or None when nothing has been published yet"""
+    try:
+        with open(os.path.join(root or GENERATIONS_ROOT, "CURRENT"), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(gen_id: str, root: str = None) -> Dict[str, Any]:
+    with open(os.path.join(generation_path(gen_id, root), "manifest.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def list_generations(root: str = None) -> List[str]:
+    """Completed generations (those with a manifest), oldest first"""
+    base = os.path.join(root or GENERATIONS_ROOT, "generations")
+    if not os.path.isdir(base):
+        return []
+    return sorted(name for name in os.listdir(base)
+                  if os.path.exists(os.path.join(base, name, "manifest.json")))
+
+
+def publish(root: str = None, keep: int = 3, **manager_options) -> Dict[str, Any]:
+    """
+    Build a new generation from the source data (plus the logged status
+    changes) and make it current. Only one publisher runs at a time; readers
+    pick the generation up on their next poll.
+    """
+    from app.data.vector_store import VectorStoreManager
+    from app.data.approvals import ApprovalWorkflow
+    from app.data.snapshot import write_snapshot, layout
+
+    root = root or GENERATIONS_ROOT
+    os.makedirs(os.path.join(root, "generations"), exist_ok=True)
+    with _publish_lock(root):
+        base = os.path.join(root, "generations")
+        numbers = [int(name) for name in os.listdir(base) if name.isdigit()]
+        gen_id = f"{max(numbers, default=0) + 1:06d}"
+        path = generation_path(gen_id, root)
+        os.makedirs(path)
+        started = time.perf_counter()
+
+        # Step 1: build the stores into the new directory; the approval log is replayed over them
+        vector_store = VectorStoreManager(persist_directory=os.path.join(path, "chroma_db"), **manager_options)
+        approvals = ApprovalWorkflow(vector_store)
+        vector_store.setup_vector_stores(snapshot_path=False)
+
+        # Step 2: snapshot of the in-memory structures, then the manifest that marks the build complete
+        snapshot = write_snapshot(vector_store, os.path.join(path, "index.snapshot"))
+        manifest = {
+            "generation": gen_id,
+            "created_at": datetime.now().isoformat(),
+            "source_version": snapshot["source_version"],
+            "layout": layout(vector_store),
+            "invoices": len(vector_store.records["invoice"]),
+            "pos": len(vector_store.records["po"]),
+            "approvals_seq": approvals.seq,
+            "build_seconds": round(time.perf_counter() - started, 2),
+        }
+        _write_atomic(os.path.join(path, "manifest.json"), json.dumps(manifest, indent=2))
+        _fsync_dir(path)
+
+        # Step 3: flip the pointer
+        _write_atomic(os.path.join(root, "CURRENT"), gen_id)
+        _fsync_dir(root)
+        prune(root, keep=keep, locked=True)
+    return manifest
+
+
+def prune(root: str = None, keep: int = 3, locked: bool = False) -> List[str]:
+    """
+    Remove all but the newest `keep` generations (never the current one) and
+    any unfinished build left by a crashed publisher. Keep at least two so
+    readers still attached to the previous generation can finish swapping.
+    """
+    root = root or GENERATIONS_ROOT
+    if not locked:
+        with _publish_lock(root):
+            return prune(root, keep=keep, locked=True)
+    base = os.path.join(root, "generations")
+    if not os.path.isdir(base):
+        return []
+    current = current_generation(root)
+    complete = list_generations(root)
+    retained = set(complete[-max(keep, 2):]) | {current}
+    removed = [name for name in sorted(os.listdir(base)) if name not in retained]
+    for name in removed:
+        shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    return removed
+
+
+def open_generation(gen_id: str, root: str = None, embeddings=None):
+    """A read-only manager attached to one published generation (raises SnapshotError if it cannot attach)"""
+    from app.data.vector_store import VectorStoreManager
+
+    path = generation_path(gen_id, root)
+    manifest = read_manifest(gen_id, root)
+    settings = manifest["layout"]
+    vector_store = VectorStoreManager(
+        persist_directory=os.path.join(path, "chroma_db"),
+        shard_key=settings["shard_key"],
+        num_shards=settings["num_shards"] or 8,
+        time_partitioned=settings["time_partitioned"],
+        multi_vector=settings.get("multi_vector", False),
+        read_only=True,
+        embeddings=embeddings,
+    )
+    vector_store.setup_vector_stores(snapshot_path=os.path.join(path, "index.snapshot"))
+    vector_store.generation = gen_id
+    return vector_store
+
+
+def open_current(root: str = None, embeddings=None):
+    gen_id = current_generation(root)
+    if gen_id is None:
+        raise ValueError(f"No index generation published under {root or GENERATIONS_ROOT} "
+                         f"(run: python -m app.data.generations publish)")
+    return open_generation(gen_id, root, embeddings=embeddings)
+
+
+class GenerationWatcher:
+    """
+    Polls CURRENT in a read-only worker and hot-swaps to newly published
+    generations. The new generation is fully loaded before on_swap(vector_store)
+    is called; if loading fails the worker keeps serving the one it has and
+    does not retry that generation.
+    """
+
+    def __init__(self, on_swap: Callable, generation: str = None, root: str = None,
+                 interval_seconds: float = 2.0, embeddings=None, loader: Callable = None):
+        self.name = "GenerationWatcher"
+        self.on_swap = on_swap
+        self.generation = generation
+        self.root = root or GENERATIONS_ROOT
+        self.interval_seconds = interval_seconds
+        self.embeddings = embeddings
+        self.loader = loader or open_generation
+        self._failed = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def check(self) -> bool:
+        """Swap if a different generation is current; returns True when it swapped"""
+        gen_id = current_generation(self.root)
+        if gen_id is None or gen_id in (self.generation, self._failed):
+            return False
+        started = time.perf_counter()
+        try:
+            vector_store = self.loader(gen_id, self.root, embeddings=self.embeddings)
+        except Exception as e:
+            print(f"⚠️ Could not load index generation {gen_id}, still serving {self.generation}: {e}")
+            self._failed = gen_id
+            return False
+        self.on_swap(vector_store)
+        print(f"🔄 Swapped index generation {self.generation} -> {gen_id} "
+              f"({(time.perf_counter() - started) * 1000:.0f} ms)")
+        self.generation = gen_id
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Generation watcher error: {e}")
+
+
+class _publish_lock:
+    """Exclusive lock so only one writer publishes or prunes at a time"""
+
+    def __init__(self, root: str):
+        self.path = os.path.join(root, ".publish.lock")
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a+")
+        if fcntl:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._file.close()
+                raise ValueError(f"Another writer is publishing ({self.path} is locked)")
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        return False
+
+
+def _write_atomic(path: str, text: str):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _fsync_dir(path: str):
+    """Make a rename inside path durable (no-op where directories can't be opened, e.g. Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Publish and inspect immutable index generations")
+    parser.add_argument("--root", default=GENERATIONS_ROOT)
+    commands = parser.add_subparsers(dest="command", required=True)
+    publish_cmd = commands.add_parser("publish", help="Build a new generation and make it current")
+    publish_cmd.add_argument("--keep", type=int, default=3, help="Completed generations to keep")
+    commands.add_parser("status", help="Show the current generation and the ones on disk")
+    prune_cmd = commands.add_parser("prune", help="Remove old and unfinished generations")
+    prune_cmd.add_argument("--keep", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "publish":
+            manifest = publish(args.root, keep=args.keep)
+            print(f"✅ Published generation {manifest['generation']}: {manifest['invoices']} invoices / "
+                  f"{manifest['pos']} POs in {manifest['build_seconds']} s")
+        elif args.command == "prune":
+            removed = prune(args.root, keep=args.keep)
+            print(f"🧹 Removed {len(removed)} generation(s): {', '.join(removed) or '-'}")
+        else:
+            current = current_generation(args.root)
+            print(f"Current generation: {current or '(none published)'}")
+            for gen_id in list_generations(args.root):
+                manifest = read_manifest(gen_id, args.root)
+                marker = "*" if gen_id == current else " "
+                print(f" {marker} {gen_id}  {manifest['created_at']}  {manifest['invoices']} invoices / "
+                      f"{manifest['pos']} POs  source {manifest['source_version'][:12]}")
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+
+from app.data.lexical_index import LexicalIndex, identifier_ratio
+from app.data.multi_vector import group_hits
+from app.utils.deadline import Deadline
+
+
+class HybridRetriever:
+    """
+    Fuses BM25 and vector results with weighted reciprocal rank fusion.
+    Queries dominated by identifiers (INV-1023, ITEM-1234, emails) skip the
+    embedding model and are answered from the lexical index alone. With
+    group_children, vector hits on header/line-item vectors are collapsed to
+    their parent documents before fusion. With a timeout (seconds) the vector
+    search is skipped once BM25 has used up the time, and fan-out stores get
+    what is left of it.
+    """
+
+    def __init__(
+        self,
+        vector_store,
+        lexical_index: LexicalIndex,
+        k: int = 5,
+        mode: str = "hybrid",
+        vector_weight: float = 1.0,
+        lexical_weight: float = 1.0,
+        rrf_k: int = 60,
+        fetch_k: int = None,
+        identifier_threshold: float = 0.5,
+        group_children: bool = False,
+        child_fetch_factor: int = 3,
+        timeout: float = None,
+    ):
+        if mode not in ("hybrid", "vector", "lexical"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.k = k
+        self.mode = mode
+        self.vector_weight = vector_weight
+        self.lexical_weight = lexical_weight
+        self.rrf_k = rrf_k
+        self.fetch_k = fetch_k or k * 4
+        self.identifier_threshold = identifier_threshold
+        self.group_children = group_children
+        self.child_fetch_factor = child_fetch_factor
+        self.timeout = timeout
+
+    def invoke(self, query: str) -> List[Document]:
+        """Retrieve the top-k documents (same interface as a LangChain retriever)"""
+        return [doc for doc, _ in self.invoke_with_scores(query)]
+
+    def invoke_with_scores(self, query: str) -> List[Tuple[Document, float]]:
+        """Retrieve the top-k documents with their fused scores"""
+        deadline = Deadline(self.timeout * 1000 if self.timeout is not None else None)
+        use_vector = self.mode in ("hybrid", "vector") and self.vector_weight > 0
+        use_lexical = self.mode in ("hybrid", "lexical") and self.lexical_weight > 0
+
+        # Partitioned stores may bound the query (e.g. by date); apply the same bound to BM25 hits
+        document_filter = getattr(self.vector_store, "document_filter", None)
+        keep = document_filter(query) if document_filter else None
+
+        ranked_lists = []
+        if use_lexical:
+            lexical_hits = self.lexical_index.search(query, k=self.fetch_k * (4 if keep else 1))
+            if keep:
+                lexical_hits = [(doc, score) for doc, score in lexical_hits if keep(doc)][:self.fetch_k]
+            ranked_lists.append(([doc for doc, _ in lexical_hits], self.lexical_weight))
+
+            # Exact-token queries gain nothing from embeddings, so save the model call
+            if lexical_hits and use_vector and identifier_ratio(query) >= self.identifier_threshold:
+                use_vector = False
+
+        # Out of time after BM25: answer from the lexical hits rather than start an embedding call
+        if use_vector and ranked_lists and deadline.expired():
+            use_vector = False
+
+        if use_vector:
+            # Sharded/partitioned stores stop waiting on slow shards; a single collection call cannot be cut short
+            search_options = ({"timeout": deadline.remaining()}
+                              if getattr(self.vector_store, "accepts_timeout", False) else {})
+            if self.group_children:
+                # Several vectors per parent: over-fetch so fetch_k distinct parents usually survive grouping
+                vector_hits = self.vector_store.similarity_search_with_score(
+                    query, k=self.fetch_k * self.child_fetch_factor, **search_options
+                )
+                vector_docs = group_hits(vector_hits, self.lexical_index.documents.get)[:self.fetch_k]
+            else:
+                vector_docs = [doc for doc, _ in self.vector_store.similarity_search_with_score(
+                    query, k=self.fetch_k, **search_options)]
+            ranked_lists.append((vector_docs, self.vector_weight))
+
+        if len(ranked_lists) == 1:
+            docs = ranked_lists[0][0][:self.k]
+            return [(doc, 1.0 / (self.rrf_k + rank)) for rank, doc in enumerate(docs, 1)]
+        return self._fuse(ranked_lists)
+
+    def _fuse(self, ranked_lists: list) -> List[Tuple[Document, float]]:
+        """Weighted reciprocal rank fusion keyed on document id"""
+        scores = {}
+        docs = {}
+        for ranked_docs, weight in ranked_lists:
+            for rank, doc in enumerate(ranked_docs, 1):
+                doc_id = doc.metadata.get("id")
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight / (self.rrf_k + rank)
+                docs.setdefault(doc_id, doc)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:self.k]
+        return [(docs[doc_id], score) for doc_id, score in ranked]
@@ -0,0 +1,112 @@
+import math
+import re
+import heapq
+import threading
+from collections import Counter, defaultdict
+from typing import List, Tuple
+
+from langchain_core.documents import Document
+
+# Keeps compound identifiers (INV-1023, ITEM-1234, manager1@company.com, 8391.49) as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_.@][a-z0-9]+)*")
+IDENTIFIER_PATTERN = re.compile(r"^(?:[^@\s]+@[^@\s]+|(?=.*\d)[a-z0-9]+(?:[-_.][a-z0-9]+)*)$")
+
+# Words that carry no lexical signal in invoice questions
+STOPWORDS = {
+    "a", "an", "and", "about", "are", "by", "details", "detail", "find", "for", "from",
+    "get", "give", "in", "invoice", "invoices", "is", "it", "list", "me", "of", "on",
+    "please", "po", "pos", "purchase", "order", "orders", "show", "the", "to", "was",
+    "what", "which", "who", "why", "with",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase tokens, adding the parts of compound identifiers"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = re.split(r"[-_.@]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+def identifier_ratio(query: str) -> float:
+    """Fraction of meaningful query tokens that look like identifiers (IDs, emails, amounts)"""
+    terms = [t for t in TOKEN_PATTERN.findall(query.lower()) if t not in STOPWORDS]
+    if not terms:
+        return 0.0
+    return sum(1 for t in terms if IDENTIFIER_PATTERN.match(t)) / len(terms)
+
+
+class LexicalIndex:
+    """
+    In-memory BM25 inverted index over the rendered invoice/PO text.
+    Documents are keyed by their metadata id, so re-adding a document replaces it.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_terms = {}                # doc_id -> Counter of terms
+        self.doc_lengths = {}
+        self.documents = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_documents(self, documents: List[Document]):
+        """Index (or re-index) documents incrementally"""
+        with self._lock:
+            for doc in documents:
+                doc_id = doc.metadata["id"]
+                self._remove(doc_id)
+                terms = Counter(tokenize(doc.page_content))
+                for term, tf in terms.items():
+                    self.postings[term][doc_id] = tf
+                length = sum(terms.values())
+                self.doc_terms[doc_id] = terms
+                self.doc_lengths[doc_id] = length
+                self.documents[doc_id] = doc
+                self.total_length += length
+
+    def remove(self, doc_id: str):
+        """Drop a document from the index"""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id: str):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+        del self.documents[doc_id]
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[Document, float]]:
+        """Return the top-k documents by BM25 score"""
+        with self._lock:
+            n_docs = len(self.documents)
+            if n_docs == 0:
+                return []
+            avg_length = self.total_length / n_docs
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                df = len(posting)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self.documents[doc_id], score) for doc_id, score in top]
@@ -0,0 +1,101 @@
+"""
+Multi-vector indexing: several short vectors per invoice/PO instead of one long one.
+
+The full rendering (render_document) dilutes the header fields and every
+line item into one embedding, padded with indentation. In multi-vector mode
+each record is embedded as a compact canonical header plus one vector per
+line item. Line-item vectors carry parent_id; at search time hits are grouped
+back to their parent, which is returned as the full document from the lexical
+index with the matched line items attached. The lexical index keeps the full
+rendering, so BM25, lookups by id and answers are unchanged.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+
+def render_header(item: Dict, doc_type: str) -> str:
+    """One-line canonical header text"""
+    if doc_type == "invoice":
+        parts = [
+            f"Invoice {item['invoice_id']}",
+            f"PO {item['po_number']}" if item.get("po_number") else "no PO",
+            item["vendor"],
+            f"{item['total_amount']} {item['currency']}",
+            item["status"],
+            f"dated {item['invoice_date'][:10]} due {item['due_date'][:10]}",
+        ]
+        if item.get("flagged_reasons"):
+            parts.append("flagged: " + "; ".join(item["flagged_reasons"]))
+    else:
+        parts = [
+            f"Purchase order {item['po_number']}",
+            item["vendor"],
+            item["department"],
+            f"{item['total_amount']} {item['currency']}",
+            item["status"],
+            f"created {item['created_date'][:10]} delivery {item['delivery_date'][:10]}",
+            f"approver {item['approver']}",
+        ]
+    return " | ".join(parts)
+
+
+def render_line_item(item: Dict, line: Dict, doc_type: str) -> str:
+    """One line item, with just enough of the parent to place it"""
+    if doc_type == "invoice":
+        return (f"{line['description']}: qty {line['quantity']} @ {line['unit_price']} "
+                f"on invoice {item['invoice_id']} from {item['vendor']}")
+    return (f"{line['description']}: ordered {line['quantity_ordered']}, received {line['quantity_received']} "
+            f"on {item['po_number']} from {item['vendor']}")
+
+
+def expand_documents(documents: List[Document], records: List[Optional[Dict]], doc_type: str) -> List[Document]:
+    """
+    Vector documents for rendered documents and their raw records: a header
+    (same id as the parent) and one child per line item (id "<parent>#<n>").
+    Children copy the parent's metadata so shard, partition and date filters
+    apply to them too. A missing record yields the header only.
+    """
+    expanded = []
+    for doc, item in zip(documents, records):
+        parent_id = doc.metadata["id"]
+        if item is None:
+            expanded.append(doc)
+            continue
+        expanded.append(Document(page_content=render_header(item, doc_type), metadata=dict(doc.metadata)))
+        for n, line in enumerate(item.get("line_items", [])):
+            metadata = {**doc.metadata, "id": f"{parent_id}#{n}", "parent_id": parent_id,
+                        "line_item": n, "description": line["description"]}
+            expanded.append(Document(page_content=render_line_item(item, line, doc_type), metadata=metadata))
+    return expanded
+
+
+def group_hits(hits: List[Tuple[Document, float]], parents: Callable[[str], Optional[Document]]) -> List[Document]:
+    """
+    Collapse header/line-item hits to their parents, in order of each parent's
+    best hit. parents(id) returns the full document; children left over from a
+    record that has since lost line items are ignored.
+    """
+    order = []
+    matched = {}
+    for doc, _ in hits:
+        parent_id = doc.metadata.get("parent_id", doc.metadata.get("id"))
+        parent = parents(parent_id)
+        if parent is None:
+            continue
+        line = doc.metadata.get("line_item")
+        if line is not None and line >= parent.metadata.get("line_items", 0):
+            continue
+        if parent_id not in matched:
+            order.append(parent)
+            matched[parent_id] = []
+        if line is not None and doc.metadata.get("description") not in matched[parent_id]:
+            matched[parent_id].append(doc.metadata.get("description"))
+    grouped = []
+    for parent in order:
+        items = matched[parent.metadata["id"]]
+        if items:
+            parent = Document(page_content=parent.page_content,
+                              metadata={**parent.metadata, "matched_line_items": items})
+        grouped.append(parent)
+    return grouped
@@ -0,0 +1,190 @@
+import re
+import zlib
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Set, Tuple
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from app.data.vendor_index import normalize_vendor
+
+SHARD_KEYS = ("vendor_hash", "business_unit", "fiscal_period")
+DATE_FIELDS = {"invoice": "invoice_date", "po": "created_date"}
+
+
+class ShardRouter:
+    """
+    Maps records and queries to shard names for one partitioning key:
+      - vendor_hash:   stable hash of the vendor name into num_shards buckets
+      - business_unit: PO department (invoices inherit it from their linked PO)
+      - fiscal_period: fiscal quarter of the invoice/PO date, e.g. "2025-q3"
+    """
+
+    def __init__(self, shard_key: str, num_shards: int = 8, fiscal_year_start_month: int = 1):
+        if shard_key not in SHARD_KEYS:
+            raise ValueError(f"Unknown shard key: {shard_key} (expected one of {', '.join(SHARD_KEYS)})")
+        self.shard_key = shard_key
+        self.num_shards = num_shards
+        self.fiscal_year_start_month = fiscal_year_start_month
+
+    def shard_for_record(self, record: Dict, doc_type: str, po_records: Dict[str, Dict] = None) -> str:
+        """Shard a raw invoice/PO record belongs to"""
+        if self.shard_key == "vendor_hash":
+            return self._vendor_shard(record.get("vendor", ""))
+        if self.shard_key == "business_unit":
+            if doc_type == "po":
+                department = record.get("department")
+            else:
+                po = (po_records or {}).get(record.get("po_number"))
+                department = po.get("department") if po else None
+            return self._slug(department or "unassigned")
+        return self._fiscal_period(str(record.get(DATE_FIELDS[doc_type], ""))[:7])
+
+    def shards_for_query(self, query: str, vendors: Set[str] = (), departments: Set[str] = ()) -> Optional[Set[str]]:
+        """Shards a query is pinned to, or None when it has to fan out to all of them"""
+        text = query.lower()
+        if self.shard_key == "vendor_hash":
+            pinned = {self._vendor_shard(v) for v in vendors if v and re.search(rf"\b{re.escape(v.lower())}\b", text)}
+        elif self.shard_key == "business_unit":
+            pinned = {self._slug(d) for d in departments if d and self._mentions_department(query, d)}
+        else:
+            pinned = set()
+            for match in re.finditer(r"\b(?:q([1-4])\s*(?:fy)?\s*(\d{4})|(\d{4})\s*-?\s*q([1-4]))\b", text):
+                quarter, year = (match.group(1), match.group(2)) if match.group(1) else (match.group(4), match.group(3))
+                pinned.add(f"{year}-q{quarter}")
+            for match in re.finditer(r"\b(\d{4})-(\d{2})\b", text):
+                pinned.add(self._fiscal_period(match.group(0)))
+        return pinned or None
+
+    @staticmethod
+    def _mentions_department(query: str, department: str) -> bool:
+        """
+        Whether a query names a department. Acronyms ("IT", "HR") must appear in
+        capitals so the pronoun "it" does not pin a query, unless written as an
+        explicit phrase ("it department", "dept: it"); other names match in any case.
+        """
+        name = re.escape(department)
+        if department.isupper() and re.search(rf"\b{name}\b", query):
+            return True
+        if re.search(rf"\b{name}\s+(?:department|dept)\b|\b(?:department|dept)\.?\s*[:=]?\s*{name}\b",
+                     query, re.IGNORECASE):
+            return True
+        return not department.isupper() and re.search(rf"\b{name}\b", query, re.IGNORECASE) is not None
+
+    def _vendor_shard(self, vendor: str) -> str:
+        # Canonical name, so every spelling of a vendor lands in the same shard
+        return f"v{zlib.crc32(normalize_vendor(vendor).encode('utf-8')) % self.num_shards:02d}"
+
+    def _fiscal_period(self, year_month: str) -> str:
+        try:
+            year, month = int(year_month[:4]), int(year_month[5:7])
+        except ValueError:
+            return "undated"
+        offset = (month - self.fiscal_year_start_month) % 12
+        fiscal_year = year + 1 if self.fiscal_year_start_month > 1 and month >= self.fiscal_year_start_month else year
+        return f"{fiscal_year}-q{offset // 3 + 1}"
+
+    @staticmethod
+    def _slug(value: str) -> str:
+        return re.sub(r"[^a-z0-9]+", "_", str(value).lower()).strip("_") or "unassigned"
+
+
+class ShardedStore:
+    """
+    A set of Chroma collections ("<base>__<shard>") that looks like a single store.
+
+    Shards are created on first write, so adding a shard never touches the
+    others. Searches embed the query once, then either hit only the shards the
+    query is pinned to or fan out to every shard in parallel and merge the
+    per-shard results into a global top-k by distance.
+    """
+
+    # Searches take a timeout (see HybridRetriever)
+    accepts_timeout = True
+
+    def __init__(self, client, embeddings, base_name: str, router: ShardRouter,
+                 vocabulary=None, max_workers: int = 8):
+        self.client = client
+        self.embeddings = embeddings
+        self.base_name = base_name
+        self.router = router
+        self.vocabulary = vocabulary or (lambda: ((), ()))  # -> (vendors, departments) for query routing
+        self.shards = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{base_name}-shard")
+        self._discover()
+
+    def _discover(self):
+        """Reattach to shards persisted by an earlier run"""
+        prefix = f"{self.base_name}__"
+        for collection in self.client.list_collections():
+            if collection.name.startswith(prefix):
+                self._shard(collection.name[len(prefix):])
+
+    def _shard(self, name: str) -> Chroma:
+        with self._lock:
+            store = self.shards.get(name)
+            if store is None:
+                store = Chroma(
+                    client=self.client,
+                    collection_name=f"{self.base_name}__{name}",
+                    embedding_function=self.embeddings,
+                )
+                self.shards[name] = store
+            return store
+
+    def add_documents(self, documents: List[Document], ids: List[str] = None):
+        """Upsert documents into the shard named by their "shard" metadata"""
+        ids = ids or [doc.metadata["id"] for doc in documents]
+        grouped = {}
+        for doc, doc_id in zip(documents, ids):
+            docs, doc_ids = grouped.setdefault(doc.metadata["shard"], ([], []))
+            docs.append(doc)
+            doc_ids.append(doc_id)
+        for name, (docs, doc_ids) in grouped.items():
+            self._shard(name).add_documents(docs, ids=doc_ids)
+
+    def update_metadata(self, documents: List[Document]):
+        """Overwrite stored metadata in place (no re-embedding), per the shard named in each document"""
+        grouped = {}
+        for doc in documents:
+            ids, metadatas = grouped.setdefault(doc.metadata["shard"], ([], []))
+            ids.append(doc.metadata["id"])
+            metadatas.append(doc.metadata)
+        for name, (ids, metadatas) in grouped.items():
+            self._shard(name)._collection.update(ids=ids, metadatas=metadatas)
+
+    def similarity_search_with_score(self, query: str, k: int = 4, shards: Set[str] = None,
+                                     timeout: float = None, **kwargs) -> List[Tuple[Document, float]]:
+        """
+        Top-k (document, distance) pairs across the routed or all shards. With a
+        timeout, shards that have not answered in time are dropped (queued ones
+        cancelled) and the merge uses the rest; TimeoutError if none answered.
+        """
+        if shards is None:
+            vendors, departments = self.vocabulary()
+            shards = self.router.shards_for_query(query, vendors, departments)
+        targets = [store for name, store in self.shards.items() if shards is None or name in shards]
+        if not targets:
+            return []
+
+        # Embed once and reuse the vector for every shard
+        embedding = self.embeddings.embed_query(query)
+        if len(targets) == 1:
+            return targets[0].similarity_search_by_vector_with_relevance_scores(embedding, k=k, **kwargs)
+        futures = [
+            self._executor.submit(store.similarity_search_by_vector_with_relevance_scores, embedding, k=k, **kwargs)
+            for store in targets
+        ]
+        done, pending = wait(futures, timeout=timeout)
+        for future in pending:
+            future.cancel()
+        if not done:
+            raise TimeoutError(f"No shard of {self.base_name} answered within {timeout * 1000:.0f} ms")
+        hits = []
+        for future in futures:
+            if future in done:
+                hits.extend(future.result())
+        return heapq.nsmallest(k, hits, key=lambda hit: hit[1])
@@ -0,0 +1,299 @@
+"""
+Versioned snapshot of the index's in-memory structures.
+
+Building the stores from JSON means re-rendering every document and
+rebuilding the lexical postings, aggregates, join maps and duplicate clusters.
+A snapshot writes all of that into one file so a new process loads it and is
+ready without touching the source data (the Chroma collections are persisted
+separately and are attached, not re-embedded).
+
+Layout (little-endian):
+    b"IRSNAP" + u16 format version | u64 header length | JSON header | sections
+Every section starts on a 64-byte boundary. Only dense numeric data (the
+MinHash signature matrix) is stored raw and read zero-copy from the mapping,
+so those pages are shared by every process mapping the file. Everything else
+(records, lexical postings, aggregates, vendors, anomaly statistics) is a
+pickled section that each process deserializes into its own memory: loading
+skips the rebuild, not the per-process copy. The header records each section's offset,
+length and SHA-256, the version of the source data it was built from and the
+layout settings it was built with, so a stale or mismatched snapshot is
+rejected instead of served.
+
+Snapshots are trusted local build artifacts (pickle); never load one from an
+untrusted source.
+
+    python -m app.data.snapshot build --out data/index.snapshot
+    python -m app.data.snapshot verify data/index.snapshot
+"""
+import gc
+import os
+import sys
+import json
+import mmap
+import time
+import pickle
+import struct
+import hashlib
+import argparse
+from datetime import datetime
+from typing import Dict, Any, List
+
+import numpy as np
+
+MAGIC = b"IRSNAP"
+FORMAT_VERSION = 5
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<6sHQ")
+
+
+class SnapshotError(ValueError):
+    """The snapshot is missing, corrupt, or does not match the source data or layout"""
+
+
+def source_version(paths: List[str]) -> str:
+    """Content hash of the source data files a snapshot is built from"""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_paths(vector_store) -> List[str]:
+    """Files the structures are derived from: the invoice/PO data and, when present, the FX rates behind amount totals"""
+    paths = [vector_store.invoice_path, vector_store.po_path]
+    fx_path = vector_store.aggregates.fx.path
+    if os.path.exists(fx_path):
+        paths.append(fx_path)
+    return paths
+
+
+def layout(vector_store) -> Dict[str, Any]:
+    """Settings that change what the structures contain; a snapshot only loads into a matching manager"""
+    return {
+        "shard_key": vector_store.router.shard_key if vector_store.router else None,
+        "num_shards": vector_store.router.num_shards if vector_store.router else None,
+        "time_partitioned": bool(vector_store.time_partitioned),
+        "multi_vector": bool(vector_store.multi_vector),
+        "dedup": [vector_store.duplicates.num_perm, vector_store.duplicates.bands],
+    }
+
+
+def collection_size(store) -> int:
+    if hasattr(store, "shards"):
+        return sum(shard._collection.count() for shard in store.shards.values())
+    return store._collection.count()
+
+
+def write_snapshot(vector_store, path: str) -> Dict[str, Any]:
+    """Write the manager's in-memory structures to path (atomically) and return the header"""
+    dedup = vector_store.duplicates
+    signature_ids = list(dedup.signatures)
+    signatures = (np.stack([dedup.signatures[i] for i in signature_ids]) if signature_ids
+                  else np.zeros((0, dedup.num_perm), dtype=np.uint64))
+
+    def lexical_state(index) -> Dict[str, Any]:
+        return {
+            "postings": dict(index.postings),
+            "doc_terms": index.doc_terms,
+            "doc_lengths": index.doc_lengths,
+            "documents": index.documents,
+            "total_length": index.total_length,
+        }
+
+    sections = {
+        "records": vector_store.records,
+        "invoices_by_po": dict(vector_store.invoices_by_po),
+        "invoice_lexical": lexical_state(vector_store.invoice_lexical),
+        "po_lexical": lexical_state(vector_store.po_lexical),
+        "aggregates": {
+            "cells": dict(vector_store.aggregates.cells),
+            "values": {doc_type: dict(values) for doc_type, values in vector_store.aggregates.values.items()},
+            "display": vector_store.aggregates.display,
+        },
+        "anomalies": vector_store.anomalies,
+        "vendors": vector_store.vendors,
+        "dedup": {
+            "signature_ids": signature_ids,
+            "buckets": dict(dedup.buckets),
+            "entries": dedup.entries,
+            "blocks": dedup.blocks,
+            "parent": dedup._parent,
+            "members": dedup._members,
+        },
+    }
+    payloads = {name: pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) for name, value in sections.items()}
+    payloads["dedup_signatures"] = np.ascontiguousarray(signatures).tobytes()
+
+    header = {
+        "format": FORMAT_VERSION,
+        "created_at": datetime.now().isoformat(),
+        "source_version": source_version(source_paths(vector_store)),
+        "layout": layout(vector_store),
+        "collections": {
+            "invoices": collection_size(vector_store.invoice_store),
+            "pos": collection_size(vector_store.po_store),
+        },
+        "sections": {},
+    }
+    # Offsets depend on the header's own size, so lay out with a generous fixed header slot
+    entries = {name: {"length": len(data), "sha256": hashlib.sha256(data).hexdigest(),
+                      "kind": "pickle"} for name, data in payloads.items()}
+    entries["dedup_signatures"].update(kind="ndarray", dtype=str(signatures.dtype), shape=list(signatures.shape))
+    header["sections"] = entries
+    header_slot = _align(len(json.dumps(header)) + 64 * len(entries) + 256)
+    offset = _align(PREAMBLE.size + header_slot)
+    for name in payloads:
+        entries[name]["offset"] = offset
+        offset = _align(offset + entries[name]["length"])
+    header_bytes = json.dumps(header).encode("utf-8")
+    if len(header_bytes) > header_slot:
+        raise SnapshotError("Snapshot header outgrew its slot")
+    header_bytes = header_bytes.ljust(header_slot, b" ")
+
+    tmp_path = f"{path}.tmp"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, data in payloads.items():
+            f.seek(entries[name]["offset"])
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return header
+
+
+def read_header(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        raise SnapshotError(f"No snapshot at {path}")
+    with open(path, "rb") as f:
+        preamble = f.read(PREAMBLE.size)
+        if len(preamble) < PREAMBLE.size:
+            raise SnapshotError(f"{path} is truncated")
+        magic, version, header_length = PREAMBLE.unpack(preamble)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not an index snapshot")
+        if version != FORMAT_VERSION:
+            raise SnapshotError(f"Snapshot format {version} is not supported (expected {FORMAT_VERSION})")
+        return json.loads(f.read(header_length))
+
+
+def load_snapshot(vector_store, path: str, verify: bool = True, check_source: bool = True) -> Dict[str, Any]:
+    """
+    Load a snapshot into a freshly constructed manager: the signatures are
+    mapped, every other section is unpickled. Raises SnapshotError when the
+    file is corrupt (checksums), was built from different source data or
+    with a different layout; the caller then rebuilds from JSON. check_source=False
+    skips the source data comparison (published generations are served as built).
+    """
+    header = read_header(path)
+    if check_source:
+        expected = source_version(source_paths(vector_store))
+        if header["source_version"] != expected:
+            raise SnapshotError("Snapshot was built from different source data")
+    if header["layout"] != layout(vector_store):
+        raise SnapshotError(f"Snapshot layout {header['layout']} does not match {layout(vector_store)}")
+
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapping)
+
+    def section(name: str) -> memoryview:
+        entry = header["sections"][name]
+        data = view[entry["offset"]:entry["offset"] + entry["length"]]
+        if len(data) != entry["length"]:
+            raise SnapshotError(f"Snapshot section {name} is truncated")
+        if verify and hashlib.sha256(data).hexdigest() != entry["sha256"]:
+            raise SnapshotError(f"Checksum mismatch in snapshot section {name}")
+        return data
+
+    # Unpickling allocates millions of small objects; pausing the cyclic GC avoids repeated full scans of them
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        loaded = {name: pickle.loads(section(name))
+                  for name, entry in header["sections"].items() if entry["kind"] == "pickle"}
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    entry = header["sections"]["dedup_signatures"]
+    # Zero-copy: the signature rows are views into the mapped file
+    signatures = np.frombuffer(section("dedup_signatures"), dtype=entry["dtype"]).reshape(entry["shape"])
+
+    # Filled in place: the reranker, aggregates and scheduler hold references to these objects
+    for doc_type, records in loaded["records"].items():
+        vector_store.records[doc_type].clear()
+        vector_store.records[doc_type].update(records)
+    vector_store.invoices_by_po.clear()
+    vector_store.invoices_by_po.update(loaded["invoices_by_po"])
+    for index, state in ((vector_store.invoice_lexical, loaded["invoice_lexical"]),
+                         (vector_store.po_lexical, loaded["po_lexical"])):
+        index.postings.clear()
+        index.postings.update(state["postings"])
+        index.doc_terms = state["doc_terms"]
+        index.doc_lengths = state["doc_lengths"]
+        index.documents = state["documents"]
+        index.total_length = state["total_length"]
+    aggregates = vector_store.aggregates
+    aggregates.cells.clear()
+    aggregates.cells.update(loaded["aggregates"]["cells"])
+    for doc_type, values in loaded["aggregates"]["values"].items():
+        aggregates.values[doc_type].clear()
+        aggregates.values[doc_type].update(values)
+    aggregates.display.clear()
+    aggregates.display.update(loaded["aggregates"]["display"])
+    vars(vector_store.anomalies).update(vars(loaded["anomalies"]))
+    vars(vector_store.vendors).update(vars(loaded["vendors"]))
+    dedup = vector_store.duplicates
+    dedup.buckets.clear()
+    dedup.buckets.update(loaded["dedup"]["buckets"])
+    dedup.entries = loaded["dedup"]["entries"]
+    dedup.blocks = loaded["dedup"]["blocks"]
+    dedup._parent = loaded["dedup"]["parent"]
+    dedup._members = loaded["dedup"]["members"]
+    dedup.signatures = dict(zip(loaded["dedup"]["signature_ids"], signatures))
+    return header
+
+
+def main(argv: List[str] = None) -> int:
+    from app.data.vector_store import VectorStoreManager
+
+    parser = argparse.ArgumentParser(description="Build or check the index snapshot")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build the stores from the source data and write a snapshot")
+    build.add_argument("--out", default=os.getenv("INDEX_SNAPSHOT_PATH", "data/index.snapshot"))
+    check = commands.add_parser("verify", help="Check a snapshot's checksums and source data version")
+    check.add_argument("path", nargs="?", default=os.getenv("INDEX_SNAPSHOT_PATH", "data/index.snapshot"))
+    args = parser.parse_args(argv)
+
+    vector_store = VectorStoreManager()
+    if args.command == "build":
+        vector_store.setup_vector_stores(snapshot_path=False)
+        header = write_snapshot(vector_store, args.out)
+        size = os.path.getsize(args.out)
+        print(f"✅ Snapshot written to {args.out} ({size / 1e6:.1f} MB, source {header['source_version'][:12]})")
+        return 0
+
+    started = time.perf_counter()
+    try:
+        header = load_snapshot(vector_store, args.path)
+    except SnapshotError as e:
+        print(f"❌ {e}")
+        return 1
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"✅ {args.path} is valid: built {header['created_at']}, source {header['source_version'][:12]}, "
+          f"{len(vector_store.records['invoice'])} invoices / {len(vector_store.records['po'])} POs, "
+          f"mapped in {elapsed:.0f} ms")
+    return 0
+
+
+def _align(value: int) -> int:
+    return (value + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import argparse
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from app.data.sharding import ShardedStore
+from app.utils.date_range import parse_date_range
+
+DATE_FIELDS = ("invoice_date", "due_date")
+
+
+class TimePartitionedStore(ShardedStore):
+    """
+    Invoice store laid out as one Chroma collection per invoice month.
+
+    A manifest next to the Chroma data keeps each partition's min/max
+    invoice_date and due_date, so a date-bounded question ("flagged invoices
+    this month", "what's due next week") only searches the partitions whose
+    range overlaps it, and recent-period latency does not grow with years of
+    history. Old partitions can be sealed (read-only) and compacted into one
+    partition per year without re-embedding.
+    """
+
+    def __init__(self, client, embeddings, base_name: str, manifest_path: str, max_workers: int = 8):
+        self.manifest_path = manifest_path
+        self.partitions = {}  # name -> {"invoice_date": [min, max], "due_date": [min, max], "sealed": bool, "months": [...]}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r") as f:
+                self.partitions = json.load(f)
+        super().__init__(client, embeddings, base_name, router=None, max_workers=max_workers)
+
+    def partition_for(self, metadata: Dict) -> str:
+        """Partition a document belongs to: its invoice month, or the year it was compacted into"""
+        ordinal = metadata.get("invoice_date_ord")
+        if not ordinal:
+            return "undated"
+        month = f"{ordinal // 10000:04d}-{ordinal // 100 % 100:02d}"
+        year = month[:4]
+        if month not in self.partitions and year in self.partitions:
+            return year
+        return month
+
+    def add_documents(self, documents: List[Document], ids: List[str] = None):
+        """
+        Route documents to their month partition and widen its date bounds.
+        Documents of sealed partitions must already be stored unchanged (e.g. a
+        rebuild from the source data after sealing); they are skipped, and any
+        new or changed one is rejected.
+        """
+        ids = ids or [doc.metadata["id"] for doc in documents]
+        writable, writable_ids = [], []
+        sealed = {}  # partition -> [(doc, id)]
+        for doc, doc_id in zip(documents, ids):
+            name = self.partition_for(doc.metadata)
+            doc.metadata["shard"] = name
+            if self.partitions.get(name, {}).get("sealed"):
+                sealed.setdefault(name, []).append((doc, doc_id))
+                continue
+            stats = self.partitions.setdefault(name, {"sealed": False, "months": [name]})
+            for field in DATE_FIELDS:
+                value = doc.metadata.get(f"{field}_ord")
+                if value:
+                    low, high = stats.get(field, [value, value])
+                    stats[field] = [min(low, value), max(high, value)]
+            writable.append(doc)
+            writable_ids.append(doc_id)
+        for name, items in sealed.items():
+            self._check_unchanged(name, items)
+        if writable:
+            super().add_documents(writable, writable_ids)
+        self._save_manifest()
+
+    def _check_unchanged(self, name: str, items: List[Tuple[Document, str]]):
+        stored = self._shard(name).get(ids=[doc_id for _, doc_id in items], include=["documents"])
+        texts = dict(zip(stored["ids"], stored["documents"]))
+        changed = [doc_id for doc, doc_id in items if texts.get(doc_id) != doc.page_content]
+        if changed:
+            raise ValueError(f"Invoice partition {name} is read-only (new or changed: {', '.join(changed[:5])})")
+
+    def update_metadata(self, documents: List[Document]):
+        """Metadata-only updates (e.g. status changes); allowed on sealed partitions, whose dates and contents don't move"""
+        for doc in documents:
+            doc.metadata["shard"] = self.partition_for(doc.metadata)
+        super().update_metadata(documents)
+
+    def overlapping(self, field: str, start: int, end: int) -> List[str]:
+        """Partitions whose [min, max] for field intersects [start, end]"""
+        names = []
+        for name, stats in self.partitions.items():
+            bounds = stats.get(field)
+            if bounds and bounds[0] <= end and bounds[1] >= start:
+                names.append(name)
+        return names
+
+    def similarity_search_with_score(self, query: str, k: int = 4, date_range: Tuple[str, int, int] = None,
+                                     **kwargs) -> List[Tuple[Document, float]]:
+        """Search only the partitions overlapping the query's date range (all of them if unbounded)"""
+        date_range = date_range or parse_date_range(query)
+        if date_range is None:
+            return super().similarity_search_with_score(query, k=k, shards=set(self.shards), **kwargs)
+        field, start, end = date_range
+        names = set(self.overlapping(field, start, end))
+        if not names:
+            return []
+        # Partitions only bound the range; the filter keeps results exact inside them
+        date_filter = {"$and": [{f"{field}_ord": {"$gte": start}}, {f"{field}_ord": {"$lte": end}}]}
+        return super().similarity_search_with_score(query, k=k, shards=names, filter=date_filter, **kwargs)
+
+    def document_filter(self, query: str):
+        """Predicate applying the query's date bound to documents found by other indexes (e.g. BM25)"""
+        date_range = parse_date_range(query)
+        if date_range is None:
+            return None
+        field, start, end = date_range
+        return lambda doc: start <= (doc.metadata.get(f"{field}_ord") or 0) <= end
+
+    def ids_in_range(self, field: str, start: int, end: int) -> List[str]:
+        """Ids of the invoices in a date range, reading only the overlapping partitions"""
+        ids = []
+        date_filter = {"$and": [{f"{field}_ord": {"$gte": start}}, {f"{field}_ord": {"$lte": end}}]}
+        for name in self.overlapping(field, start, end):
+            ids.extend(self._shard(name).get(where=date_filter, include=[])["ids"])
+        return ids
+
+    def seal_before(self, month: str) -> List[str]:
+        """Make every partition older than month (YYYY-MM) read-only"""
+        sealed = []
+        for name, stats in self.partitions.items():
+            if max(stats["months"]) < month and not stats["sealed"]:
+                stats["sealed"] = True
+                sealed.append(name)
+        self._save_manifest()
+        return sealed
+
+    def compact_year(self, year: str) -> Optional[str]:
+        """Merge the sealed month partitions of a year into one partition, copying stored embeddings"""
+        months = [name for name, stats in self.partitions.items()
+                  if name.startswith(f"{year}-") and stats["sealed"]]
+        if not months:
+            return None
+        target = self._shard(year)
+        stats = self.partitions.setdefault(year, {"sealed": True, "months": []})
+        for name in sorted(months):
+            data = self._shard(name).get(include=["embeddings", "documents", "metadatas"])
+            if data["ids"]:
+                for metadata in data["metadatas"]:
+                    metadata["shard"] = year
+                target._collection.upsert(
+                    ids=data["ids"], embeddings=data["embeddings"],
+                    documents=data["documents"], metadatas=data["metadatas"]
+                )
+            month_stats = self.partitions.pop(name)
+            stats["months"].extend(month_stats["months"])
+            for field in DATE_FIELDS:
+                if field in month_stats:
+                    low, high = stats.get(field, month_stats[field])
+                    stats[field] = [min(low, month_stats[field][0]), max(high, month_stats[field][1])]
+            self.client.delete_collection(f"{self.base_name}__{name}")
+            with self._lock:
+                self.shards.pop(name, None)
+        stats["sealed"] = True
+        self._save_manifest()
+        return year
+
+    def _save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.partitions, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+
+def main(argv: List[str] = None) -> int:
+    import chromadb
+
+    parser = argparse.ArgumentParser(description="Seal and compact monthly invoice partitions")
+    parser.add_argument("--chroma-dir", default=os.getenv("CHROMA_DIR", "./data/chroma_db"))
+    commands = parser.add_subparsers(dest="command", required=True)
+    seal = commands.add_parser("seal", help="Make every partition older than a month read-only")
+    seal.add_argument("--before", required=True, help="YYYY-MM")
+    compact = commands.add_parser("compact", help="Merge a year's sealed month partitions into one")
+    compact.add_argument("--year", required=True, help="YYYY")
+    commands.add_parser("status", help="List the partitions and their date bounds")
+    args = parser.parse_args(argv)
+
+    # Sealing and compaction copy stored vectors; nothing is embedded, so no embedding model is loaded
+    store = TimePartitionedStore(
+        chromadb.PersistentClient(path=args.chroma_dir), None, "invoices",
+        manifest_path=os.path.join(args.chroma_dir, "invoice_partitions.json")
+    )
+    if args.command == "seal":
+        sealed = store.seal_before(args.before)
+        print(f"🔒 Sealed {len(sealed)} partition(s): {', '.join(sorted(sealed)) or '-'}")
+    elif args.command == "compact":
+        year = store.compact_year(args.year)
+        print(f"🗜️ Compacted {args.year}" if year else f"No sealed partitions for {args.year}")
+    else:
+        for name, stats in sorted(store.partitions.items()):
+            marker = "🔒" if stats["sealed"] else "  "
+            print(f"{marker} {name:10} invoice_date {stats.get('invoice_date')}  due_date {stats.get('due_date')}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
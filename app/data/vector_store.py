@@ -7,96 +7,359 @@ import chromadb
 from langchain_community.embeddings import HuggingFaceEmbeddings  # LOCAL EMBEDDINGS
 from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
-from typing import List, Dict
+from typing import List, Dict, Callable
+from collections import defaultdict
+
+from app.data.lexical_index import LexicalIndex
+from app.data.hybrid_retriever import HybridRetriever
+from app.data.dedup import DuplicateDetector
+from app.data.aggregates import AggregateStore
+from app.data.anomaly import AnomalyScorer
+from app.data.vendor_index import VendorIndex
+from app.data.sharding import ShardRouter, ShardedStore
+from app.data.time_partitions import TimePartitionedStore
+from app.data.multi_vector import expand_documents
+from app.data.snapshot import SnapshotError, collection_size, load_snapshot, read_header
+from app.utils.date_range import date_ordinal
 
 class VectorStoreManager:
-    def __init__(self, persist_directory: str = "./data/chroma_db"):
+    def __init__(self, persist_directory: str = None, shard_key: str = None, num_shards: int = 8,
+                 time_partitioned: bool = None, invoice_path: str = None, po_path: str = None,
+                 read_only: bool = False, embeddings=None, multi_vector: bool = None):
+        # Paths can be pointed elsewhere (e.g. a synthetic corpus for load tests) through the environment
+        persist_directory = persist_directory or os.getenv("CHROMA_DIR", "./data/chroma_db")
         self.persist_directory = persist_directory
+        self.invoice_path = invoice_path or os.getenv("INVOICE_DATA_PATH", "data/invoices/mock_invoices.json")
+        self.po_path = po_path or os.getenv("PO_DATA_PATH", "data/pos/mock_pos.json")
+        # Optional partitioning: vendor_hash, business_unit or fiscal_period (one collection per shard)
+        shard_key = shard_key or os.getenv("SHARD_KEY")
+        self.router = ShardRouter(shard_key, num_shards=num_shards) if shard_key else None
+        # Optional monthly invoice partitions with date-range pruning (takes precedence over shard_key for invoices)
+        if time_partitioned is None:
+            time_partitioned = os.getenv("INVOICE_PARTITIONING", "").lower() == "monthly"
+        self.time_partitioned = time_partitioned
+        # Optional multi-vector mode: a compact header vector plus one vector per line item (see multi_vector.py)
+        if multi_vector is None:
+            multi_vector = os.getenv("MULTI_VECTOR", "").lower() == "true"
+        self.multi_vector = multi_vector
+        # Read-only managers serve a published index generation: they never build, ingest or update
+        self.read_only = read_only
+        self.generation = None
         
         # USE LOCAL EMBEDDINGS - NO INTERNET REQUIRED
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="all-MiniLM-L6-v2"  # This downloads once and runs locally
-        )
-        print("✅ Using local embeddings (no internet required)")
+        if embeddings is None:
+            embeddings = HuggingFaceEmbeddings(
+                model_name="all-MiniLM-L6-v2"  # This downloads once and runs locally
+            )
+            print("✅ Using local embeddings (no internet required)")
+        self.embeddings = embeddings
         
         self.client = chromadb.PersistentClient(path=persist_directory)
         self.invoice_store = None
         self.po_store = None
+        # Lexical indexes are kept in step with the vector collections
+        self.invoice_lexical = LexicalIndex()
+        self.po_lexical = LexicalIndex()
+        # Raw records by id, and duplicate clusters over the invoices
+        self.records = {"invoice": {}, "po": {}}
+        self.duplicates = DuplicateDetector()
+        # Canonical vendor ids with fuzzy lookup, for verification and vendor filters in questions
+        self.vendors = VendorIndex()
+        self.aggregates = AggregateStore(vendor_resolver=lambda text: self.vendors.find_in_text(text))
+        # Per-vendor amount statistics; new invoices are scored as they arrive
+        self.anomalies = AnomalyScorer()
+        # Join index invoice <- po_number, and subscribers notified of record changes
+        self.invoices_by_po = defaultdict(set)
+        self.change_listeners = []
+        # Bumped on every write, so cached or shared results can tell they are out of date
+        self.index_version = 0
+        # Called once the stores are built (e.g. to replay logged status changes over the source data)
+        self.ready_listeners = []
 
-    def load_documents_from_json(self, file_path: str, doc_type: str) -> List[Document]:
+    def load_records_from_json(self, file_path: str) -> List[Dict]:
         with open(file_path, 'r') as f:
-            data = json.load(f)
-        documents = []
-        for item in data:
-            if doc_type == "invoice":
-                content = f"""
-                Invoice ID: {item['invoice_id']}
-                PO Number: {item.get('po_number', 'N/A')}
-                Vendor: {item['vendor']}
-                Total Amount: {item['total_amount']} {item['currency']}
-                Status: {item['status']}
-                Invoice Date: {item['invoice_date']}
-                Due Date: {item['due_date']}
-                
-                Line Items:
-                {chr(10).join([f"- {li['description']}: Qty {li['quantity']} @ ${li['unit_price']}" for li in item['line_items']])}
-                
-                Flagged Reasons: {', '.join(item.get('flagged_reasons', []))}
-                """
-            else:
-                content = f"""
-                PO Number: {item['po_number']}
-                Department: {item['department']}
-                Vendor: {item['vendor']}
-                Total Amount: {item['total_amount']} {item['currency']}
-                Status: {item['status']}
-                Created Date: {item['created_date']}
-                Delivery Date: {item['delivery_date']}
-                
-                Line Items:
-                {chr(10).join([f"- {li['description']}: Ordered {li['quantity_ordered']}, Received {li['quantity_received']}" for li in item['line_items']])}
-                
-                Approver: {item['approver']}
-                """
-            doc = Document(
-                page_content=content.strip(),
-                metadata={
-                    "type": doc_type,
-                    "id": item.get('invoice_id' if doc_type == 'invoice' else 'po_number'),
-                    "vendor": item['vendor'],
-                    "amount": item['total_amount'],
-                    "status": item['status']
-                }
+            return json.load(f)
+
+    def load_documents_from_json(self, file_path: str, doc_type: str) -> List[Document]:
+        return [self.render_document(item, doc_type) for item in self.load_records_from_json(file_path)]
+
+    def render_document(self, item: Dict, doc_type: str) -> Document:
+        if doc_type == "invoice":
+            content = f"""
+            Invoice ID: {item['invoice_id']}
+            PO Number: {item.get('po_number', 'N/A')}
+            Vendor: {item['vendor']}
+            Total Amount: {item['total_amount']} {item['currency']}
+            Status: {item['status']}
+            Invoice Date: {item['invoice_date']}
+            Due Date: {item['due_date']}
+            
+            Line Items:
+            {chr(10).join([f"- {li['description']}: Qty {li['quantity']} @ ${li['unit_price']}" for li in item['line_items']])}
+            
+            Flagged Reasons: {', '.join(item.get('flagged_reasons', []))}
+            """
+        else:
+            content = f"""
+            PO Number: {item['po_number']}
+            Department: {item['department']}
+            Vendor: {item['vendor']}
+            Total Amount: {item['total_amount']} {item['currency']}
+            Status: {item['status']}
+            Created Date: {item['created_date']}
+            Delivery Date: {item['delivery_date']}
+            
+            Line Items:
+            {chr(10).join([f"- {li['description']}: Ordered {li['quantity_ordered']}, Received {li['quantity_received']}" for li in item['line_items']])}
+            
+            Approver: {item['approver']}
+            """
+        metadata = {
+            "type": doc_type,
+            "id": item.get('invoice_id' if doc_type == 'invoice' else 'po_number'),
+            "vendor": item['vendor'],
+            "amount": item['total_amount'],
+            "currency": item['currency'],
+            "status": item['status'],
+            "line_items": len(item.get('line_items', []))
+        }
+        if doc_type == "invoice":
+            if item.get('po_number'):
+                metadata["po_number"] = item['po_number']
+            # YYYYMMDD integers so date bounds can be filtered and partitioned on
+            for field in ("invoice_date", "due_date"):
+                ordinal = date_ordinal(item.get(field))
+                if ordinal:
+                    metadata[f"{field}_ord"] = ordinal
+        return Document(page_content=content.strip(), metadata=metadata)
+
+    def setup_vector_stores(self, snapshot_path=None):
+        """
+        Build the stores from the source JSON, or attach to the persisted
+        collections and load a snapshot of the in-memory structures when one
+        matches the source data (INDEX_SNAPSHOT_PATH; pass False to always build).
+        A read-only manager only attaches, and raises SnapshotError if it cannot.
+        """
+        if snapshot_path is None:
+            snapshot_path = os.getenv("INDEX_SNAPSHOT_PATH", "data/index.snapshot")
+        if snapshot_path and os.path.exists(snapshot_path) and self._load_snapshot(snapshot_path):
+            return
+        if self.read_only:
+            raise SnapshotError(f"Read-only index at {self.persist_directory} has no usable snapshot ({snapshot_path})")
+        invoice_records = self.load_records_from_json(self.invoice_path)
+        po_records = self.load_records_from_json(self.po_path)
+        po_by_number = {item["po_number"]: item for item in po_records}
+        invoice_docs = self._build_documents(invoice_records, "invoice", po_by_number)
+        self.invoice_store = self._create_store(self._vector_documents(invoice_docs, invoice_records, "invoice"), "invoices")
+        self.invoice_lexical.add_documents(invoice_docs)
+        po_docs = self._build_documents(po_records, "po", po_by_number)
+        self.po_store = self._create_store(self._vector_documents(po_docs, po_records, "po"), "pos")
+        self.po_lexical.add_documents(po_docs)
+        # POs first, so invoice listeners see the PO each invoice joins to
+        self._track_records(po_records, "po")
+        self._track_records(invoice_records, "invoice")
+        for listener in self.ready_listeners:
+            listener()
+        print("✅ Vector stores initialized successfully!")
+
+    def _load_snapshot(self, path: str) -> bool:
+        try:
+            header = read_header(path)
+            invoice_store = self._attach_store("invoices")
+            po_store = self._attach_store("pos")
+            sizes = {"invoices": collection_size(invoice_store), "pos": collection_size(po_store)}
+            if sizes != header["collections"]:
+                raise SnapshotError(f"Vector collections {sizes} do not match the snapshot {header['collections']}")
+            load_snapshot(self, path, check_source=not self.read_only)
+        except SnapshotError as e:
+            print(f"⚠️ Ignoring snapshot {path}: {e}")
+            return False
+        self.invoice_store = invoice_store
+        self.po_store = po_store
+        self.index_version += 1
+        for listener in self.ready_listeners:
+            listener()
+        print(f"✅ Index loaded from snapshot {path}")
+        return True
+
+    def _attach_store(self, collection_name: str):
+        """Open an already-built collection (or its shards/partitions) without adding or embedding anything"""
+        if self.time_partitioned and collection_name == "invoices":
+            return TimePartitionedStore(
+                self.client, self.embeddings, collection_name,
+                manifest_path=os.path.join(self.persist_directory, "invoice_partitions.json")
+            )
+        if self.router:
+            return ShardedStore(
+                self.client, self.embeddings, collection_name, self.router, vocabulary=self._shard_vocabulary
             )
-            documents.append(doc)
+        return Chroma(client=self.client, collection_name=collection_name, embedding_function=self.embeddings)
+
+    def _build_documents(self, records: List[Dict], doc_type: str, po_by_number: Dict = None) -> List[Document]:
+        """Render records, tagging each document with its shard when partitioned"""
+        documents = [self.render_document(item, doc_type) for item in records]
+        if self.router:
+            po_by_number = po_by_number or self.records["po"]
+            for doc, item in zip(documents, records):
+                doc.metadata["shard"] = self.router.shard_for_record(item, doc_type, po_by_number)
         return documents
 
-    def setup_vector_stores(self):
-        invoice_docs = self.load_documents_from_json("data/invoices/mock_invoices.json", "invoice")
-        self.invoice_store = Chroma.from_documents(
-            documents=invoice_docs,
-            embedding=self.embeddings,
-            collection_name="invoices",
-            persist_directory=self.persist_directory
-        )
-        po_docs = self.load_documents_from_json("data/pos/mock_pos.json", "po")
-        self.po_store = Chroma.from_documents(
-            documents=po_docs,
+    def _vector_documents(self, documents: List[Document], records: List[Dict], doc_type: str) -> List[Document]:
+        """What goes into the vector collection: the documents themselves, or their header/line-item vectors"""
+        if not self.multi_vector:
+            return documents
+        if records is None:
+            records = [self.records[doc_type].get(doc.metadata["id"]) for doc in documents]
+        return expand_documents(documents, records, doc_type)
+
+    def _create_store(self, documents: List[Document], collection_name: str):
+        if self.time_partitioned and collection_name == "invoices":
+            store = TimePartitionedStore(
+                self.client, self.embeddings, collection_name,
+                manifest_path=os.path.join(self.persist_directory, "invoice_partitions.json")
+            )
+            store.add_documents(documents)
+            return store
+        if self.router:
+            store = ShardedStore(
+                self.client, self.embeddings, collection_name, self.router, vocabulary=self._shard_vocabulary
+            )
+            store.add_documents(documents)
+            return store
+        return Chroma.from_documents(
+            documents=documents,
             embedding=self.embeddings,
-            collection_name="pos",
+            ids=[doc.metadata["id"] for doc in documents],
+            collection_name=collection_name,
             persist_directory=self.persist_directory
         )
-        print("✅ Vector stores initialized successfully!")
 
-    def get_invoice_retriever(self, k: int = 5):
+    def _shard_vocabulary(self) -> tuple:
+        """Known vendors and departments, used to pin queries to shards"""
+        vendors = self.aggregates.values["invoice"]["vendor"] | self.aggregates.values["po"]["vendor"]
+        return vendors, self.aggregates.values["po"]["department"]
+
+    def ingest_records(self, records: List[Dict], doc_type: str):
+        """Render and index new or changed raw invoice/PO records"""
+        self._check_writable()
+        self.add_documents(self._build_documents(records, doc_type), doc_type, records=records)
+        self._track_records(records, doc_type)
+
+    def _track_records(self, records: List[Dict], doc_type: str):
+        id_field = "invoice_id" if doc_type == "invoice" else "po_number"
+        self.index_version += 1
+        changes = []
+        for item in records:
+            self.vendors.add(item.get("vendor"))
+            previous = self.records[doc_type].get(item[id_field])
+            self.records[doc_type][item[id_field]] = item
+            changes.append((previous, item))
+            if doc_type == "invoice":
+                if previous and previous.get("po_number"):
+                    self.invoices_by_po[previous["po_number"]].discard(item["invoice_id"])
+                if item.get("po_number"):
+                    self.invoices_by_po[item["po_number"]].add(item["invoice_id"])
+        # One vectorized FX conversion for the batch's amounts
+        self.aggregates.replace_many(changes, doc_type)
+        if doc_type == "invoice":
+            # Incremental: only new or changed invoices probe the LSH blocks (unchanged ones are skipped)
+            for item in records:
+                self.duplicates.add(item)
+            self.anomalies.update(records, self.records["po"])
+        else:
+            # A changed PO amount moves the PO ratio of the invoices billed against it
+            linked = {invoice_id for item in records for invoice_id in self.invoices_by_po.get(item["po_number"], ())}
+            if linked:
+                self.anomalies.update([self.records["invoice"][i] for i in sorted(linked)], self.records["po"])
+        for listener in self.change_listeners:
+            listener(doc_type, records)
+
+    def add_change_listener(self, listener: Callable[[str, List[Dict]], None]):
+        """Call listener(doc_type, records) whenever records are ingested or changed"""
+        self.change_listeners.append(listener)
+
+    def add_documents(self, documents: List[Document], doc_type: str, records: List[Dict] = None):
+        """Upsert new or changed documents into the vector collection and lexical index"""
+        self._check_writable()
+        if not self.invoice_store:
+            self.setup_vector_stores()
+        store = self.invoice_store if doc_type == "invoice" else self.po_store
+        lexical = self.invoice_lexical if doc_type == "invoice" else self.po_lexical
+        vector_docs = self._vector_documents(documents, records, doc_type)
+        store.add_documents(vector_docs, ids=[doc.metadata["id"] for doc in vector_docs])
+        lexical.add_documents(documents)
+        self.index_version += 1
+
+    def update_invoice_status(self, changes: Dict[str, str]) -> List[Dict]:
+        """
+        Apply {invoice_id: status} in place: raw records, aggregates, lexical
+        index and vector collection metadata. Only metadata is rewritten in the
+        vector collection (no re-embedding); the text there keeps the status the
+        invoice was embedded with, while lookups by id see the new one.
+        """
+        self._check_writable()
+        if not self.invoice_store:
+            self.setup_vector_stores()
+        records = []
+        for invoice_id, status in changes.items():
+            record = self.records["invoice"].get(invoice_id)
+            if record is not None and record.get("status") != status:
+                records.append({**record, "status": status})
+        if not records:
+            return []
+        documents = self._build_documents(records, "invoice")
+        # In multi-vector mode the header and every line-item vector carry the status
+        vector_docs = self._vector_documents(documents, records, "invoice")
+        if isinstance(self.invoice_store, ShardedStore):
+            self.invoice_store.update_metadata(vector_docs)
+        else:
+            self.invoice_store._collection.update(
+                ids=[doc.metadata["id"] for doc in vector_docs],
+                metadatas=[doc.metadata for doc in vector_docs]
+            )
+        self.invoice_lexical.add_documents(documents)
+        self._track_records(records, "invoice")
+        return records
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("This index generation is read-only; changes go through the writer process")
+
+    def get_documents(self, doc_type: str, ids: List[str]) -> List[Document]:
+        """Look up already-indexed documents by id (no embedding or search)"""
+        if not self.invoice_store:
+            self.setup_vector_stores()
+        lexical = self.invoice_lexical if doc_type == "invoice" else self.po_lexical
+        return [lexical.documents[doc_id] for doc_id in ids if doc_id in lexical.documents]
+
+    def invoice_ids_in_range(self, field: str, start: int, end: int) -> List[str]:
+        """Invoices whose invoice_date/due_date (YYYYMMDD) falls in [start, end]"""
+        if not self.invoice_store:
+            self.setup_vector_stores()
+        if isinstance(self.invoice_store, TimePartitionedStore):
+            return self.invoice_store.ids_in_range(field, start, end)
+        return [
+            invoice_id for invoice_id, item in self.records["invoice"].items()
+            if start <= (date_ordinal(item.get(field)) or 0) <= end
+        ]
+
+    def get_invoice_retriever(self, k: int = 5, mode: str = "vector", timeout: float = None, **options):
+        """Invoice retriever; mode is "vector", "lexical" or "hybrid" (options and timeout go to HybridRetriever)"""
         if not self.invoice_store:
             self.setup_vector_stores()
-        return self.invoice_store.as_retriever(search_kwargs={"k": k})
+        if mode == "vector" and not options and not self.multi_vector and isinstance(self.invoice_store, Chroma):
+            return self.invoice_store.as_retriever(search_kwargs={"k": k})
+        return HybridRetriever(self.invoice_store, self.invoice_lexical, k=k, mode=mode,
+                               group_children=self.multi_vector, timeout=timeout, **options)
 
-    def get_po_retriever(self, k: int = 5):
+    def get_po_retriever(self, k: int = 5, mode: str = "vector", timeout: float = None, **options):
+        """PO retriever; mode is "vector", "lexical" or "hybrid" (options and timeout go to HybridRetriever)"""
         if not self.po_store:
             self.setup_vector_stores()
-        return self.po_store.as_retriever(search_kwargs={"k": k})
+        if mode == "vector" and not options and not self.multi_vector and isinstance(self.po_store, Chroma):
+            return self.po_store.as_retriever(search_kwargs={"k": k})
+        return HybridRetriever(self.po_store, self.po_lexical, k=k, mode=mode,
+                               group_children=self.multi_vector, timeout=timeout, **options)
 
 if __name__ == "__main__":
     vs_manager = VectorStoreManager()
@@ -0,0 +1,148 @@
+"""
+Vendor normalization and fuzzy lookup.
+
+Vendor names arrive in many spellings ("TechCorp Inc.", "TECHCORP", "Tech-Corp").
+normalize_vendor() folds case, punctuation and legal suffixes into one
+canonical name, and every distinct canonical name gets a vendor id when the
+vendor master (the invoice and PO records) is indexed. Names that still differ
+after normalization (spacing, small spelling differences) are resolved through
+a character-trigram inverted index: a lookup only touches the vendors sharing
+trigrams with the name, so it stays sub-millisecond however many vendors
+there are, instead of comparing strings pairwise.
+"""
+import re
+from collections import Counter, defaultdict
+from typing import List, Optional
+
+LEGAL_SUFFIXES = {"inc", "incorporated", "ltd", "limited", "llc", "plc", "gmbh", "ag", "sa", "bv", "pty", "lp", "llp"}
+# Also legal forms, but often part of the name itself ("Tech Corp"); only dropped after a multi-word name
+WEAK_SUFFIXES = {"corp", "corporation", "co", "company"}
+
+
+def normalize_vendor(name: str) -> str:
+    """Canonical vendor name: lowercase words, no punctuation or trailing legal form"""
+    tokens = re.findall(r"[a-z0-9]+", str(name or "").lower().replace("&", " and "))
+    while len(tokens) > 1 and (tokens[-1] in LEGAL_SUFFIXES or (tokens[-1] in WEAK_SUFFIXES and len(tokens) > 2)):
+        tokens.pop()
+    if len(tokens) > 1 and tokens[0] == "the":
+        tokens.pop(0)
+    return " ".join(tokens)
+
+
+def trigrams(name: str) -> set:
+    """Character trigrams of the space-free canonical name, padded so short names still have some"""
+    compact = f"#{name.replace(' ', '')}#"
+    return {compact[i:i + 3] for i in range(len(compact) - 2)}
+
+
+class VendorIndex:
+    """
+    Canonical vendor ids over the vendor master, with a trigram index for
+    fuzzy resolution. Similarity is the Dice coefficient of trigram sets;
+    `threshold` applies to names being resolved (verification), the stricter
+    `text_threshold` to word windows of free text (query parsing).
+    """
+
+    def __init__(self, threshold: float = 0.6, text_threshold: float = 0.8, max_cache: int = 10000):
+        self.threshold = threshold
+        self.text_threshold = text_threshold
+        self.max_cache = max_cache
+        self.ids = {}      # canonical name -> vendor id
+        self.names = []    # vendor id -> canonical name
+        self.sizes = []    # vendor id -> number of trigrams
+        self.postings = defaultdict(list)  # trigram -> vendor ids
+        self.max_words = 1
+        self._cache = {}   # raw name -> vendor id or None
+
+    def add(self, name: str) -> Optional[int]:
+        """Register a vendor name from the master data; returns its vendor id"""
+        canonical = normalize_vendor(name)
+        if not canonical:
+            return None
+        vendor_id = self.ids.get(canonical)
+        if vendor_id is None:
+            vendor_id = len(self.names)
+            self.ids[canonical] = vendor_id
+            self.names.append(canonical)
+            grams = trigrams(canonical)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(vendor_id)
+            self.max_words = max(self.max_words, len(canonical.split()))
+            self._cache.clear()  # a new vendor can be a better match for cached fuzzy lookups
+        return vendor_id
+
+    def resolve(self, name: str, threshold: float = None) -> Optional[int]:
+        """Vendor id for a name: exact canonical match first, then the best trigram match above threshold"""
+        threshold = self.threshold if threshold is None else threshold
+        if threshold == self.threshold and name in self._cache:
+            return self._cache[name]
+        canonical = normalize_vendor(name)
+        vendor_id = self.ids.get(canonical)
+        if vendor_id is None and canonical:
+            vendor_id = self._best_match(trigrams(canonical), threshold)
+        if threshold == self.threshold:
+            if len(self._cache) >= self.max_cache:
+                self._cache.clear()
+            self._cache[name] = vendor_id
+        return vendor_id
+
+    def canonical(self, name: str) -> Optional[str]:
+        vendor_id = self.resolve(name)
+        return self.names[vendor_id] if vendor_id is not None else None
+
+    def same_vendor(self, a: str, b: str) -> bool:
+        """Whether two spellings name the same vendor"""
+        first, second = normalize_vendor(a), normalize_vendor(b)
+        if first == second:
+            return bool(first)
+        id_a, id_b = self.resolve(a), self.resolve(b)
+        if id_a is not None and id_b is not None:
+            return id_a == id_b
+        # At least one is not in the master data: compare the two names directly
+        return dice(trigrams(first), trigrams(second)) >= self.threshold
+
+    def find_in_text(self, text: str) -> List[str]:
+        """Canonical names of the vendors mentioned in free text, longest mention first"""
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        found = []
+        for size in range(min(self.max_words + 1, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                window = " ".join(words[start:start + size])
+                vendor_id = self.ids.get(normalize_vendor(window))
+                # Short windows are too easily near-misses of ordinary words; only match them exactly
+                if vendor_id is None and len(window.replace(" ", "")) >= 6:
+                    vendor_id = self._best_match(trigrams(window), self.text_threshold)
+                if vendor_id is not None and self.names[vendor_id] not in found:
+                    found.append(self.names[vendor_id])
+        return found
+
+    def _best_match(self, grams: set, threshold: float) -> Optional[int]:
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        best, best_score = None, threshold
+        for vendor_id, count in shared.items():
+            score = 2 * count / (len(grams) + self.sizes[vendor_id])
+            if score >= best_score:
+                best, best_score = vendor_id, score
+        return best
+
+    def __len__(self):
+        return len(self.names)
+
+
+def dice(a: set, b: set) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+
+if __name__ == "__main__":
+    import time
+
+    index = VendorIndex()
+    for vendor in ["TechCorp", "SupplyCo", "MaterialsInc", "ServicePro", "EquipmentLtd", "Acme Supplies Ltd"]:
+        index.add(vendor)
+    for name in ["TechCorp Inc.", "TECHCORP", "Tech-Corp", "Acme Supplies Corporation", "Unknown Vendor"]:
+        started = time.perf_counter()
+        print(f"{name!r:32} -> {index.canonical(name)!r} ({(time.perf_counter() - started) * 1e6:.0f} µs)")
+    print(index.find_in_text("How many flagged invoices from Tech Corp Inc. this month?"))
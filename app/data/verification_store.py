@@ -0,0 +1,122 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+
+def record_version(record: Optional[Dict[str, Any]]) -> str:
+    """Content hash of a raw record; a verdict is current only for the versions it was computed from"""
+    if record is None:
+        return ""
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class VerificationStore:
+    """
+    Persisted invoice/PO verification verdicts (SQLite).
+    Each row remembers the record versions it was computed from and whether it
+    is dirty, i.e. the invoice or its linked PO changed since.
+    """
+
+    def __init__(self, db_path: str = None):
+        db_path = db_path or os.getenv("VERIFICATION_DB_PATH", "data/verification.db")
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS verification_results (
+                    invoice_id TEXT PRIMARY KEY,
+                    po_number TEXT,
+                    invoice_version TEXT,
+                    po_version TEXT,
+                    result TEXT,
+                    verified_at TEXT,
+                    dirty INTEGER NOT NULL DEFAULT 1
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_verification_dirty ON verification_results (dirty)")
+
+    def versions(self, invoice_ids: List[str]) -> Dict[str, tuple]:
+        """(invoice_version, po_version, dirty) for the given invoices"""
+        found = {}
+        with self._lock:
+            for start in range(0, len(invoice_ids), 500):
+                chunk = invoice_ids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT invoice_id, invoice_version, po_version, dirty FROM verification_results "
+                    f"WHERE invoice_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                found.update({row[0]: row[1:] for row in rows})
+        return found
+
+    def mark_dirty(self, invoice_ids: List[str]):
+        """Flag verdicts for re-verification (creates placeholder rows for new invoices)"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO verification_results (invoice_id, dirty) VALUES (?, 1) "
+                "ON CONFLICT(invoice_id) DO UPDATE SET dirty = 1",
+                [(invoice_id,) for invoice_id in invoice_ids],
+            )
+
+    def dirty_ids(self, limit: int = 100) -> List[str]:
+        """Next batch of invoices waiting for re-verification"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT invoice_id FROM verification_results WHERE dirty = 1 LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def dirty_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM verification_results WHERE dirty = 1").fetchone()[0]
+
+    def save_many(self, rows: List[Dict[str, Any]]):
+        """Store a batch of verdicts in one transaction"""
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO verification_results "
+                "(invoice_id, po_number, invoice_version, po_version, result, verified_at, dirty) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT(invoice_id) DO UPDATE SET po_number = excluded.po_number, "
+                "invoice_version = excluded.invoice_version, po_version = excluded.po_version, "
+                "result = excluded.result, verified_at = excluded.verified_at, dirty = 0",
+                [
+                    (row["invoice_id"], row.get("po_number"), row["invoice_version"], row["po_version"],
+                     json.dumps(row["result"], default=str), now)
+                    for row in rows
+                ],
+            )
+
+    def delete(self, invoice_ids: List[str]):
+        """Drop verdicts for invoices that no longer exist"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM verification_results WHERE invoice_id = ?", [(invoice_id,) for invoice_id in invoice_ids]
+            )
+
+    def get(self, invoice_id: str) -> Optional[Dict[str, Any]]:
+        """Stored verdict for an invoice, or None if it was never verified"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT po_number, result, verified_at, dirty FROM verification_results WHERE invoice_id = ?",
+                (invoice_id,),
+            ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        return {
+            "invoice_id": invoice_id,
+            "po_number": row[0],
+            "result": json.loads(row[1]),
+            "verified_at": row[2],
+            "stale": bool(row[3]),
+        }
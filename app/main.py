@@ -1,19 +1,20 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from typing import Dict, Any, Optional
+import os
 import uuid
 from datetime import datetime
-import re
 
 # Import your modules
-from models.schemas import QueryRequest, QueryResponse
-from agents.planner import query_planner
-from agents.retriever import DocumentRetriever
-from agents.verifier import result_verifier
-from data.vector_store import VectorStore, initialize_vector_store
-from utils.audit import audit_logger
-from utils.llm import llm_client
+from app.models.schemas import QueryRequest, QueryResponse, StatusChangeRequest
+from app.agents.rag_system import AgenticRAGSystem
+from app.utils.audit import audit_logger
+from app.utils.serialization import dumps, project, resolve_fields
+from app.utils.pagination import DEFAULT_PAGE_SIZE, page_size, result_store
+from app.utils.profiler import profiler
+from app.data.generations import GenerationWatcher, open_current
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -32,21 +33,40 @@ app.add_middleware(
 )
 
 # Global variables
-vector_store = None
-document_retriever = None
+rag_system = None
+generation_watcher = None
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the system when the app starts"""
-    global vector_store, document_retriever
+    global rag_system, generation_watcher
     
     print("🚀 Starting Agentic RAG Invoice Matcher...")
     
-    # Initialize vector store with data
-    vector_store = initialize_vector_store()
+    # INDEX_ROLE=reader: serve the published index generation read-only and follow new ones
+    vector_store = None
+    if os.getenv("INDEX_ROLE", "standalone").lower() == "reader":
+        vector_store = open_current()
     
-    # Initialize document retriever
-    document_retriever = DocumentRetriever(vector_store)
+    # Initialize the RAG pipeline and build the vector stores up front
+    rag_system = AgenticRAGSystem(
+        rerank=os.getenv("RERANK", "false").lower() == "true",
+        request_budget_ms=float(os.getenv("REQUEST_BUDGET_MS", "2000")),
+        vector_store=vector_store
+    )
+    if vector_store is None:
+        # PROFILE_STARTUP=true profiles loading the JSON and building the index
+        with profiler.profile("startup", enabled=os.getenv("PROFILE_STARTUP", "false").lower() == "true"):
+            rag_system.vector_store.setup_vector_stores()
+    else:
+        generation_watcher = GenerationWatcher(
+            on_swap=rag_system.swap_vector_store,
+            generation=vector_store.generation,
+            interval_seconds=float(os.getenv("GENERATION_POLL_SECONDS", "2")),
+            embeddings=vector_store.embeddings
+        )
+        generation_watcher.start()
+        print(f"📖 Serving read-only index generation {vector_store.generation}")
     
     print("✅ System initialized successfully!")
 
@@ -66,86 +86,61 @@ async def health_check():
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
         "components": {
-            "vector_store": "operational" if vector_store else "not initialized",
-            "retriever": "operational" if document_retriever else "not initialized"
+            "vector_store": "operational" if rag_system else "not initialized",
+            "index_generation": generation_watcher.generation if generation_watcher else None,
+            "sessions": len(rag_system.sessions) if rag_system else 0
         }
     }
 
 @app.post("/query", response_model=QueryResponse)
-async def process_query(request: QueryRequest):
+async def process_query(request: QueryRequest, x_profile: Optional[str] = Header(None)):
     """Main query processing endpoint - this is where the magic happens!"""
     
-    if not document_retriever:
+    if not rag_system:
         raise HTTPException(status_code=503, detail="System not initialized")
     
+    try:
+        fields = resolve_fields(request.fields, QueryResponse.__fields__)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # The session id ties follow-ups ("Approve it") to the previous question
     session_id = request.session_id or str(uuid.uuid4())
     
+    # X-Profile header, "profile" flag or PROFILE_SAMPLE_RATE
+    profiled = profiler.should_profile(x_profile or request.profile)
+    
+    def run_query():
+        # Profiled inside the worker thread, so the sampler follows the pipeline there
+        with profiler.profile("process_query", enabled=profiled, session_id=session_id) as profile:
+            result = rag_system.process_query(
+                request.query, session_id=session_id,
+                rerank_budget_ms=request.rerank_budget_ms, budget_ms=request.budget_ms
+            )
+        return result, profile
+    
     try:
-        # Step 1: Plan the query
-        plan = query_planner.plan_query(request.query, session_id)
-        
-        # Initialize response
-        response_data = {
-            "answer": "",
-            "evidence": [],
-            "match_score": 0.0,
-            "confidence": 0.0,
-            "audit_log": [],
-            "sources": []
-        }
-        
-        # Step 2: Execute the plan
-        invoice_data = None
-        po_data = None
-        
-        # Extract IDs from query
-        invoice_id = extract_invoice_id(request.query)
-        po_number = extract_po_number(request.query)
-        
-        # Retrieve invoice data
-        if "retrieve_invoice_data" in plan["steps"]:
-            invoice_result = document_retriever.retrieve_invoice(request.query, invoice_id)
-            if invoice_result["found"]:
-                invoice_data = invoice_result["invoice"]
-                response_data["evidence"].append({
-                    "type": "invoice",
-                    "data": invoice_data,
-                    "confidence": invoice_result["confidence"]
-                })
-                response_data["sources"].append(f"Invoice {invoice_data['invoice_id']}")
-        
-        # Retrieve PO data
-        if "retrieve_po_data" in plan["steps"]:
-            po_result = document_retriever.retrieve_po(po_number, request.query)
-            if po_result["found"]:
-                po_data = po_result["po"]
-                response_data["evidence"].append({
-                    "type": "purchase_order", 
-                    "data": po_data,
-                    "confidence": po_result["confidence"]
-                })
-                response_data["sources"].append(f"PO {po_data['po_number']}")
-        
-        # Step 3: Verify and analyze
-        if invoice_data and "analyze_flagging_reasons" in plan["steps"]:
-            verification = result_verifier.verify_invoice_po_match(invoice_data, po_data)
-            response_data["match_score"] = verification["match_score"]
-            response_data["confidence"] = verification["confidence"]
-            response_data["evidence"].append({
-                "type": "verification",
-                "data": verification,
-                "confidence": verification["confidence"]
-            })
-        
-        # Step 4: Generate response
-        response_data["answer"] = generate_human_readable_response(
-            request.query, invoice_data, po_data, response_data
+        # Run the pipeline off the event loop so one slow request cannot hold up the others' deadlines
+        result, profile = await run_in_threadpool(run_query)
+        # Sources and audit trail stay pageable under the result id (GET /results/{result_id}/...)
+        result["result_id"] = result_store.put(result)
+        # One entry per caller, even when the pipeline run was shared with concurrent identical requests
+        coalescing = next((step for step in result["audit_log"] if step["step"] == "coalescing"), {})
+        audit_logger.log_action(
+            agent_name="MainAPI",
+            action="process_query",
+            input_data={"query": request.query, "session_id": session_id},
+            output_data={
+                "sources": [source.get("id") for source in result["sources"]],
+                "degraded": result["degraded"],
+                "coalesced": coalescing.get("role"),
+                "profile_id": profile.profile_id if profile else None
+            },
+            confidence=result["confidence"]
         )
-        
-        # Step 5: Get audit logs for this session
-        response_data["audit_log"] = audit_logger.get_recent_logs(5)
-        
-        return QueryResponse(**response_data)
+        # The result is built internally, so skip re-validating it through QueryResponse and serialize directly
+        headers = {"X-Profile-Id": profile.profile_id} if profile else None
+        return Response(content=dumps(project(result, fields)), media_type="application/json", headers=headers)
     
     except Exception as e:
         audit_logger.log_action(
@@ -157,84 +152,151 @@ async def process_query(request: QueryRequest):
         )
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
 
-def extract_invoice_id(query: str) -> Optional[str]:
-    """Extract invoice ID from query"""
-    match = re.search(r'inv[-_]?(\d+)', query.lower())
-    if match:
-        return f"INV-{match.group(1)}"
-    return None
-
-def extract_po_number(query: str) -> Optional[str]:
-    """Extract PO number from query"""
-    match = re.search(r'po[-_]?(\d+)', query.lower())
-    if match:
-        return f"PO-{match.group(1)}"
-    return None
-
-def generate_human_readable_response(
-    query: str, 
-    invoice: Optional[Dict[str, Any]], 
-    po: Optional[Dict[str, Any]], 
-    response_data: Dict[str, Any]
-) -> str:
-    """Generate a human-readable response"""
-    
-    if not invoice:
-        return "I couldn't find the specified invoice in our system. Please check the invoice number and try again."
-    
-    # Build response based on query type
-    if "flagged" in query.lower():
-        verification = None
-        for evidence in response_data["evidence"]:
-            if evidence["type"] == "verification":
-                verification = evidence["data"]
-                break
-        
-        if verification:
-            answer = f"Invoice {invoice['invoice_id']} was flagged for the following reasons:\n\n"
-            
-            if verification["flagging_reasons"]:
-                for i, reason in enumerate(verification["flagging_reasons"], 1):
-                    answer += f"{i}. {reason}\n"
-            
-            answer += f"\nMatch Score: {verification['match_score']}/100\n"
-            answer += f"Confidence Level: {verification['confidence']}%\n"
-            
-            if po:
-                answer += f"\nComparison with PO {po['po_number']}:\n"
-                answer += f"• Invoice Amount: ${invoice['amount']}\n"
-                answer += f"• PO Amount: ${po['amount']}\n"
-                answer += f"• Vendor: {invoice['vendor_name']}\n"
-            
-            if verification["recommendations"]:
-                answer += f"\nRecommendations: {', '.join(verification['recommendations'])}"
-            
-            return answer
-    
-    # Default response
-    answer = f"Found invoice {invoice['invoice_id']} from {invoice['vendor_name']} for ${invoice['amount']}."
-    
-    if po:
-        answer += f" It's linked to PO {po['po_number']}."
-        
-    return answer
+@app.post("/query/stream")
+async def stream_query(request: QueryRequest):
+    """Streaming variant of /query: each pipeline stage is sent as a server-sent event as soon as it finishes"""
+    
+    if not rag_system:
+        raise HTTPException(status_code=503, detail="System not initialized")
+    
+    session_id = request.session_id or str(uuid.uuid4())
+    
+    def event_stream():
+        try:
+            for event, data in rag_system.stream_query(
+                request.query, session_id=session_id, rerank_budget_ms=request.rerank_budget_ms,
+                budget_ms=request.budget_ms
+            ):
+                if event == "done":
+                    audit_logger.log_action(
+                        agent_name="MainAPI",
+                        action="stream_query",
+                        input_data={"query": request.query, "session_id": session_id},
+                        output_data={
+                            "sources": [source.get("id") for source in data["sources"]],
+                            "degraded": data["degraded"]
+                        },
+                        confidence=data["confidence"]
+                    )
+                    # Plan, evidence and answer were already streamed; close with the audit trail
+                    # and the result id its sources can be paged through
+                    data = {
+                        "session_id": session_id,
+                        "result_id": result_store.put(data),
+                        "confidence": data["confidence"],
+                        "source_count": len(data["sources"]),
+                        "audit_log": data["audit_log"],
+                        "degraded": data["degraded"]
+                    }
+                yield format_sse(event, data)
+        except Exception as e:
+            audit_logger.log_action(
+                agent_name="MainAPI",
+                action="stream_query_error",
+                input_data={"query": request.query, "session_id": session_id},
+                output_data={"error": str(e)},
+                confidence=0
+            )
+            yield format_sse("error", {"detail": f"Processing error: {str(e)}"})
+    
+    # Sync generator: Starlette iterates it in a worker thread, so the event loop stays free
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Encode one server-sent event"""
+    return f"event: {event}\ndata: {dumps(data).decode('utf-8')}\n\n"
 
 @app.get("/audit-logs")
 async def get_audit_logs(limit: int = 20):
     """Get recent audit logs"""
     return audit_logger.get_recent_logs(limit)
 
+@app.get("/audit-logs/page")
+async def get_audit_log_page(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE,
+                             session_id: Optional[str] = None):
+    """Newest-first page of the audit log; pass next_cursor back to get the following page"""
+    try:
+        return await run_in_threadpool(audit_logger.read_page, cursor, page_size(limit), session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/results/{result_id}/sources")
+async def get_result_sources(result_id: str, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    """One page of a query result's sources"""
+    return result_page(result_id, "sources", cursor, limit)
+
+@app.get("/results/{result_id}/audit")
+async def get_result_audit(result_id: str, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE):
+    """One page of a query result's pipeline audit trail"""
+    return result_page(result_id, "audit_log", cursor, limit)
+
+def result_page(result_id: str, field: str, cursor: Optional[str], limit: int) -> Dict[str, Any]:
+    try:
+        return result_store.page(result_id, field, cursor, page_size(limit))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/duplicates")
+async def get_duplicates():
+    """Duplicate / near-duplicate invoice clusters"""
+    if not rag_system:
+        raise HTTPException(status_code=503, detail="System not initialized")
+    
+    clusters = rag_system.vector_store.duplicates.clusters()
+    return {"cluster_count": len(clusters), "clusters": clusters}
+
 @app.get("/invoices/{invoice_id}")
 async def get_invoice(invoice_id: str):
     """Get specific invoice details"""
-    if not vector_store:
+    if not rag_system:
         raise HTTPException(status_code=503, detail="System not initialized")
     
-    invoice = vector_store.get_invoice_by_id(invoice_id)
-    if not invoice:
+    docs = rag_system.vector_store.get_documents("invoice", [invoice_id.upper()])
+    if not docs:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    return invoice
+    return {"metadata": docs[0].metadata, "content": docs[0].page_content}
+
+@app.post("/invoices/{invoice_id}/status")
+async def change_invoice_status(invoice_id: str, request: StatusChangeRequest,
+                                idempotency_key: Optional[str] = Header(None)):
+    """Durably change an invoice's status; retries with the same Idempotency-Key return the original result"""
+    if not rag_system:
+        raise HTTPException(status_code=503, detail="System not initialized")
+    
+    try:
+        entry = await run_in_threadpool(
+            rag_system.approvals.transition, invoice_id.upper(), request.status,
+            idempotency_key=idempotency_key or request.idempotency_key,
+            actor=request.actor, reason=request.reason
+        )
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e).strip("'"))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    audit_logger.log_action(
+        agent_name="MainAPI",
+        action="change_invoice_status",
+        input_data={"invoice_id": invoice_id.upper(), "status": request.status, "actor": request.actor},
+        output_data=entry,
+        confidence=1.0
+    )
+    return entry
+
+@app.get("/invoices/{invoice_id}/history")
+async def get_invoice_history(invoice_id: str):
+    """Logged status transitions of an invoice"""
+    if not rag_system:
+        raise HTTPException(status_code=503, detail="System not initialized")
+    
+    return {"invoice_id": invoice_id.upper(), "transitions": rag_system.approvals.history(invoice_id.upper())}
 
 if __name__ == "__main__":
     import uvicorn
@@ -70,3 +70,31 @@ class AuditEntry(BaseModel):
     action_type: str
     details: Dict[str, Any]
     session_id: str
+
+class QueryRequest(BaseModel):
+    query: str
+    session_id: Optional[str] = None
+    rerank_budget_ms: Optional[float] = None
+    budget_ms: Optional[float] = None
+    # Field projection, e.g. ["answer"], ["evidence"] or ["response", "confidence"]; None returns everything
+    fields: Optional[List[str]] = None
+    # Sample this request's pipeline (same as the X-Profile header)
+    profile: Optional[bool] = None
+
+class QueryResponse(BaseModel):
+    query: str
+    session_id: str
+    response: str
+    confidence: float
+    sources: List[Dict[str, Any]]
+    audit_log: List[Dict[str, Any]]
+    plan: Dict[str, Any]
+    degraded: bool = False
+    # Id for paging through sources and audit_log (GET /results/{result_id}/sources)
+    result_id: Optional[str] = None
+
+class StatusChangeRequest(BaseModel):
+    status: str
+    idempotency_key: Optional[str] = None
+    actor: Optional[str] = None
+    reason: Optional[str] = None
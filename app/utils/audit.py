@@ -3,13 +3,16 @@ from datetime import datetime
 from typing import Dict, Any, List
 import os
 
+AUDIT_READ_BLOCK = 64 * 1024
+
 class AuditLogger:
     """
     The Audit Logger keeps track of everything the system does.
     Think of it as a detailed logbook of all actions.
     """
     
-    def __init__(self, log_file: str = "data/audit_log.jsonl"):
+    def __init__(self, log_file: str = None):
+        log_file = log_file or os.getenv("AUDIT_LOG_PATH", "data/audit_log.jsonl")
         self.log_file = log_file
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
     
@@ -47,6 +50,49 @@ class AuditLogger:
             pass
         return logs
     
+    def read_page(self, cursor: str = None, limit: int = 20, session_id: str = None) -> Dict[str, Any]:
+        """
+        Newest-first page of log entries. The cursor is the byte offset the
+        previous page stopped at; the file is read backwards from there block
+        by block, so a page costs the same however long the log has grown.
+        """
+        if cursor not in (None, "") and not str(cursor).isdigit():
+            raise ValueError(f"Invalid cursor '{cursor}'")
+        items = []
+        try:
+            f = open(self.log_file, "rb")
+        except FileNotFoundError:
+            return {"items": items, "next_cursor": None}
+        with f:
+            f.seek(0, os.SEEK_END)
+            position = min(int(cursor), f.tell()) if cursor else f.tell()
+            buffer = b""
+            while True:
+                if position > 0:
+                    size = min(AUDIT_READ_BLOCK, position)
+                    position -= size
+                    f.seek(position)
+                    buffer = f.read(size) + buffer
+                pieces = buffer.split(b"\n")
+                # Until the start of the file is reached the first piece may be a partial line
+                head = pieces.pop(0) if position > 0 else b""
+                offset = position + len(buffer)
+                for piece in reversed(pieces):
+                    offset -= len(piece)  # start of this line
+                    if piece.strip():
+                        try:
+                            entry = json.loads(piece)
+                        except ValueError:
+                            entry = None  # a line still being appended
+                        if entry and (session_id is None or entry.get("input_data", {}).get("session_id") == session_id):
+                            items.append(entry)
+                            if len(items) >= limit:
+                                return {"items": items, "next_cursor": str(offset) if offset > 0 else None}
+                    offset -= 1  # its newline
+                if position == 0:
+                    return {"items": items, "next_cursor": None}
+                buffer = head
+
     def get_session_logs(self, session_id: str) -> List[Dict[str, Any]]:
         """Get logs for a specific session"""
         logs = []
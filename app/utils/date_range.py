@@ -0,0 +1,70 @@
+import re
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+MONTH_NAMES = [name.lower() for name in calendar.month_name if name]
+
+
+def date_ordinal(value) -> Optional[int]:
+    """YYYYMMDD integer for an ISO date/datetime string (sortable, usable in Chroma filters)"""
+    try:
+        parsed = value if isinstance(value, date) else datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return parsed.year * 10000 + parsed.month * 100 + parsed.day
+
+
+def parse_date_range(query: str, today: date = None) -> Optional[Tuple[str, int, int]]:
+    """
+    Find a date bound in a question, e.g. "flagged invoices this month" or
+    "what's due next week". Returns (field, start, end) with YYYYMMDD ordinals,
+    where field is "due_date" for due-date questions and "invoice_date"
+    otherwise, or None when the question is not date-bounded or names a date
+    that does not exist ("2025-13", "2025-02-30").
+    """
+    text = query.lower()
+    today = today or date.today()
+    field = "due_date" if re.search(r"\b(due|overdue|payable)\b", text) else "invoice_date"
+
+    def month_range(year: int, month: int) -> Tuple[date, date]:
+        return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+    start = end = None
+    week_start = today - timedelta(days=today.weekday())
+    if "today" in text:
+        start = end = today
+    elif "this week" in text:
+        start, end = week_start, week_start + timedelta(days=6)
+    elif "next week" in text:
+        start, end = week_start + timedelta(days=7), week_start + timedelta(days=13)
+    elif "last week" in text or "previous week" in text:
+        start, end = week_start - timedelta(days=7), week_start - timedelta(days=1)
+    elif "this month" in text:
+        start, end = month_range(today.year, today.month)
+    elif "next month" in text:
+        start, end = month_range(today.year + today.month // 12, today.month % 12 + 1)
+    elif "last month" in text or "previous month" in text:
+        start, end = month_range(today.year - (today.month == 1), (today.month - 2) % 12 + 1)
+    else:
+        days = re.search(r"\b(?:last|past) (\d+) days\b", text)
+        explicit = re.search(r"\b(\d{4})-(\d{2})(?:-(\d{2}))?\b", text)
+        if days:
+            start, end = today - timedelta(days=int(days.group(1))), today
+        elif explicit:
+            year, month = int(explicit.group(1)), int(explicit.group(2))
+            # A full date still bounds its month, but only if that day exists
+            if not 1 <= month <= 12 or (explicit.group(3) and date_ordinal(explicit.group(0)) is None):
+                return None
+            start, end = month_range(year, month)
+        else:
+            for index, name in enumerate(MONTH_NAMES, 1):
+                named = re.search(rf"\b{name}(?:\s+(\d{{4}}))?\b", text)
+                if named and (name != "may" or named.group(1)):
+                    year = int(named.group(1)) if named.group(1) else (today.year if index <= today.month else today.year - 1)
+                    start, end = month_range(year, index)
+                    break
+
+    if start is None:
+        return None
+    return field, date_ordinal(start), date_ordinal(end)
@@ -0,0 +1,35 @@
+import time
+from typing import Optional
+
+
+class Deadline:
+    """
+    Absolute end time for one request, handed down the pipeline so every
+    stage works from the same clock. A budget of None means no deadline.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.budget_ms = budget_ms
+        self.started = time.perf_counter()
+        self.expires_at = self.started + budget_ms / 1000 if budget_ms is not None else None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left (never negative), or None when unbounded"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.perf_counter())
+
+    def remaining_ms(self) -> Optional[float]:
+        remaining = self.remaining()
+        return remaining * 1000 if remaining is not None else None
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.perf_counter() >= self.expires_at
+
+    def slice(self, share: float) -> Optional[float]:
+        """Timeout in seconds for a stage allowed to use `share` of the time still left"""
+        remaining = self.remaining()
+        return remaining * share if remaining is not None else None
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
@@ -1,19 +1,191 @@
 # app/utils/llm.py
 import os
-from langchain_openai import ChatOpenAI
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 
+from app.utils.llm_cache import LLMCache, prompt_key
+
 load_dotenv()
 
-def get_llm(temperature: float = 0.1, model: str = "gpt-3.5-turbo"):
-    """Get configured LLM instance"""
-    return ChatOpenAI(
-        temperature=temperature,
-        model=model,
-        api_key=os.getenv("OPENAI_API_KEY")
-    )
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+# Bump when the analysis prompt changes meaning, so cached answers to the old prompt are not reused
+ANALYSIS_PROMPT_VERSION = 1
+ANALYSIS_PROMPT = """task: invoice_po_match v{version}
+You are an accounts-payable auditor. Compare the invoice with its purchase order and
+answer with JSON only: {{"match_score": <0-100>, "analysis": "<one sentence>"}}.
+### payload
+{payload}"""
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+
+def get_llm(temperature: float = 0.1, model: str = DEFAULT_MODEL):
+    """Get the shared LLM instance for (model, temperature); created once, reused by every caller"""
+    key = (model, round(float(temperature), 4))
+    with _pool_lock:
+        if key not in _pool:
+            from langchain_openai import ChatOpenAI  # only needed for the OpenAI backend
+            _pool[key] = ChatOpenAI(
+                temperature=temperature,
+                model=model,
+                api_key=os.getenv("OPENAI_API_KEY")
+            )
+        return _pool[key]
 
 def create_prompt_template(template: str) -> ChatPromptTemplate:
     """Create a chat prompt template"""
     return ChatPromptTemplate.from_template(template)
+
+
+class OpenAIBackend:
+    """Completions through the pooled ChatOpenAI instances"""
+    name = "openai"
+
+    def complete(self, prompt: str, model: str, temperature: float) -> str:
+        return get_llm(temperature=temperature, model=model).invoke(prompt).content
+
+
+class LocalBackend:
+    """
+    Deterministic offline stand-in: the same prompt always gets the same answer.
+    Invoice/PO analyses get the rule-based baseline; other prompts an echo with
+    the prompt hash. latency_ms simulates a remote call for benchmarks.
+    """
+    name = "local"
+
+    def __init__(self, latency_ms: float = None):
+        self.latency_ms = float(os.getenv("LLM_LOCAL_LATENCY_MS", "0")) if latency_ms is None else latency_ms
+        self.calls = 0
+
+    def complete(self, prompt: str, model: str, temperature: float) -> str:
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if prompt.startswith("task: invoice_po_match") and "### payload" in prompt:
+            payload = json.loads(prompt.split("### payload", 1)[1])
+            has_po = payload.get("po") is not None
+            return json.dumps({
+                "match_score": 100 if has_po else 30,
+                "analysis": "Rule-based baseline (local LLM backend)"
+            })
+        return f"[local {model} {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}] {prompt[:200]}"
+
+
+def default_backend():
+    """LLM_BACKEND=openai|local; without it, OpenAI only when an API key is configured"""
+    choice = os.getenv("LLM_BACKEND", "").lower()
+    if choice == "openai" or (not choice and os.getenv("OPENAI_API_KEY")):
+        return OpenAIBackend()
+    return LocalBackend()
+
+
+class LLMClient:
+    """
+    Cached, concurrency-limited LLM calls.
+
+    Responses are cached by (model, prompt hash, temperature), so re-analysing
+    an unchanged invoice/PO pair costs a cache lookup. complete_many()
+    de-duplicates a batch, answers what it can from the cache and runs the
+    misses concurrently, never more than max_concurrency at once across all
+    callers. Without an OpenAI key the deterministic local backend is used, so
+    the demo, tests and benchmarks run offline.
+    """
+
+    def __init__(self, backend=None, cache: Optional[LLMCache] = None, model: str = DEFAULT_MODEL,
+                 max_concurrency: int = None, use_cache: bool = None):
+        self.backend = backend or default_backend()
+        if use_cache is None:
+            use_cache = os.getenv("LLM_CACHE_PATH", "data/llm_cache.db").lower() not in ("", "off")
+        self.cache = (cache or LLMCache()) if use_cache else None
+        self.model = model
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="llm")
+
+    def complete(self, prompt: str, temperature: float = 0.0, model: str = None) -> str:
+        return self.complete_many([prompt], temperature=temperature, model=model)[0]
+
+    def complete_many(self, prompts: List[str], temperature: float = 0.0, model: str = None) -> List[str]:
+        """Responses in prompt order; cached and duplicate prompts are not sent again"""
+        model = model or self.model
+        keys = [prompt_key(model, prompt, temperature) for prompt in prompts]
+        unique = dict(zip(keys, prompts))
+        responses = self.cache.get_many(list(unique)) if self.cache else {}
+        misses = [(key, prompt) for key, prompt in unique.items() if key not in responses]
+
+        if len(misses) == 1:
+            key, prompt = misses[0]
+            fresh = {key: self._call(prompt, model, temperature)}
+        else:
+            futures = {key: self._executor.submit(self._call, prompt, model, temperature) for key, prompt in misses}
+            fresh = {key: future.result() for key, future in futures.items()}
+        if self.cache:
+            self.cache.put_many(fresh)
+        responses.update(fresh)
+        return [responses[key] for key in keys]
+
+    def _call(self, prompt: str, model: str, temperature: float) -> str:
+        with self._slots:
+            return self.backend.complete(prompt, model, temperature)
+
+    def analyze_invoice_po_match(self, invoice: dict, po: dict = None) -> dict:
+        """Match assessment for an invoice and its PO (cached per pair content)"""
+        return self.analyze_many([(invoice, po)])[0]
+
+    def analyze_many(self, pairs: List[Tuple[dict, Optional[dict]]]) -> List[dict]:
+        """Assess many invoice/PO pairs in one batch (concurrent, cached)"""
+        prompts = [self._analysis_prompt(invoice, po) for invoice, po in pairs]
+        return [self._parse_analysis(text, po) for text, (_, po) in zip(self.complete_many(prompts), pairs)]
+
+    @staticmethod
+    def _analysis_prompt(invoice: dict, po: dict = None) -> str:
+        # Canonical JSON (sorted keys, only the compared fields): the same pair always hashes the same
+        fields = ("invoice_id", "po_number", "vendor", "vendor_name", "total_amount", "amount", "currency", "line_items")
+        payload = {
+            "invoice": {name: invoice.get(name) for name in fields if name in invoice},
+            "po": {name: po.get(name) for name in fields if name in po} if po else None,
+        }
+        return ANALYSIS_PROMPT.format(version=ANALYSIS_PROMPT_VERSION,
+                                      payload=json.dumps(payload, sort_keys=True, default=str))
+
+    @staticmethod
+    def _parse_analysis(text: str, po: dict = None) -> dict:
+        try:
+            start, end = text.index("{"), text.rindex("}") + 1
+            analysis = json.loads(text[start:end])
+            return {"match_score": int(round(float(analysis["match_score"]))),
+                    "analysis": str(analysis.get("analysis", ""))}
+        except (ValueError, KeyError, TypeError):
+            return {"match_score": 100 if po else 30, "analysis": "Unparseable LLM answer; rule-based baseline used"}
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.backend.name,
+            "model": self.model,
+            "max_concurrency": self.max_concurrency,
+            "cache": self.cache.stats() if self.cache else None,
+        }
+
+# Global LLM client instance
+llm_client = LLMClient()
+
+if __name__ == "__main__":
+    from app.data.mock_invoices import generate_mock_invoices, generate_mock_pos
+
+    invoices = generate_mock_invoices(200)
+    pos = {po["po_number"]: po for po in generate_mock_pos(200)}
+    pairs = [(invoice, pos.get(invoice["po_number"])) for invoice in invoices]
+    client = LLMClient(backend=LocalBackend(latency_ms=20), cache=LLMCache(db_path=":memory:"))
+    for label in ("cold", "warm"):
+        started = time.perf_counter()
+        client.analyze_many(pairs)
+        print(f"{label}: {len(pairs)} analyses in {(time.perf_counter() - started) * 1000:.0f} ms "
+              f"({client.backend.calls} backend calls so far)")
+    print(client.stats())
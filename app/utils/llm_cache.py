@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+
+def prompt_key(model: str, prompt: str, temperature: float) -> Tuple[str, str, float]:
+    """Cache key: model, SHA-256 of the prompt text and temperature"""
+    return model, hashlib.sha256(prompt.encode("utf-8")).hexdigest(), round(float(temperature), 4)
+
+
+class LLMCache:
+    """
+    Persisted prompt -> response cache (SQLite) with an in-memory LRU in front.
+    The database is opened on first use, so importing the client costs nothing.
+    """
+
+    def __init__(self, db_path: str = None, memory_size: int = 4096):
+        self.db_path = db_path or os.getenv("LLM_CACHE_PATH", "data/llm_cache.db")
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            with self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS llm_responses (
+                        model TEXT NOT NULL,
+                        prompt_hash TEXT NOT NULL,
+                        temperature REAL NOT NULL,
+                        response TEXT NOT NULL,
+                        created_at TEXT,
+                        PRIMARY KEY (model, prompt_hash, temperature)
+                    )
+                    """
+                )
+        return self._conn
+
+    def get_many(self, keys: List[Tuple[str, str, float]]) -> Dict[Tuple[str, str, float], str]:
+        """Cached responses for the keys that have one"""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+            conn = self._connect() if missing else None
+            for key in missing:
+                row = conn.execute(
+                    "SELECT response FROM llm_responses WHERE model = ? AND prompt_hash = ? AND temperature = ?", key
+                ).fetchone()
+                if row:
+                    found[key] = row[0]
+                    self._remember(key, row[0])
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: Tuple[str, str, float]) -> Optional[str]:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: Dict[Tuple[str, str, float], str]):
+        """Store responses in one transaction"""
+        if not items:
+            return
+        now = datetime.now().isoformat()
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO llm_responses (model, prompt_hash, temperature, response, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(*key, response, now) for key, response in items.items()],
+                )
+            for key, response in items.items():
+                self._remember(key, response)
+
+    def _remember(self, key, response: str):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
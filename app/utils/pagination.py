@@ -0,0 +1,89 @@
+"""
+Cursor pagination for query results.
+
+A query's sources and pipeline audit trail can be long, so the API keeps each
+result in a bounded ResultStore under a result id and clients fetch one page at
+a time. Cursors are opaque strings (an offset into the stored list); a stored
+result never changes, so a page fetched by (result id, cursor) can be cached
+by the client for as long as it likes.
+"""
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+
+
+def page_size(limit: Optional[int]) -> int:
+    """Clamp a requested page size to 1..MAX_PAGE_SIZE"""
+    return max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+
+
+def decode_offset(cursor: Optional[str]) -> int:
+    """Offset a list cursor points at; raises ValueError for a cursor this API did not issue"""
+    if cursor in (None, ""):
+        return 0
+    if not str(cursor).isdigit():
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return int(cursor)
+
+
+def paginate(items: List[Any], cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """One page of a list: {"items", "next_cursor" (None on the last page), "total"}"""
+    start = decode_offset(cursor)
+    end = start + page_size(limit)
+    return {
+        "items": items[start:end],
+        "next_cursor": str(end) if end < len(items) else None,
+        "total": len(items),
+    }
+
+
+class ResultStore:
+    """
+    Recent query results, kept for paging through their sources and audit
+    trail. Bounded by count (least recently stored evicted first) and expired
+    after `ttl_seconds`; a client holding an expired result id gets a KeyError.
+    """
+
+    PAGED_FIELDS = ("sources", "audit_log")
+
+    def __init__(self, max_results: int = 1000, ttl_seconds: float = 1800):
+        self.max_results = max_results
+        self.ttl_seconds = ttl_seconds
+        self._results = OrderedDict()  # result_id -> (expires_at, {field: list})
+        self._lock = threading.Lock()
+
+    def put(self, result: Dict[str, Any]) -> str:
+        """Keep the paged fields of a result; returns its result id"""
+        result_id = uuid.uuid4().hex
+        fields = {field: list(result.get(field) or ()) for field in self.PAGED_FIELDS}
+        with self._lock:
+            self._results[result_id] = (time.monotonic() + self.ttl_seconds, fields)
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        return result_id
+
+    def page(self, result_id: str, field: str, cursor: Optional[str] = None,
+             limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        """One page of a stored result's sources or audit_log"""
+        if field not in self.PAGED_FIELDS:
+            raise ValueError(f"Unknown paged field '{field}' (choose from {', '.join(self.PAGED_FIELDS)})")
+        with self._lock:
+            entry = self._results.get(result_id)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._results[result_id]
+                entry = None
+        if entry is None:
+            raise KeyError(f"Result {result_id} not found or expired")
+        return {"result_id": result_id, **paginate(entry[1][field], cursor, limit)}
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+# Global result store for the API and the in-process dashboard
+result_store = ResultStore()
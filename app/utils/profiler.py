@@ -0,0 +1,275 @@
+"""
+Opt-in sampling profiler for the query pipeline.
+
+A profiled run starts a sampler thread that snapshots the stacks of the
+threads working for it every PROFILE_INTERVAL_MS (the calling thread plus any
+pipeline stage thread the work was handed to through propagate()). Samples are
+written as collapsed stacks, one "thread;module:function;... count" line per
+distinct stack, which flamegraph.pl, speedscope and inferno read directly, and
+as a JSON summary with the hottest functions and allocation counts. Both files
+go to PROFILE_DIR (default data/profiles, next to the audit log) and the
+summary is recorded in the audit log.
+
+A run is profiled when the caller asks (X-Profile header or "profile" flag on
+/query) or for a PROFILE_SAMPLE_RATE fraction of traffic. Disabled, the cost is
+one branch per request and one context variable lookup per stage hand-off.
+PROFILE_ALLOCATIONS=true additionally traces allocation sites with
+tracemalloc, which slows every thread while a profile is running.
+"""
+import gc
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from app.utils.audit import audit_logger
+
+MAX_STACK_DEPTH = 128
+TOP_FUNCTIONS = 20
+
+# The profile the current thread (or the task it was handed) belongs to
+_active = contextvars.ContextVar("active_profile", default=None)
+
+
+def propagate(fn: Callable) -> Callable:
+    """Wrap fn before handing it to another thread so that thread is sampled too (no-op when not profiling)"""
+    session = _active.get()
+    if session is None:
+        return fn
+
+    def attached(*args, **kwargs):
+        with session.attached():
+            return fn(*args, **kwargs)
+    return attached
+
+
+def requested(value: Any) -> bool:
+    """Whether a header/flag value asks for profiling ("1", "true", "yes", "on" or True)"""
+    return value is True or str(value or "").strip().lower() in ("1", "true", "yes", "on")
+
+
+class ProfileSession:
+    """Samples of one profiled run; written out when the run finishes"""
+
+    def __init__(self, profiler: "Profiler", name: str, tags: Dict[str, Any]):
+        self.profiler = profiler
+        self.name = name
+        self.tags = tags
+        self.profile_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{name}-{uuid.uuid4().hex[:8]}"
+        self.stacks = Counter()  # (thread, outermost frame, ..., innermost frame) -> samples
+        self.summary = None
+        self._threads = Counter()  # thread ident -> attach depth
+        self._labels = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @contextmanager
+    def attached(self):
+        """Sample the current thread for the duration of the block"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads[ident] += 1
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+            with self._lock:
+                self._threads[ident] -= 1
+                if not self._threads[ident]:
+                    del self._threads[ident]
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._started_at = datetime.now().isoformat()
+        self._blocks = sys.getallocatedblocks()
+        self._collections = [stats["collections"] for stats in gc.get_stats()]
+        self._tracing = self.profiler.allocations and self.profiler._start_tracing()
+        self._snapshot = tracemalloc.take_snapshot() if self._tracing else None
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.name}", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        allocations = {
+            # Process-wide counters: concurrent requests are included
+            "allocated_blocks_delta": sys.getallocatedblocks() - self._blocks,
+            "gc_collections": [stats["collections"] - before
+                               for stats, before in zip(gc.get_stats(), self._collections)],
+        }
+        if self._tracing:
+            diff = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+            self.profiler._stop_tracing()
+            allocations["top_sites"] = [
+                {"site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 "count": stat.count_diff, "bytes": stat.size_diff}
+                for stat in sorted(diff, key=lambda stat: stat.count_diff, reverse=True)[:TOP_FUNCTIONS]
+                if stat.count_diff > 0
+            ]
+        self.summary = self._summarize(duration_ms, allocations)
+        self.profiler._write(self)
+
+    def _sample_loop(self):
+        interval = self.profiler.interval_ms / 1000
+        while not self._stop.wait(interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                stack.append(self._label(ident))
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def _label(self, ident: int) -> str:
+        """Thread name without its pool index, so every stage worker shares one flame graph root"""
+        if ident not in self._labels:
+            thread = next((t for t in threading.enumerate() if t.ident == ident), None)
+            name = thread.name if thread else f"thread-{ident}"
+            self._labels[ident] = re.sub(r"[_-]?\d+$", "", re.sub(r" \(.*\)$", "", name)) or name
+        return self._labels[ident]
+
+    def _summarize(self, duration_ms: float, allocations: Dict[str, Any]) -> Dict[str, Any]:
+        samples = sum(self.stacks.values())
+        own, cumulative, threads = Counter(), Counter(), Counter()
+        for stack, count in self.stacks.items():
+            threads[stack[0]] += count
+            if len(stack) > 1:
+                own[stack[-1]] += count
+            for frame in set(stack[1:]):
+                cumulative[frame] += count
+
+        def top(counter: Counter) -> List[Dict[str, Any]]:
+            return [{"function": frame, "samples": count, "percent": round(100 * count / samples, 1)}
+                    for frame, count in counter.most_common(TOP_FUNCTIONS)]
+
+        return {
+            "profile_id": self.profile_id,
+            "name": self.name,
+            "tags": self.tags,
+            "started_at": self._started_at,
+            "duration_ms": round(duration_ms, 1),
+            "interval_ms": self.profiler.interval_ms,
+            "samples": samples,
+            "threads": dict(threads),
+            "top_self": top(own) if samples else [],
+            "top_cumulative": top(cumulative) if samples else [],
+            "allocations": allocations,
+        }
+
+    def collapsed(self) -> str:
+        """Collapsed-stack text (flamegraph.pl / speedscope input)"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class Profiler:
+    """Decides which runs are profiled and writes their output"""
+
+    def __init__(self, out_dir: str = None, interval_ms: float = None, sample_rate: float = None,
+                 allocations: bool = None):
+        self.out_dir = out_dir or os.getenv("PROFILE_DIR", "data/profiles")
+        self.interval_ms = interval_ms or float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+        self.sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0")) if sample_rate is None else sample_rate
+        if allocations is None:
+            allocations = os.getenv("PROFILE_ALLOCATIONS", "false").lower() == "true"
+        self.allocations = allocations
+        self._tracers = 0
+        self._tracing_lock = threading.Lock()
+
+    def should_profile(self, request: Any = None) -> bool:
+        """Profile when the caller asked for it, otherwise for sample_rate of runs"""
+        return requested(request) or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    @contextmanager
+    def profile(self, name: str, enabled: bool = True, **tags):
+        """
+        Profile the block (in the current thread and whatever it hands off through
+        propagate()). Yields the session, or None when not enabled; the session's
+        summary is filled in once the block exits.
+        """
+        if not enabled:
+            yield None
+            return
+        session = ProfileSession(self, name, tags)
+        session.start()
+        try:
+            with session.attached():
+                yield session
+        finally:
+            session.stop()
+
+    def _write(self, session: ProfileSession):
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            base = os.path.join(self.out_dir, session.profile_id)
+            session.summary["collapsed_path"] = f"{base}.collapsed"
+            session.summary["summary_path"] = f"{base}.json"
+            with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+                f.write(session.collapsed())
+            with open(f"{base}.json", "w", encoding="utf-8") as f:
+                json.dump(session.summary, f, indent=2, default=str)
+            audit_logger.log_action(
+                agent_name="Profiler",
+                action="profile",
+                input_data={"name": session.name, **session.tags},
+                output_data={
+                    **{key: session.summary[key] for key in (
+                        "profile_id", "duration_ms", "samples", "collapsed_path", "summary_path")},
+                    "top_self": session.summary["top_self"][:5]
+                },
+                confidence=1.0
+            )
+        except Exception as e:
+            print(f"Profile write error: {e}")
+
+    def _start_tracing(self) -> bool:
+        with self._tracing_lock:
+            if self._tracers == 0 and tracemalloc.is_tracing():
+                return False  # someone else is tracing; leave it alone
+            if self._tracers == 0:
+                tracemalloc.start()
+            self._tracers += 1
+            return True
+
+    def _stop_tracing(self):
+        with self._tracing_lock:
+            self._tracers -= 1
+            if self._tracers == 0:
+                tracemalloc.stop()
+
+
+# Global profiler instance
+profiler = Profiler()
+
+
+if __name__ == "__main__":
+    from app.agents.rag_system import AgenticRAGSystem
+
+    query = " ".join(sys.argv[1:]) or "Why was invoice INV-1023 flagged?"
+    rag = AgenticRAGSystem()
+    with profiler.profile("startup"):
+        rag.vector_store.setup_vector_stores()
+    with profiler.profile("process_query", query=query) as session:
+        rag.process_query(query)
+    print(json.dumps({key: session.summary[key] for key in (
+        "profile_id", "duration_ms", "samples", "threads", "collapsed_path")}, indent=2))
+    for row in session.summary["top_cumulative"][:10]:
+        print(f"{row['percent']:5.1f}%  {row['function']}")
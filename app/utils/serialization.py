@@ -0,0 +1,47 @@
+import json
+from typing import Any, Dict, Iterable, Optional
+
+try:
+    import orjson
+except ImportError:  # optional: stdlib json is used when orjson is not installed
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+# Named field sets a client can ask for instead of listing fields
+FIELD_PRESETS = {
+    "answer": ("session_id", "response", "confidence", "degraded"),
+    "evidence": ("session_id", "response", "confidence", "degraded", "sources"),
+    # Sources and audit trail fetched page by page through the result id
+    "paged": ("session_id", "result_id", "response", "confidence", "degraded"),
+}
+
+
+def dumps(obj: Any) -> bytes:
+    """Serialize internally built results straight to JSON bytes (no model validation)"""
+    if orjson:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def resolve_fields(fields: Optional[Iterable[str]], allowed: Iterable[str]) -> Optional[tuple]:
+    """Expand presets and check names; None means every field. Raises ValueError for unknown names."""
+    if not fields:
+        return None
+    allowed = set(allowed)
+    resolved = []
+    for name in fields:
+        for field in FIELD_PRESETS.get(name, (name,)):
+            if field not in allowed:
+                raise ValueError(f"Unknown field '{field}' (choose from {', '.join(sorted(allowed))} "
+                                 f"or presets {', '.join(FIELD_PRESETS)})")
+            if field not in resolved:
+                resolved.append(field)
+    return tuple(resolved)
+
+
+def project(result: Dict[str, Any], fields: Optional[tuple]) -> Dict[str, Any]:
+    """Keep only the requested top-level fields"""
+    if fields is None:
+        return result
+    return {field: result[field] for field in fields if field in result}
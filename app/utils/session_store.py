@@ -0,0 +1,101 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+class SessionStore:
+    """
+    Remembers what each conversation last talked about so follow-ups like
+    "Approve it" can be resolved without running retrieval again.
+
+    Sessions hold only document ids (the documents themselves live in the
+    vector store manager), are evicted least-recently-used first, expire after
+    `ttl_seconds` of inactivity and are bounded by both count and approximate bytes.
+    """
+
+    MAX_RETRIEVED_IDS = 10
+
+    def __init__(self, max_sessions: int = 50000, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 1800):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # session_id -> (expires_at, size, context)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    @property
+    def memory_usage(self) -> int:
+        """Approximate bytes held by all sessions"""
+        return self._bytes
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Return the session context, refreshing its LRU position and TTL"""
+        if not session_id:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, size, context = entry
+            if expires_at <= now:
+                self._evict(session_id)
+                return None
+            self._sessions[session_id] = (now + self.ttl_seconds, size, context)
+            self._sessions.move_to_end(session_id)
+            return dict(context)
+
+    def update(self, session_id: str, **fields):
+        """Merge fields into the session context (None values are ignored)"""
+        if not session_id:
+            return
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            context = dict(entry[2]) if entry and entry[0] > now else {}
+            if entry:
+                self._evict(session_id)
+            context.update({key: value for key, value in fields.items() if value is not None})
+            if "retrieved_ids" in context:
+                context["retrieved_ids"] = tuple(context["retrieved_ids"][:self.MAX_RETRIEVED_IDS])
+            context["updated_at"] = time.time()
+            size = self._estimate_size(session_id, context)
+            self._sessions[session_id] = (now + self.ttl_seconds, size, context)
+            self._bytes += size
+            self._enforce_limits(now)
+
+    def clear(self, session_id: str):
+        """Forget a session"""
+        with self._lock:
+            if session_id in self._sessions:
+                self._evict(session_id)
+
+    def _evict(self, session_id: str):
+        _, size, _ = self._sessions.pop(session_id)
+        self._bytes -= size
+
+    def _enforce_limits(self, now: float):
+        # Least recently used sessions sit at the front and, since every access
+        # pushes the expiry out by the same TTL, they also expire first
+        while self._sessions:
+            session_id, (expires_at, _, _) = next(iter(self._sessions.items()))
+            over_capacity = len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            if expires_at > now and not over_capacity:
+                break
+            self._evict(session_id)
+
+    @staticmethod
+    def _estimate_size(session_id: str, context: Dict[str, Any]) -> int:
+        size = sys.getsizeof(session_id) + sys.getsizeof(context)
+        for key, value in context.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+            if isinstance(value, (list, tuple)):
+                size += sum(sys.getsizeof(item) for item in value)
+        return size
+
+# Global session store instance
+session_store = SessionStore()
@@ -0,0 +1,58 @@
+import threading
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution: the first
+    caller (the leader) runs the function, callers arriving while it is in
+    flight wait for it and receive the same result (or exception). A caller
+    that cannot wait past its own deadline runs the function itself once its
+    timeout is up. Nothing is cached once the call completes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, str]:
+        """
+        Return (result, role): "leader" for the caller that ran fn for the
+        flight, "follower" for one that received the leader's result, and
+        "fallback" for a follower that gave up after `timeout` seconds (None:
+        wait until the leader finishes) and ran fn on its own, outside the flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                return fn(), "fallback"
+            if call.error is not None:
+                raise call.error
+            return call.result, "follower"
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, "leader"
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,173 @@
+"""
+Data access for the Streamlit dashboard.
+
+With BACKEND_URL set (as in docker-compose) the dashboard is a thin client of
+the FastAPI backend: one pooled requests.Session, streamed answers from
+/query/stream, and sources and audit logs fetched a page at a time through
+cursors. Without it, LocalClient runs the pipeline in the Streamlit process
+behind the same interface, as the dashboard always has for local development.
+"""
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+SOURCES_PAGE_SIZE = 5
+AUDIT_PAGE_SIZE = 20
+
+
+class PageCache:
+    """
+    LRU of fetched pages. A page addressed by a cursor (or belonging to a
+    stored query result) never changes and stays until evicted; the first page
+    of a live list such as the audit log expires after `head_ttl_seconds`.
+    """
+
+    def __init__(self, max_pages: int = 512, head_ttl_seconds: float = 5.0):
+        self.max_pages = max_pages
+        self.head_ttl_seconds = head_ttl_seconds
+        self._pages = OrderedDict()  # key -> (expires_at or None, page)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                del self._pages[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Tuple, page: Dict[str, Any], immutable: bool):
+        expires_at = None if immutable else time.monotonic() + self.head_ttl_seconds
+        with self._lock:
+            self._pages[key] = (expires_at, page)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "pages": len(self._pages)}
+
+
+class BackendClient:
+    """FastAPI backend over one pooled, keep-alive HTTP session (idempotent GETs are retried)"""
+
+    mode = "backend"
+
+    def __init__(self, base_url: str, pool_size: int = 10, timeout: float = 30.0, cache: PageCache = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.cache = cache or PageCache()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504),
+                              allowed_methods=frozenset({"GET"}))
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def health(self) -> Dict[str, Any]:
+        response = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def stream_query(self, query: str, session_id: str = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """(event, data) pairs from /query/stream as the backend sends them"""
+        with self.session.post(f"{self.base_url}/query/stream", json={"query": query, "session_id": session_id},
+                               stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            event, data = None, []
+            # Decoded here: without a charset in the content type requests would assume Latin-1
+            for line in (raw.decode("utf-8") for raw in response.iter_lines()):
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    data.append(line[len("data: "):])
+                elif not line and event:
+                    payload = json.loads("\n".join(data))
+                    if event == "error":
+                        raise RuntimeError(payload.get("detail", "Backend error"))
+                    yield event, payload
+                    event, data = None, []
+
+    def sources_page(self, result_id: str, cursor: str = None, limit: int = SOURCES_PAGE_SIZE) -> Dict[str, Any]:
+        return self._page(f"/results/{result_id}/sources", {"cursor": cursor, "limit": limit}, immutable=True)
+
+    def result_audit_page(self, result_id: str, cursor: str = None, limit: int = AUDIT_PAGE_SIZE) -> Dict[str, Any]:
+        return self._page(f"/results/{result_id}/audit", {"cursor": cursor, "limit": limit}, immutable=True)
+
+    def audit_page(self, cursor: str = None, limit: int = AUDIT_PAGE_SIZE, session_id: str = None) -> Dict[str, Any]:
+        # Older pages of the append-only log are fixed; only the newest page can change
+        return self._page("/audit-logs/page", {"cursor": cursor, "limit": limit, "session_id": session_id},
+                          immutable=cursor is not None)
+
+    def _page(self, path: str, params: Dict[str, Any], immutable: bool) -> Dict[str, Any]:
+        params = {name: value for name, value in params.items() if value is not None}
+        key = (path,) + tuple(sorted(params.items()))
+        page = self.cache.get(key)
+        if page is None:
+            response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+            response.raise_for_status()
+            page = response.json()
+            self.cache.put(key, page, immutable)
+        return page
+
+
+class LocalClient:
+    """The pipeline in this process, behind the BackendClient interface"""
+
+    mode = "local"
+
+    def __init__(self, rag):
+        from app.utils.audit import audit_logger
+        from app.utils.pagination import result_store
+
+        self.rag = rag
+        self.audit_logger = audit_logger
+        self.result_store = result_store
+
+    def health(self) -> Dict[str, Any]:
+        return {"status": "healthy", "components": {"vector_store": "operational", "sessions": len(self.rag.sessions)}}
+
+    def stream_query(self, query: str, session_id: str = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for event, data in self.rag.stream_query(query, session_id=session_id):
+            if event == "done":
+                # Same closing event as /query/stream
+                data = {
+                    "session_id": session_id,
+                    "result_id": self.result_store.put(data),
+                    "confidence": data["confidence"],
+                    "source_count": len(data["sources"]),
+                    "audit_log": data["audit_log"],
+                    "degraded": data["degraded"]
+                }
+            yield event, data
+
+    def sources_page(self, result_id: str, cursor: str = None, limit: int = SOURCES_PAGE_SIZE) -> Dict[str, Any]:
+        return self.result_store.page(result_id, "sources", cursor, limit)
+
+    def result_audit_page(self, result_id: str, cursor: str = None, limit: int = AUDIT_PAGE_SIZE) -> Dict[str, Any]:
+        return self.result_store.page(result_id, "audit_log", cursor, limit)
+
+    def audit_page(self, cursor: str = None, limit: int = AUDIT_PAGE_SIZE, session_id: str = None) -> Dict[str, Any]:
+        return self.audit_logger.read_page(cursor, limit, session_id)
+
+
+def backend_url() -> Optional[str]:
+    """BACKEND_URL when the dashboard should talk to the API instead of loading the pipeline itself"""
+    return os.getenv("BACKEND_URL") or None
@@ -2,16 +2,51 @@ import streamlit as st
 import json
 import sys
 import os
+import uuid
 
 # Add the parent directory to Python path so we can import our modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.agents.rag_system import AgenticRAGSystem
+from frontend.dashboard_client import (
+    AUDIT_PAGE_SIZE, SOURCES_PAGE_SIZE, BackendClient, LocalClient, backend_url
+)
 
-# Initialize the RAG system
+# One client per Streamlit server: with BACKEND_URL a pooled HTTP client, otherwise the in-process pipeline
 @st.cache_resource
-def load_rag_system():
-    return AgenticRAGSystem()
+def load_client():
+    if backend_url():
+        return BackendClient(backend_url())
+    from app.agents.rag_system import AgenticRAGSystem
+    return LocalClient(AgenticRAGSystem())
+
+def paged(key: str, fetch):
+    """
+    Render controls for a cursor-paginated list and return the current page.
+    The cursors of the pages already visited are kept so "Previous" needs no offset arithmetic.
+    """
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    try:
+        page = fetch(cursors[-1])
+    except Exception as e:
+        # e.g. the result expired on the backend; the next query starts a fresh one
+        st.warning(f"Could not load this page: {e}")
+        return {"items": [], "next_cursor": None}
+    prev_col, info_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        st.button("◀ Previous", key=f"{key}_prev", disabled=len(cursors) == 1,
+                  on_click=lambda: cursors.pop())
+    with info_col:
+        shown = len(page["items"])
+        total = f" of {page['total']}" if "total" in page else ""
+        st.caption(f"Page {len(cursors)} · {shown} shown{total}")
+    with next_col:
+        st.button("Next ▶", key=f"{key}_next", disabled=page["next_cursor"] is None,
+                  on_click=lambda: cursors.append(page["next_cursor"]))
+    return page
+
+def reset_pages(*keys: str):
+    for key in keys:
+        st.session_state[f"{key}_cursors"] = [None]
 
 def main():
     st.set_page_config(page_title="Agentic RAG Invoice Matcher", layout="wide")
@@ -20,14 +55,26 @@ def main():
     st.markdown("*AI-powered invoice and PO matching system with audit logging*")
     
     # Initialize system
-    rag = load_rag_system()
+    client = load_client()
+    
+    # One session per browser tab so follow-ups like "Approve it" have context
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
     
     # Sidebar for system info
     with st.sidebar:
         st.header("📊 System Status")
-        st.success("✅ Vector Store: Ready")
-        st.success("✅ Local Embeddings: Loaded")
-        st.success("✅ Rule-based LLM: Active")
+        if client.mode == "backend":
+            try:
+                health = client.health()
+                st.success(f"✅ Backend: {health['components']['vector_store']}")
+            except Exception as e:
+                st.error(f"❌ Backend unreachable: {e}")
+            st.caption(f"API: {client.base_url}")
+        else:
+            st.success("✅ Vector Store: Ready")
+            st.success("✅ Local Embeddings: Loaded")
+            st.success("✅ Rule-based LLM: Active")
         
         st.header("🔍 Sample Queries")
         sample_queries = [
@@ -56,27 +103,46 @@ def main():
         
         if st.button("🔍 Process Query", type="primary"):
             if query:
-                with st.spinner("Processing query..."):
-                    try:
-                        # Process the query
-                        result = rag.process_query(query)
-                        
-                        # Display response
-                        st.subheader("📝 Response")
-                        st.markdown(result['response'])
-                        
-                        # Display metrics
-                        col_conf, col_sources = st.columns(2)
-                        with col_conf:
-                            st.metric("Confidence", f"{result['confidence']:.1%}")
-                        with col_sources:
-                            st.metric("Sources Found", len(result['sources']))
-                        
-                        # Store in session for audit log
-                        st.session_state.last_result = result
-                        
-                    except Exception as e:
-                        st.error(f"Error processing query: {e}")
+                # Render each pipeline stage as soon as it finishes
+                status = st.status("Planning query...", expanded=True)
+                evidence_area = status.container()
+                answer_area = st.empty()
+                try:
+                    for event, data in client.stream_query(query, session_id=st.session_state.session_id):
+                        if event == "plan":
+                            status.update(label="Retrieving evidence...")
+                            evidence_area.write(f"**Plan:** {data['reasoning']} → {', '.join(data['actions'])}")
+                        elif event == "evidence":
+                            meta = data['metadata']
+                            evidence_area.write(
+                                f"📄 {meta.get('type', 'document').title()} {meta.get('id', '')} - "
+                                f"{meta.get('vendor', 'Unknown')} (${meta.get('amount', 'Unknown')}) - {meta.get('status', 'Unknown')}"
+                            )
+                        elif event == "verification":
+                            status.update(label="Writing answer...")
+                            evidence_area.write(f"**Verification:** confidence {data['confidence']:.1%} from {data['evidence_count']} documents")
+                        elif event == "answer":
+                            with answer_area.container():
+                                st.subheader("📝 Response")
+                                st.markdown(data['response'])
+                        elif event == "done":
+                            status.update(label="Done", state="complete", expanded=False)
+                            result = data
+                    
+                    # Display metrics
+                    col_conf, col_sources = st.columns(2)
+                    with col_conf:
+                        st.metric("Confidence", f"{result['confidence']:.1%}")
+                    with col_sources:
+                        st.metric("Sources Found", result['source_count'])
+                    
+                    # Store in session for audit log; sources and audit rows are fetched page by page
+                    st.session_state.last_result = result
+                    reset_pages("sources", "pipeline_audit", "audit_log")
+                    
+                except Exception as e:
+                    status.update(label="Failed", state="error")
+                    st.error(f"Error processing query: {e}")
     
     with col2:
         st.header("📋 Retrieved Sources")
@@ -84,9 +150,11 @@ def main():
         if 'last_result' in st.session_state:
             result = st.session_state.last_result
             
-            # Show sources
-            if result['sources']:
-                for i, source in enumerate(result['sources'][:3]):
+            # Show one page of sources
+            if result['source_count']:
+                page = paged("sources", lambda cursor: client.sources_page(result['result_id'], cursor,
+                                                                          SOURCES_PAGE_SIZE))
+                for i, source in enumerate(page['items']):
                     with st.expander(f"📄 {source.get('type', 'document').title()} {source.get('id', f'#{i+1}')}"):
                         st.write(f"**Vendor:** {source.get('vendor', 'Unknown')}")
                         st.write(f"**Amount:** ${source.get('amount', 'Unknown')}")
@@ -100,9 +168,11 @@ def main():
         
         result = st.session_state.last_result
         
-        # Show audit log
+        # Show this query's pipeline steps, a page at a time
+        page = paged("pipeline_audit", lambda cursor: client.result_audit_page(result['result_id'], cursor,
+                                                                               AUDIT_PAGE_SIZE))
         audit_data = []
-        for log_entry in result['audit_log']:
+        for log_entry in page['items']:
             audit_data.append({
                 "Step": log_entry['step'].replace('_', ' ').title(),
                 "Timestamp": log_entry['timestamp'],
@@ -112,6 +182,16 @@ def main():
         if audit_data:
             st.dataframe(audit_data, use_container_width=True)
         
+        # Persisted audit log of every agent, newest first
+        with st.expander("🗂️ Recent Audit Log"):
+            page = paged("audit_log", lambda cursor: client.audit_page(cursor, AUDIT_PAGE_SIZE))
+            st.dataframe([{
+                "Timestamp": entry['timestamp'],
+                "Agent": entry['agent_name'],
+                "Action": entry['action'],
+                "Confidence": entry['confidence']
+            } for entry in page['items']], use_container_width=True)
+        
         # Show raw JSON (collapsible)
         with st.expander("🔧 Raw Response JSON"):
             st.json(result)
@@ -0,0 +1,36 @@
+from app.data.anomaly import AnomalyScorer
+import json
+
+def make_invoice(number, amount, vendor="TechCorp"):
+    return {"invoice_id": f"INV-{number}", "vendor": vendor, "po_number": None, "total_amount": amount}
+
+def test_planted_outlier():
+    # 9 ordinary invoices: with the outlier counted in its own statistics |z| could not exceed 2.67
+    invoices = [make_invoice(1000 + i, 1000 + 25 * i) for i in range(8)]
+    invoices.append(make_invoice(1099, 100000))
+    scorer = AnomalyScorer()
+    scorer.update(invoices, {})
+    
+    outlier = scorer.get("INV-1099")
+    assert outlier["anomalous"], outlier
+    assert outlier["score"] >= scorer.threshold
+    assert [result["invoice_id"] for result in scorer.top(5)] == ["INV-1099"]
+    assert not any(scorer.get(item["invoice_id"])["anomalous"] for item in invoices[:-1])
+
+def test_mock_corpus():
+    with open("data/invoices/mock_invoices.json") as f:
+        invoices = json.load(f)
+    with open("data/pos/mock_pos.json") as f:
+        pos = {po["po_number"]: po for po in json.load(f)}
+    scorer = AnomalyScorer()
+    scorer.update(invoices, pos)
+    
+    # INV-1033 (343.99 against TechCorp's usual ~5,600) is the mock corpus's most unusual amount
+    top = scorer.top(5)
+    assert top[0]["invoice_id"] == "INV-1033", top
+    assert top[0]["anomalous"]
+    assert any(reason.startswith("Amount 343.99") for reason in top[0]["reasons"]), top[0]["reasons"]
+
+if __name__ == "__main__":
+    test_planted_outlier()
+    test_mock_corpus()
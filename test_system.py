@@ -1,8 +1,20 @@
 from app.agents.rag_system import AgenticRAGSystem
+from app.data.vector_store import VectorStoreManager
+from app.data.verification_store import VerificationStore
 import json
+import os
+import tempfile
 
 def test_queries():
-    rag = AgenticRAGSystem()
+    # "Approve it" is durable: the demo gets its own index, verdicts and approvals log, never data/
+    workdir = tempfile.mkdtemp()
+    rag = AgenticRAGSystem(
+        vector_store=VectorStoreManager(persist_directory=os.path.join(workdir, "chroma_db")),
+        verification_store=VerificationStore(os.path.join(workdir, "verification.db")),
+        approvals_wal_path=os.path.join(workdir, "approvals.wal")
+    )
+    rag.vector_store.setup_vector_stores(snapshot_path=False)
+    session_id = "test-session"
     
     test_queries = [
         "Why was invoice INV-1023 flagged?",
@@ -15,7 +27,7 @@ def test_queries():
         print(f"Query: {query}")
         print('='*50)
         
-        result = rag.process_query(query)
+        result = rag.process_query(query, session_id=session_id)
         print(f"Response: {result['response']}")
         print(f"Confidence: {result['confidence']}")
         print(f"Sources: {len(result['sources'])} documents")